@@ -0,0 +1,202 @@
+"""
+Async variant of 'operations.py', used by the endpoints of main.py: only the
+blocking storage calls leave the event loop.
+"""
+
+import asyncio
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Optional
+
+from pydantic import BaseModel
+
+import operations
+from models import Task, TaskWithID, TaskV2WithID
+
+
+# Size of the executor running the storage calls, which bounds the number of
+# threads touching the files whatever the number of clients, e.g.:
+#   $ TASKS_IO_WORKERS=16 uvicorn main:app
+IO_WORKERS = int(os.getenv("TASKS_IO_WORKERS", "8"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+# asyncio primitives belong to one event loop (a test client starts a new one
+# per client), so the writer lock and the running reads are kept per loop.
+_writer_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+    weakref.WeakKeyDictionary()
+)
+_running_reads: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+    weakref.WeakKeyDictionary()
+)
+
+# Number of writes completed by this process. It is part of the key of the
+# coalesced reads: a read started after a write never joins a read started
+# before it, so it always sees that write.
+_writes = 0
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=IO_WORKERS, thread_name_prefix="task-io"
+        )
+    return _executor
+
+
+def shutdown():
+    # Called when the application stops; a new executor is created on demand.
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def run_in_executor(function: Callable, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), partial(function, *args, **kwargs)
+    )
+
+
+def _writer_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _writer_locks.get(loop)
+    if lock is None:
+        lock = _writer_locks[loop] = asyncio.Lock()
+    return lock
+
+
+async def _read(function: Callable, *args):
+    # Run 'function(*args)' in the executor, unless the same call is already
+    # running: then wait for it and share its result. The results are lists of
+    # models that nobody modifies, so sharing them is safe.
+    loop = asyncio.get_running_loop()
+    running = _running_reads.setdefault(loop, {})
+    key = (function, args, _writes)
+    future = running.get(key)
+    if future is None:
+        future = asyncio.ensure_future(run_in_executor(function, *args))
+        running[key] = future
+        future.add_done_callback(lambda _: running.pop(key, None))
+    # shield(): a client going away cancels its own wait, not the shared read.
+    return await asyncio.shield(future)
+
+
+async def _write(function: Callable, *args):
+    # Writers queue up on an asyncio lock, as cheap coroutines, instead of
+    # each blocking an executor thread on the lock of the store.
+    global _writes
+    async with _writer_lock():
+        try:
+            return await run_in_executor(function, *args)
+        finally:
+            _writes += 1
+
+
+async def read_all_tasks() -> list[TaskWithID]:
+    return await _read(operations.read_all_tasks)
+
+
+async def filter_tasks(
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    model: type[BaseModel] = TaskWithID,
+) -> list[BaseModel]:
+    return await _read(operations.filter_tasks, status, title, model)
+
+
+async def read_tasks_page(
+    model: type[BaseModel] = TaskWithID,
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> list[BaseModel]:
+    return await _read(
+        operations.read_tasks_page, model, status, title, after, limit
+    )
+
+
+async def iter_tasks(
+    model: type[BaseModel] = TaskWithID,
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[BaseModel]:
+    # Same walk as operations.iter_tasks, each page being read in the
+    # executor while the event loop keeps serving the other clients.
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch_size = (
+            operations.STREAM_BATCH_SIZE
+            if remaining is None
+            else min(remaining, operations.STREAM_BATCH_SIZE)
+        )
+        tasks = await read_tasks_page(
+            model, status, title, after=after, limit=batch_size
+        )
+        for task in tasks:
+            yield task
+        if len(tasks) < batch_size:
+            return
+        after = tasks[-1].id
+        if remaining is not None:
+            remaining -= len(tasks)
+
+
+async def search_tasks_by_keyword(
+    keyword: str,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> list[TaskWithID]:
+    return await _read(
+        operations.search_tasks_by_keyword, keyword, limit, offset
+    )
+
+
+async def read_task(task_id) -> Optional[TaskWithID]:
+    return await _read(operations.read_task, task_id)
+
+
+async def create_task(task: Task) -> TaskWithID:
+    return await _write(operations.create_task, task)
+
+
+async def create_tasks(tasks: list[Task]) -> list[TaskWithID]:
+    return await _write(operations.create_tasks, tasks)
+
+
+async def modify_task(id: int, task: dict) -> Optional[TaskWithID]:
+    return await _write(operations.modify_task, id, task)
+
+
+async def modify_tasks(
+    updates: list[tuple[int, dict]]
+) -> list[Optional[TaskWithID]]:
+    return await _write(operations.modify_tasks, updates)
+
+
+async def remove_task(id: int) -> Optional[Task]:
+    return await _write(operations.remove_task, id)
+
+
+async def remove_tasks(ids: list[int]) -> list[Optional[Task]]:
+    return await _write(operations.remove_tasks, ids)
+
+
+async def read_version() -> str:
+    return await _read(operations.read_version)
+
+
+async def read_changes(
+    since: Optional[str] = None, model: type[BaseModel] = TaskWithID
+) -> tuple[str, list[BaseModel], list[int], bool]:
+    return await _read(operations.read_changes, since, model)
+
+
+async def read_all_tasks_v2() -> list[TaskV2WithID]:
+    return await _read(operations.read_all_tasks_v2)
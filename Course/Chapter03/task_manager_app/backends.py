@@ -0,0 +1,39 @@
+import threading
+
+from snapshot import SnapshotTaskStore
+from sqlite_store import SQLiteTaskStore
+from store import MemoryTaskStore, TaskBackend, get_task_store
+
+# Storage backends of the task table, selected by name:
+# - "csv": the CSV file with an in-memory copy (store.TaskStore), the default.
+# - "memory": in-memory only, nothing is persisted (store.MemoryTaskStore).
+# - "sqlite": a SQLite database in WAL mode (sqlite_store.SQLiteTaskStore).
+# - "snapshot": a read-only snapshot file (snapshot.SnapshotTaskStore).
+BACKENDS = ("csv", "memory", "sqlite", "snapshot")
+
+_backends: dict[tuple[str, str], TaskBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str, filename: str) -> TaskBackend:
+    # One backend instance per (name, file), shared by every request, and
+    # refreshed if its file changed since the last one.
+    if name == "csv":
+        return get_task_store(filename)
+    with _backends_lock:
+        backend = _backends.get((name, filename))
+        if backend is None:
+            if name == "memory":
+                backend = MemoryTaskStore()
+            elif name == "sqlite":
+                backend = SQLiteTaskStore(filename)
+            elif name == "snapshot":
+                backend = SnapshotTaskStore(filename)
+            else:
+                raise ValueError(
+                    f"unknown storage backend {name!r}, "
+                    f"expected one of {', '.join(BACKENDS)}"
+                )
+            _backends[(name, filename)] = backend
+    backend.refresh()
+    return backend
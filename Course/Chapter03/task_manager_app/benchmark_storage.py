@@ -0,0 +1,128 @@
+"""
+Throughput and p50/p99 latencies of the same workload on every storage backend
+of the task table, each working on its own files in a temporary folder:
+
+    $ python benchmark_storage.py --tasks 100000 --operations 2000 --backends csv sqlite
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from backends import BACKENDS, get_backend
+from snapshot import write_snapshot
+
+
+STATUSES = ["Incomplete", "Ongoing", "Finished", "Ready"]
+WORDS = [
+    "buy", "milk", "pizza", "call", "mom", "write", "report",
+    "fix", "bug", "review", "code", "plan", "trip", "book",
+]
+
+
+def random_task(rng: random.Random) -> dict:
+    return {
+        "title": " ".join(rng.choices(WORDS, k=3)),
+        "description": " ".join(rng.choices(WORDS, k=8)),
+        "status": rng.choice(STATUSES),
+    }
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    if len(latencies) == 1:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100)[percent - 1]
+
+
+def run_workload(
+    backend, tasks: int, operations: int, seed: int, writes: bool = True
+):
+    rng = random.Random(seed)
+    ids = list(range(1, tasks + 1))
+    workload = {
+        "point read": lambda: backend.get(rng.choice(ids)),
+        "filtered list": lambda: backend.page(
+            status=rng.choice(STATUSES), limit=100
+        ),
+        "search": lambda: backend.search(rng.choice(WORDS), limit=20),
+        "update": lambda: backend.update(
+            rng.choice(ids), {"status": rng.choice(STATUSES)}
+        ),
+    }
+    if not writes:
+        del workload["update"]
+    results = {}
+    for name, operation in workload.items():
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(operations):
+            start = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        results[name] = (
+            operations / elapsed,
+            percentile(latencies, 50),
+            percentile(latencies, 99),
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the storage backends of the task table."
+    )
+    parser.add_argument("--tasks", type=int, default=10_000)
+    parser.add_argument("--operations", type=int, default=1_000)
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS)
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    arguments = parser.parse_args()
+
+    print(
+        f"{'backend':<8} {'operation':<14} {'ops/s':>10} "
+        f"{'p50 (ms)':>10} {'p99 (ms)':>10}"
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        for name in arguments.backends:
+            filename = str(Path(folder) / f"tasks.{name}")
+            rng = random.Random(arguments.seed)
+            started = time.perf_counter()
+            if name == "snapshot":
+                # Read-only: the snapshot is written in one go, then opened.
+                write_snapshot(
+                    (
+                        {**random_task(rng), "id": task_id}
+                        for task_id in range(1, arguments.tasks + 1)
+                    ),
+                    filename,
+                )
+                backend = get_backend(name, filename)
+            else:
+                backend = get_backend(name, filename)
+                for _ in range(arguments.tasks):
+                    backend.create(random_task(rng))
+            print(
+                f"{name:<8} {'load':<14} "
+                f"{arguments.tasks / (time.perf_counter() - started):>10.0f}"
+            )
+            results = run_workload(
+                backend,
+                arguments.tasks,
+                arguments.operations,
+                arguments.seed,
+                writes=name != "snapshot",
+            )
+            for operation, (throughput, p50, p99) in results.items():
+                print(
+                    f"{name:<8} {operation:<14} {throughput:>10.0f} "
+                    f"{p50 * 1000:>10.3f} {p99 * 1000:>10.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ from unittest.mock import patch
 
 import pytest
 
+from main import rate_limit_store
+from store import epoch_filename, journal_filename, lock_filename
+
 TEST_DATABASE_FILE = "test_tasks.csv"
 
 # Define the initial raw data for the CSV file.
@@ -69,3 +72,19 @@ def create_test_database():
         # Teardown phase: This code runs after the test finishes (whether it passed or failed).
         # We remove the temporary CSV file to ensure no side effects persist for subsequent tests.
         os.remove(database_file_location)
+        # Updates and deletes are stored in a journal next to the CSV file, writes are
+        # synchronized through a lock file: remove them as well.
+        for filename in (
+            journal_filename(database_file_location),
+            lock_filename(database_file_location),
+            epoch_filename(database_file_location),
+        ):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+# Each test starts with empty rate limit counters: the requests of the previous
+# tests, all made from the same client, must not use up its quota.
+@pytest.fixture(autouse=True)
+def clear_rate_limits():
+    rate_limit_store.clear()
+    yield
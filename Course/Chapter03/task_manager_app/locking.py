@@ -0,0 +1,142 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# 'fcntl' only exists on Unix. Elsewhere, the lock only protects the threads of
+# a single process, which is enough for a server started with one worker.
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# Reader/writer lock for the threads of one process.
+# Any number of threads can read at the same time, while a writer gets exclusive
+# access. Waiting writers have priority over new readers, so a steady flow of
+# reads cannot starve them. The thread holding the write lock can take it again
+# (or take the read lock) without blocking itself.
+class ReadWriteLock:
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def owned(self) -> bool:
+        return self._writer == threading.get_ident()
+
+    @contextmanager
+    def read(self):
+        if self.owned():
+            yield
+            return
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+            else:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+                self._writer_depth = 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+# Advisory lock on a file, shared by all the processes using it
+# (e.g. the workers started by 'uvicorn main:app --workers 4').
+class FileLock:
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    @contextmanager
+    def acquire(self, exclusive: bool = True):
+        if fcntl is None:
+            yield
+            return
+        with open(self.filename, "a") as lockfile:
+            fcntl.flock(
+                lockfile.fileno(),
+                fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH,
+            )
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+
+# Lock protecting a file-backed store in memory and on disk.
+# - read(): the in-memory data is not modified while it is held.
+# - sync(): exclusive in memory, shared on disk, to load what other
+#   processes wrote to the files.
+# - write(): exclusive both in memory and on disk, to modify the files.
+class StorageLock:
+    def __init__(self, filename: str):
+        self._threads = ReadWriteLock()
+        self._file = FileLock(filename)
+        self._file_held = False
+
+    def read(self):
+        return self._threads.read()
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._threads.write():
+            if self._file_held:
+                # Nested call of the thread already holding the file lock.
+                yield
+                return
+            with self._file.acquire(exclusive=exclusive):
+                self._file_held = True
+                try:
+                    yield
+                finally:
+                    self._file_held = False
+
+    def sync(self):
+        return self._locked(exclusive=False)
+
+    def write(self):
+        return self._locked(exclusive=True)
+
+
+@contextmanager
+def atomic_write(filename: str, mode: str = "w", newline=None):
+    # Write into a temporary file in the same directory and move it over the
+    # target with os.replace(), which is atomic: readers see either the old
+    # file or the complete new one, never a truncated or half-written file.
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(
+            temporary_filename, mode, newline=newline
+        ) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
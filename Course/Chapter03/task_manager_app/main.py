@@ -1,18 +1,50 @@
-from typing import Optional
+import os
+from contextlib import asynccontextmanager
+from functools import cache
+from typing import Literal, Optional
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
 from fastapi.openapi.utils import get_openapi
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 from models import Task, TaskV2WithID, TaskWithID
-from operations import (
+from rate_limit import (
+    RateLimit,
+    RateLimitMiddleware,
+    SlidingWindow,
+    TokenBucket,
+    by_ip,
+    create_rate_limit_store,
+    first_of,
+    parse_rate,
+)
+import async_operations
+import operations
+from async_operations import (
     create_task,
+    create_tasks,
+    filter_tasks,
+    iter_tasks,
     modify_task,
-    read_all_tasks,
-    read_all_tasks_v2,
+    modify_tasks,
+    read_changes,
     read_task,
+    read_tasks_page,
+    read_version,
     remove_task,
+    remove_tasks,
+    search_tasks_by_keyword,
 )
 from security import (
     User,
@@ -21,7 +53,9 @@ from security import (
     fake_users_db,
     fakely_hash_password,
     get_user_from_token,
+    token_cache,
 )
+from snapshot import ReadOnlyStoreError
 
 # To hide the /token endpoint from the OpenAPI schema
 def custom_openapi():
@@ -37,46 +71,215 @@ def custom_openapi():
     app.openapi_schema = openapi_schema
     return app.openapi_schema
 
+# Load the CSV database into the in-memory store once, when the server starts,
+# instead of paying the parsing cost on the first request.
+# The task endpoints are 'async def': their storage calls run in the executor of
+# async_operations.py instead of Starlette's threadpool, which is shut down here.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await async_operations.run_in_executor(operations.get_store)
+    yield
+    async_operations.shutdown()
+
 # To run this app, use the command: $ uvicorn main:app --reload
 app = FastAPI(
     title="Task Manager API",
     description="This is a task management API",
     version="0.1.0",
+    lifespan=lifespan,
 )
 app.openapi = custom_openapi
 
+# Writes to a read-only backend (TASKS_STORAGE_BACKEND=snapshot).
+@app.exception_handler(ReadOnlyStoreError)
+async def read_only_store(request: Request, exc: ReadOnlyStoreError):
+    return JSONResponse(status_code=405, content={"detail": str(exc)})
+
+# Admission control, before any endpoint runs (see rate_limit.py): /token
+# accepts RATE_LIMIT_LOGIN requests per IP, and every request takes a token
+# from the bucket of its client (its user, else its IP).
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "20/minute")
+RATE_LIMIT_API = os.getenv("RATE_LIMIT_API", "600/minute")
+RATE_LIMIT_API_BURST = int(os.getenv("RATE_LIMIT_API_BURST", "100"))
+
+
+# The user of a token already resolved (see security.resolve_token()): a
+# made-up token does not get a bucket of its own, it is counted by IP.
+def by_user(scope: dict) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            user = scheme.lower() == "bearer" and token_cache.peek(token)
+            return f"user:{user.username}" if user else None
+
+
+rate_limit_store = create_rate_limit_store()
+app.add_middleware(
+    RateLimitMiddleware,
+    rules=[
+        RateLimit(
+            "login",
+            SlidingWindow(*parse_rate(RATE_LIMIT_LOGIN)),
+            by_ip,
+            paths=("/token",),
+            methods=("POST",),
+        ),
+        RateLimit(
+            "api",
+            TokenBucket(
+                *parse_rate(RATE_LIMIT_API), burst=RATE_LIMIT_API_BURST
+            ),
+            first_of(by_user, by_ip),
+        ),
+    ],
+    store=rate_limit_store,
+)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # 'If-None-Match' holds "*" or a comma-separated list of ETags, which
+    # may be weak (W/"..."): a weak comparison is enough for a GET.
+    if if_none_match is None:
+        return False
+    return any(
+        tag.strip().removeprefix("W/") in (etag, "*")
+        for tag in if_none_match.split(",")
+    )
+
+async def check_etag(if_none_match: Optional[str]) -> str:
+    # Conditional GET: the ETag of a response is the version of the task table,
+    # which every write bumps. When the client already has the current version,
+    # answer 304 Not Modified before reading any task.
+    etag = f'"{await read_version()}"'
+    if etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+    return etag
+
 @app.get("/tasks", response_model=list[TaskWithID])
-def get_tasks(
+async def get_tasks(
     status: Optional[str] = None,
     title: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    if_none_match: Optional[str] = Header(None),
 ):
-    tasks = read_all_tasks()
+    # The store answers both filters from its status/title indexes.
+    # Empty strings mean "no filter", as before.
+    etag = await check_etag(if_none_match)
+    response = await list_tasks(
+        TaskWithID,
+        status=status or None,
+        title=title or None,
+        after=after,
+        limit=limit,
+        fields=fields,
+        format=format,
+    )
+    response.headers["ETag"] = etag
+    return response
 
-    if status:
-        tasks = [
-            task
-            for task in tasks
-            if task.status == status
-        ]
-    if title:
-        tasks = [
-            task for task in tasks if task.title == title
-        ]
+def projected_fields(
+    fields: Optional[str], model: type[BaseModel]
+) -> Optional[set[str]]:
+    # Parse the 'fields' query parameter (e.g. "?fields=title,status").
+    # The id is always returned, since clients need it as pagination cursor.
+    if fields is None:
+        return None
+    selected = {
+        field.strip() for field in fields.split(",") if field.strip()
+    }
+    unknown = selected - set(model.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"unknown fields: {', '.join(sorted(unknown))}",
+        )
+    return selected | {"id"}
+
+@cache
+def list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+def json_tasks(
+    tasks: list[BaseModel],
+    model: type[BaseModel],
+    include: Optional[set[str]] = None,
+    headers: Optional[dict] = None,
+) -> Response:
+    # The tasks come from our own store and were built without validation
+    # (see operations.trusted), so they are serialized straight to JSON bytes
+    # by pydantic-core. Returning a Response skips the validation FastAPI
+    # would otherwise run again against the 'response_model' of the route,
+    # which is kept for the OpenAPI schema.
+    return Response(
+        list_adapter(model).dump_json(
+            tasks,
+            include=None if include is None else {"__all__": include},
+        ),
+        media_type="application/json",
+        headers=headers,
+    )
+
+async def list_tasks(
+    model: type[BaseModel],
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    format: str = "json",
+):
+    # Shared implementation of GET /tasks and GET /v2/tasks.
+    # - 'after' and 'limit' turn on keyset pagination: tasks are sorted by id,
+    #   a page holds at most 'limit' tasks after the id 'after', and the
+    #   'X-Next-Cursor' header gives the 'after' value of the next page.
+    # - 'fields' returns only the listed fields of each task.
+    # - 'format=ndjson' streams one JSON object per line, reading the table
+    #   page by page, so the full list is never built in memory.
+    include = projected_fields(fields, model)
+    if format == "ndjson":
+        tasks = iter_tasks(
+            model, status, title, after=after, limit=limit
+        )
+        return StreamingResponse(
+            (
+                task.model_dump_json(include=include) + "\n"
+                async for task in tasks
+            ),
+            media_type="application/x-ndjson",
+        )
+
+    headers = {}
+    if after is None and limit is None:
+        tasks = await filter_tasks(status, title, model=model)
+    else:
+        tasks = await read_tasks_page(
+            model, status, title, after=after, limit=limit
+        )
+        if limit is not None and len(tasks) == limit:
+            headers["X-Next-Cursor"] = str(tasks[-1].id)
 
-    return tasks
+    return json_tasks(tasks, model, include=include, headers=headers)
 
 @app.get("/task/{task_id}")
-def get_task(task_id: int):
-    task = read_task(task_id)
+async def get_task(
+    task_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+):
+    etag = await check_etag(if_none_match)
+    task = await read_task(task_id)
     if not task:
         raise HTTPException(
             status_code=404, detail="task not found"
         )
+    response.headers["ETag"] = etag
     return task
 
 @app.post("/task", response_model=TaskWithID)
-def add_task(task: Task):
-    return create_task(task)
+async def add_task(task: Task):
+    return await create_task(task)
 
 class UpdateTask(BaseModel):
     title: str | None = None
@@ -84,10 +287,10 @@ class UpdateTask(BaseModel):
     status: str | None = None
 
 @app.put("/task/{task_id}", response_model=TaskWithID)
-def update_task(task_id: int, task_update: UpdateTask):
+async def update_task(task_id: int, task_update: UpdateTask):
     # `exclude_unset=True` turns the Pydantic model into a dictionary that only includes the fields that the 
     # client actually sent, ignoring those with unset default values.
-    modified = modify_task(
+    modified = await modify_task(
         task_id,
         task_update.model_dump(exclude_unset=True),
     )
@@ -99,29 +302,119 @@ def update_task(task_id: int, task_update: UpdateTask):
     return modified
 
 @app.delete("/task/{task_id}", response_model=Task)
-def delete_task(task_id: int):
-    removed_task = remove_task(task_id)
+async def delete_task(task_id: int):
+    removed_task = await remove_task(task_id)
     if not removed_task:
         raise HTTPException(
             status_code=404, detail="task not found"
         )
     return removed_task
 
-@app.get("/tasks/search", response_model=list[TaskWithID])
-def search_tasks(keyword: str):
-    tasks = read_all_tasks()
-    filtered_tasks = [
-        task
-        for task in tasks
-        if keyword.lower()
-        in (task.title + task.description).lower()
+# Largest number of tasks accepted by a single batch request.
+MAX_BATCH_SIZE = 10_000
+
+class BatchUpdateTask(UpdateTask):
+    id: int
+
+class BatchResult(BaseModel):
+    # Outcome of one item of a batch: the task, or why it was not processed.
+    id: int
+    task: Optional[Task] = None
+    error: Optional[str] = None
+
+def batch_results(
+    ids: list[int], tasks: list[Optional[BaseModel]]
+) -> list[BatchResult]:
+    return [
+        BatchResult(id=task_id, task=task)
+        if task
+        else BatchResult(id=task_id, error="task not found")
+        for task_id, task in zip(ids, tasks)
     ]
-    return filtered_tasks
+
+@app.post("/tasks/batch", response_model=list[TaskWithID])
+async def add_tasks(
+    tasks: list[Task] = Body(max_length=MAX_BATCH_SIZE),
+):
+    # All the tasks get consecutive ids, allocated once, and are written to
+    # the database in one pass: importing n tasks costs one request instead of n.
+    return json_tasks(await create_tasks(tasks), TaskWithID)
+
+@app.patch("/tasks/batch", response_model=list[BatchResult])
+async def update_tasks(
+    updates: list[BatchUpdateTask] = Body(max_length=MAX_BATCH_SIZE),
+):
+    # Each item holds the id of a task and the fields to change. Unknown ids
+    # don't fail the whole batch, they get an error in their own result.
+    modified = await modify_tasks(
+        [
+            (update.id, update.model_dump(exclude_unset=True, exclude={"id"}))
+            for update in updates
+        ]
+    )
+    return batch_results([update.id for update in updates], modified)
+
+@app.delete("/tasks/batch", response_model=list[BatchResult])
+async def delete_tasks(
+    ids: list[int] = Body(max_length=MAX_BATCH_SIZE),
+):
+    return batch_results(ids, await remove_tasks(ids))
+
+@app.get("/tasks/search", response_model=list[TaskWithID])
+async def search_tasks(
+    keyword: str,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+):
+    # The keyword is looked up in the inverted index kept by the store, which is
+    # updated by every create/update/delete. Best matches come first, and
+    # 'limit'/'offset' page through the ranked results.
+    return json_tasks(
+        await search_tasks_by_keyword(
+            keyword, limit=limit, offset=offset
+        ),
+        TaskWithID,
+    )
 
 @app.get("/v2/tasks", response_model=list[TaskV2WithID])
-def get_tasks_v2():
-    tasks = read_all_tasks_v2()
-    return tasks
+async def get_tasks_v2(
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    if_none_match: Optional[str] = Header(None),
+):
+    etag = await check_etag(if_none_match)
+    response = await list_tasks(
+        TaskV2WithID,
+        after=after,
+        limit=limit,
+        fields=fields,
+        format=format,
+    )
+    response.headers["ETag"] = etag
+    return response
+
+class TaskChanges(BaseModel):
+    version: str
+    # True when 'since' was unknown: 'tasks' is then the whole table.
+    reset: bool
+    tasks: list[TaskWithID]
+    deleted: list[int]
+
+@app.get("/tasks/changes", response_model=TaskChanges)
+async def get_task_changes(since: Optional[str] = None):
+    # Change feed for clients keeping a copy of the tasks: the first call
+    # (without 'since') returns every task and a version, the next ones send
+    # that version back and only get the tasks created, modified or deleted
+    # since then. A version of another server process is answered with a reset.
+    version, tasks, deleted, reset = await read_changes(since)
+    changes = TaskChanges.model_construct(
+        version=version, reset=reset, tasks=tasks, deleted=deleted
+    )
+    return Response(
+        changes.model_dump_json(), media_type="application/json"
+    )
 
 @app.post("/token")
 async def login(
@@ -1,105 +1,168 @@
-import csv
-from typing import Optional
+import os
+from typing import Iterator, Optional
 
+from pydantic import BaseModel
+
+from backends import get_backend
 from models import Task, TaskWithID, TaskV2WithID
+from store import Changes, TaskBackend
+
+# Storage backend of the task table ("csv", "memory", "sqlite" or "snapshot",
+# see backends.py)
+# and the file it uses, e.g.:
+#   $ TASKS_STORAGE_BACKEND=sqlite TASKS_DATABASE_FILENAME=tasks.db uvicorn main:app
+STORAGE_BACKEND = os.getenv("TASKS_STORAGE_BACKEND", "csv")
+DATABASE_FILENAME = os.getenv("TASKS_DATABASE_FILENAME", "tasks.csv")
 
-DATABASE_FILENAME = "tasks.csv"
+# Number of rows fetched from the store at a time when streaming a listing.
+STREAM_BATCH_SIZE = 500
 
 column_fields = [
     "id", "title", "description", "status"
 ]
 
+# Every operation goes through the storage backend of the current database file.
+# The default CSV store parses the file only once (or again if the file changes
+# on disk), so lookups and filters no longer scan the whole file on each request.
+def get_store() -> TaskBackend:
+    return get_backend(STORAGE_BACKEND, DATABASE_FILENAME)
+
+# Rows read from the store were validated when they were written (the API only
+# stores validated models), so they are turned into models with
+# model_construct(), which skips validation but still fills in the defaults,
+# e.g. the 'priority' of the v2 API. Keys that are not fields of the model
+# (such as 'priority' for the v1 models) are ignored, as with validation.
+def trusted(model: type[BaseModel], row: dict) -> BaseModel:
+    return model.model_construct(**row)
+
 def read_all_tasks() -> list[TaskWithID]:
-    with open(DATABASE_FILENAME) as csvfile:
-        reader = csv.DictReader(
-            csvfile,
+    return [trusted(TaskWithID, row) for row in get_store().all()]
+
+def filter_tasks(
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    model: type[BaseModel] = TaskWithID,
+) -> list[BaseModel]:
+    return [
+        trusted(model, row)
+        for row in get_store().find(status=status, title=title)
+    ]
+
+def read_tasks_page(
+    model: type[BaseModel] = TaskWithID,
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> list[BaseModel]:
+    return [
+        trusted(model, row)
+        for row in get_store().page(
+            after=after, limit=limit, status=status, title=title
         )
-        return [TaskWithID(**row) for row in reader]
+    ]
 
-def read_task(task_id) -> Optional[TaskWithID]:
-    with open(DATABASE_FILENAME) as csvfile:
-        reader = csv.DictReader(
-            csvfile,
+def iter_tasks(
+    model: type[BaseModel] = TaskWithID,
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Iterator[BaseModel]:
+    # Generator walking the table one page at a time, so that a streamed
+    # response never holds more than STREAM_BATCH_SIZE tasks in memory.
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch_size = (
+            STREAM_BATCH_SIZE
+            if remaining is None
+            else min(remaining, STREAM_BATCH_SIZE)
+        )
+        tasks = read_tasks_page(
+            model, status, title, after=after, limit=batch_size
         )
-        for row in reader:
-            if int(row["id"]) == task_id:
-                return TaskWithID(**row)
+        yield from tasks
+        if len(tasks) < batch_size:
+            return
+        after = tasks[-1].id
+        if remaining is not None:
+            remaining -= len(tasks)
+
+def search_tasks_by_keyword(
+    keyword: str,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> list[TaskWithID]:
+    return [
+        trusted(TaskWithID, row)
+        for row in get_store().search(
+            keyword, limit=limit, offset=offset
+        )
+    ]
+
+def read_task(task_id) -> Optional[TaskWithID]:
+    row = get_store().get(task_id)
+    if row:
+        return trusted(TaskWithID, row)
 
 def get_next_id():
-    try:
-        with open(DATABASE_FILENAME, "r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            max_id = max(
-                int(row["id"]) for row in reader
-            )
-            return max_id + 1
-    except (FileNotFoundError, ValueError):
-        return 1
+    return get_store().next_id()
 
 def write_task_into_csv(task: TaskWithID):
-    with open(DATABASE_FILENAME, mode="a", newline="") as file:
-        writer = csv.DictWriter(
-            file,
-            fieldnames=column_fields,
-        )
-        writer.writerow(task.model_dump())
+    get_store().add(task.model_dump())
 
 def create_task(task: Task) -> TaskWithID:
-    id = get_next_id()
-    task_with_id = TaskWithID(
-        id=id, **task.model_dump()
+    # The id is allocated by the store under the lock of the database file,
+    # which keeps ids unique even with several workers writing to it.
+    return trusted(
+        TaskWithID, get_store().create(task.model_dump())
     )
-    write_task_into_csv(task_with_id)
-    return task_with_id
+
+def create_tasks(tasks: list[Task]) -> list[TaskWithID]:
+    # Bulk import: a single id range and a single write for all the tasks.
+    rows = get_store().create_many([task.model_dump() for task in tasks])
+    return [trusted(TaskWithID, row) for row in rows]
 
 def modify_task(id: int, task: dict) -> Optional[TaskWithID]:
-    updated_task: Optional[TaskWithID] = None
-    tasks = read_all_tasks()
-    for number, task_ in enumerate(tasks):
-        if task_.id == id:
-            # This is a double (or multiple) assignment on a single line.
-            tasks[number] = (
-                updated_task
-            ) = task_.model_copy(update=task)
-    with open(DATABASE_FILENAME, mode="w", newline="") as csvfile: # rewrite the file
-        writer = csv.DictWriter(
-            csvfile,
-            fieldnames=column_fields,
-        )
-        writer.writeheader()
-        for task in tasks:
-            writer.writerow(task.model_dump())
-    if updated_task:
-        return updated_task
-
-def remove_task(id: int) -> bool:
-    deleted_task: Optional[Task] = None
-    tasks = read_all_tasks()
-    with open(DATABASE_FILENAME, mode="w", newline="") as csvfile: # rewrite the file
-        writer = csv.DictWriter(
-            csvfile,
-            fieldnames=column_fields,
-        )
-        writer.writeheader()
-        for task in tasks:
-            if task.id == id:
-                deleted_task = task
-                continue
-            writer.writerow(task.model_dump())
-    if deleted_task:
-        dict_task_without_id = (
-            deleted_task.model_dump()
-        )
-        del dict_task_without_id["id"]
-        return Task(**dict_task_without_id)
+    updated_row = get_store().update(id, task)
+    if updated_row:
+        return trusted(TaskWithID, updated_row)
 
-def read_all_tasks_v2() -> list[TaskV2WithID]:
-    with open(DATABASE_FILENAME) as csvfile:
-        reader = csv.DictReader(
-            csvfile,
-        )
-        return [TaskV2WithID(**row) for row in reader]
+def modify_tasks(
+    updates: list[tuple[int, dict]]
+) -> list[Optional[TaskWithID]]:
+    return [
+        trusted(TaskWithID, row) if row else None
+        for row in get_store().update_many(updates)
+    ]
 
+def remove_task(id: int) -> Optional[Task]:
+    deleted_row = get_store().delete(id)
+    if deleted_row:
+        # Task has no 'id' field, so the id of the row is left out.
+        return trusted(Task, deleted_row)
 
+def remove_tasks(ids: list[int]) -> list[Optional[Task]]:
+    return [
+        trusted(Task, row) if row else None
+        for row in get_store().delete_many(ids)
+    ]
 
+# Every write (of any process) bumps the version of the table. Reading it only
+# costs the freshness check of get_store() (two os.stat() calls for the CSV store).
+def read_version() -> str:
+    return get_store().version()
 
+def read_changes(
+    since: Optional[str] = None, model: type[BaseModel] = TaskWithID
+) -> tuple[str, list[BaseModel], list[int], bool]:
+    changes: Changes = get_store().changes(since)
+    return (
+        changes.version,
+        [trusted(model, row) for row in changes.rows],
+        changes.deleted,
+        changes.reset,
+    )
+
+def read_all_tasks_v2() -> list[TaskV2WithID]:
+    return [trusted(TaskV2WithID, row) for row in get_store().all()]
@@ -0,0 +1,103 @@
+import re
+from typing import Iterable
+
+# Length of the substrings (n-grams) indexed for substring search.
+NGRAM_SIZE = 3
+
+_token_pattern = re.compile(r"\w+")
+
+
+def _tokens(title: str, description: str) -> set[str]:
+    # Words are taken from the title and the description separately, so the
+    # last word of the title and the first one of the description stay apart.
+    return set(_token_pattern.findall(title)) | set(
+        _token_pattern.findall(description)
+    )
+
+
+def _ngrams(text: str) -> set[str]:
+    return {
+        text[start:start + NGRAM_SIZE]
+        for start in range(len(text) - NGRAM_SIZE + 1)
+    }
+
+
+# Inverted index over the title and description of the tasks.
+# GET /tasks/search keeps its original semantics: a task matches when the keyword
+# is a case-insensitive substring of 'title + description'. Instead of scanning
+# every task, the index keeps, for each 3-character substring (trigram), the ids
+# of the tasks containing it. A keyword of n characters can only be found in
+# tasks containing all of its trigrams, so only those few candidates are checked.
+# A second index of whole words is used to rank the results.
+class SearchIndex:
+    def __init__(self):
+        # id -> (lowercased title, lowercased description,
+        #        lowercased 'title + description')
+        self._texts: dict[int, tuple[str, str, str]] = {}
+        self._ngrams: dict[str, set[int]] = {}
+        self._tokens: dict[str, set[int]] = {}
+
+    def add(self, task_id: int, title: str, description: str):
+        # Lowercased separately: the lowercase of a string may not have its
+        # length, so the title cannot be cut back out of the lowercased text.
+        title = (title or "").lower()
+        description = (description or "").lower()
+        text = title + description
+        self._texts[task_id] = (title, description, text)
+        for gram in _ngrams(text):
+            self._ngrams.setdefault(gram, set()).add(task_id)
+        for token in _tokens(title, description):
+            self._tokens.setdefault(token, set()).add(task_id)
+
+    def remove(self, task_id: int):
+        entry = self._texts.pop(task_id, None)
+        if entry is None:
+            return
+        title, description, text = entry
+        for index, keys in (
+            (self._ngrams, _ngrams(text)),
+            (self._tokens, _tokens(title, description)),
+        ):
+            for key in keys:
+                ids = index.get(key)
+                if ids is None:
+                    continue
+                ids.discard(task_id)
+                if not ids:
+                    del index[key]
+
+    def _candidates(self, keyword: str) -> Iterable[int]:
+        if len(keyword) < NGRAM_SIZE:
+            # Too short to use the n-gram index, check every task.
+            return self._texts.keys()
+        postings = sorted(
+            (self._ngrams.get(gram, set()) for gram in _ngrams(keyword)),
+            key=len,
+        )
+        # Intersect starting from the smallest set, so selective keywords
+        # only touch a handful of ids.
+        return set.intersection(*postings) if postings[0] else set()
+
+    def search(self, keyword: str) -> list[int]:
+        # Returns the ids of the matching tasks, best matches first:
+        # tasks where the keyword appears as whole words, then tasks where it
+        # appears in the title, and finally by id.
+        keyword = keyword.lower()
+        matches = [
+            task_id
+            for task_id in self._candidates(keyword)
+            if keyword in self._texts[task_id][2]
+        ]
+        word_postings = [
+            self._tokens.get(token, set())
+            for token in _token_pattern.findall(keyword)
+        ]
+
+        def rank(task_id: int):
+            whole_words = bool(word_postings) and all(
+                task_id in ids for ids in word_postings
+            )
+            in_title = keyword in self._texts[task_id][0]
+            return (not whole_words, not in_title, task_id)
+
+        return sorted(matches, key=rank)
@@ -1,7 +1,11 @@
+from typing import Callable
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 
+from token_cache import TTLCache
+
 
 fake_users_db = {
     "johndoe": {
@@ -41,12 +45,45 @@ def fake_token_resolver(
         user = get_user(fake_users_db, user_id)
         return user
 
+# Function turning a token into a user (or None). It can be replaced with
+# set_token_resolver(), e.g. by one reading a real user store.
+token_resolver: Callable[[str], UserInDB | None] = fake_token_resolver
+
+# Users resolved from their tokens in the last TOKEN_CACHE_TTL seconds, so that
+# authenticated requests don't resolve the same token again and again.
+# Cached users are shared between requests and must not be modified.
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 300.0
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+def set_token_resolver(
+    resolver: Callable[[str], UserInDB | None],
+):
+    global token_resolver
+    token_resolver = resolver
+    token_cache.clear()
+
+def resolve_token(token: str) -> UserInDB | None:
+    user = token_cache.get(token)
+    if user is None:
+        # Unknown tokens are not cached: a user created later must be able
+        # to log in, and invalid tokens cannot fill the cache.
+        user = token_resolver(token)
+        if user:
+            token_cache.set(token, user, tag=user.username)
+    return user
+
+def invalidate_user(username: str):
+    # To call whenever a user changes (password, rights, deletion...):
+    # the next request with one of their tokens resolves it again.
+    token_cache.invalidate_tag(username)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def get_user_from_token(
     token: str = Depends(oauth2_scheme),
 ) -> UserInDB:
-    user = fake_token_resolver(token)
+    user = resolve_token(token)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,394 @@
+"""
+Compact binary snapshot of the task table, read through mmap, and a
+read-only storage backend serving the API from it.
+
+    $ python snapshot.py tasks.csv tasks.snapshot
+    $ python snapshot.py tasks.snapshot tasks.csv
+"""
+
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from bisect import bisect_right
+from typing import Iterable, Iterator, Optional
+
+from locking import atomic_write
+from search_index import SearchIndex
+from store import Changes, parse_version
+
+# Layout of a snapshot file (little-endian, rows in the order of the CSV file):
+#   magic "TSNAP001" | metadata length (uint32) | row count n (uint32)
+#   metadata (JSON: CSV fieldnames, status and priority dictionaries)
+#   ids n x int64 | status codes n x uint16 | priority codes n x uint16
+#   title offsets (n + 1) x uint64 | description offsets (n + 1) x uint64
+#   string heap (the UTF-8 titles and descriptions, end to end)
+# Every column has a fixed width, so the value of row i is found by
+# arithmetic, and the operating system only loads the pages that are read.
+MAGIC = b"TSNAP001"
+HEADER = struct.Struct("<8sII")
+# Code of a missing status or priority.
+MISSING = 0xFFFF
+
+
+def _align(position: int) -> int:
+    return (position + 7) // 8 * 8
+
+
+def _check_byteorder():
+    # The columns are read with memoryview.cast(), which uses the byte order
+    # of the machine.
+    if sys.byteorder != "little":
+        raise RuntimeError("snapshots require a little-endian machine")
+
+
+def write_snapshot(
+    rows: Iterable[dict],
+    filename: str,
+    fieldnames: Optional[list[str]] = None,
+):
+    _check_byteorder()
+    rows = list(rows)
+    statuses: dict[str, int] = {}
+    priorities: dict[str, int] = {}
+
+    def code(dictionary: dict[str, int], value) -> int:
+        if value is None:
+            return MISSING
+        return dictionary.setdefault(value, len(dictionary))
+
+    ids = [int(row["id"]) for row in rows]
+    status_codes = [code(statuses, row.get("status")) for row in rows]
+    priority_codes = [
+        code(priorities, row.get("priority")) for row in rows
+    ]
+    heap = bytearray()
+    title_offsets = [0]
+    description_offsets = [0]
+    for row in rows:
+        heap += (row.get("title") or "").encode()
+        title_offsets.append(len(heap))
+    description_offsets[0] = len(heap)
+    for row in rows:
+        heap += (row.get("description") or "").encode()
+        description_offsets.append(len(heap))
+
+    metadata = json.dumps(
+        {
+            "fieldnames": fieldnames or [],
+            "statuses": list(statuses),
+            "priorities": list(priorities),
+        }
+    ).encode()
+    count = len(rows)
+    with atomic_write(filename, mode="wb") as file:
+        file.write(HEADER.pack(MAGIC, len(metadata), count))
+        file.write(metadata)
+        file.write(
+            b"\0" * (_align(file.tell()) - file.tell())
+        )
+        file.write(struct.pack(f"<{count}q", *ids))
+        file.write(struct.pack(f"<{count}H", *status_codes))
+        file.write(struct.pack(f"<{count}H", *priority_codes))
+        file.write(
+            b"\0" * (_align(file.tell()) - file.tell())
+        )
+        file.write(struct.pack(f"<{count + 1}Q", *title_offsets))
+        file.write(
+            struct.pack(f"<{count + 1}Q", *description_offsets)
+        )
+        file.write(heap)
+
+
+class TaskSnapshot:
+    def __init__(self, filename: str):
+        _check_byteorder()
+        self.filename = filename
+        with open(filename, "rb") as file:
+            self._mmap = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        buffer = memoryview(self._mmap)
+        magic, metadata_length, count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            buffer.release()
+            self._mmap.close()
+            raise ValueError(f"{filename} is not a task snapshot")
+        position = HEADER.size
+        metadata = json.loads(
+            bytes(buffer[position:position + metadata_length])
+        )
+        self.fieldnames: list[str] = metadata["fieldnames"]
+        self.statuses: list[str] = metadata["statuses"]
+        self.priorities: list[str] = metadata["priorities"]
+        self._count = count
+
+        def column(start: int, width: int, format: str):
+            end = start + count * width
+            return buffer[start:end].cast(format), end
+
+        position = _align(position + metadata_length)
+        self.ids, position = column(position, 8, "q")
+        self.status_codes, position = column(position, 2, "H")
+        self.priority_codes, position = column(position, 2, "H")
+        position = _align(position)
+        count += 1
+        self._title_offsets, position = column(position, 8, "Q")
+        self._description_offsets, position = column(position, 8, "Q")
+        self._heap = buffer[position:]
+        self._buffer = buffer
+
+    def close(self):
+        for view in (
+            self.ids,
+            self.status_codes,
+            self.priority_codes,
+            self._title_offsets,
+            self._description_offsets,
+            self._heap,
+            self._buffer,
+        ):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _string(self, offsets, index: int) -> str:
+        return str(
+            self._heap[offsets[index]:offsets[index + 1]], "utf-8"
+        )
+
+    def title_is(self, index: int, title: bytes) -> bool:
+        # Compares the UTF-8 bytes in place, without decoding the title.
+        start = self._title_offsets[index]
+        end = self._title_offsets[index + 1]
+        return end - start == len(title) and self._heap[start:end] == title
+
+    def row(self, index: int) -> dict:
+        row = {
+            "id": self.ids[index],
+            "title": self._string(self._title_offsets, index),
+            "description": self._string(
+                self._description_offsets, index
+            ),
+            "status": None,
+        }
+        status = self.status_codes[index]
+        if status != MISSING:
+            row["status"] = self.statuses[status]
+        priority = self.priority_codes[index]
+        if priority != MISSING:
+            row["priority"] = self.priorities[priority]
+        return row
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self.row(index) for index in range(self._count))
+
+
+class ReadOnlyStoreError(Exception):
+    pass
+
+
+# The columns of an open snapshot, with the lookup structures derived from
+# them. They are built on first use, and replaced as a whole when the file
+# changes, so a reader always sees one consistent version of the table.
+class _SnapshotState:
+    def __init__(self, snapshot: TaskSnapshot, signature: tuple):
+        self.snapshot = snapshot
+        self.signature = signature
+        self.epoch = f"{hash(signature) & 0xFFFFFFFF:08x}"
+        # id -> index of the row; with a duplicated id the last row wins,
+        # as in the CSV store.
+        self.indexes: dict[int, int] = {}
+        for index, task_id in enumerate(snapshot.ids):
+            self.indexes[task_id] = index
+        self.live: Optional[set[int]] = None
+        if len(self.indexes) != len(snapshot):
+            self.live = set(self.indexes.values())
+        self._sorted_ids: Optional[list[int]] = None
+        self._search_index: Optional[SearchIndex] = None
+
+    def sorted_ids(self) -> list[int]:
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.indexes)
+        return self._sorted_ids
+
+    def search_index(self) -> SearchIndex:
+        if self._search_index is None:
+            search_index = SearchIndex()
+            for task_id, index in self.indexes.items():
+                row = self.snapshot.row(index)
+                search_index.add(task_id, row["title"], row["description"])
+            self._search_index = search_index
+        return self._search_index
+
+
+# Read-only storage backend over a snapshot file ("snapshot" in backends.py).
+# Nothing is loaded up front: a lookup by id maps the id to its row, and the
+# status filter scans the status column (2 bytes per row) and only decodes
+# the rows that match. Writes raise ReadOnlyStoreError. Replacing the file
+# (e.g. with 'python snapshot.py tasks.csv tasks.snapshot') is picked up by
+# the next request.
+class SnapshotTaskStore:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._state: Optional[_SnapshotState] = None
+        self.refresh()
+
+    def _signature(self) -> tuple:
+        stat = os.stat(self.filename)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def refresh(self):
+        signature = self._signature()
+        with self._lock:
+            if self._state is None or self._state.signature != signature:
+                # The previous snapshot is not closed: requests may still be
+                # reading it, and its mapping goes away with the last of them.
+                self._state = _SnapshotState(
+                    TaskSnapshot(self.filename), signature
+                )
+
+    def _rows(self, state: _SnapshotState, indexes) -> list[dict]:
+        return [state.snapshot.row(index) for index in indexes]
+
+    def _find_indexes(
+        self,
+        state: _SnapshotState,
+        status: Optional[str],
+        title: Optional[str],
+    ) -> list[int]:
+        snapshot = state.snapshot
+        if status is None:
+            indexes = list(state.indexes.values())
+        elif status in snapshot.statuses:
+            code = snapshot.statuses.index(status)
+            indexes = [
+                index
+                for index, row_code in enumerate(snapshot.status_codes)
+                if row_code == code
+            ]
+            if state.live is not None:
+                indexes = [i for i in indexes if i in state.live]
+        else:
+            return []
+        if title is not None:
+            encoded = title.encode()
+            indexes = [i for i in indexes if snapshot.title_is(i, encoded)]
+        return sorted(indexes, key=snapshot.ids.__getitem__)
+
+    def all(self) -> list[dict]:
+        state = self._state
+        return self._rows(
+            state, (state.indexes[task_id] for task_id in state.sorted_ids())
+        )
+
+    def get(self, task_id: int) -> Optional[dict]:
+        state = self._state
+        index = state.indexes.get(task_id)
+        return None if index is None else state.snapshot.row(index)
+
+    def find(
+        self,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]:
+        state = self._state
+        return self._rows(state, self._find_indexes(state, status, title))
+
+    def page(
+        self,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]:
+        state = self._state
+        if status is None and title is None:
+            ids = state.sorted_ids()
+        else:
+            ids = [
+                state.snapshot.ids[index]
+                for index in self._find_indexes(state, status, title)
+            ]
+        start = 0 if after is None else bisect_right(ids, after)
+        end = None if limit is None else start + limit
+        return self._rows(
+            state, (state.indexes[task_id] for task_id in ids[start:end])
+        )
+
+    def search(
+        self,
+        keyword: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> list[dict]:
+        state = self._state
+        ids = state.search_index().search(keyword)
+        end = None if limit is None else offset + limit
+        return self._rows(
+            state, (state.indexes[task_id] for task_id in ids[offset:end])
+        )
+
+    def next_id(self) -> int:
+        return max(self._state.indexes, default=0) + 1
+
+    def _read_only(self, *args):
+        raise ReadOnlyStoreError(f"{self.filename} is a read-only snapshot")
+
+    create = add = update = delete = _read_only
+    create_many = add_many = update_many = delete_many = _read_only
+
+    # The table only changes when the file is replaced, and each file gets
+    # its own epoch: a version is either current or unknown.
+    def version(self) -> str:
+        return f"{self._state.epoch}.0"
+
+    def changes(self, since: Optional[str] = None) -> Changes:
+        state = self._state
+        version = f"{state.epoch}.0"
+        if parse_version(since, state.epoch) == 0:
+            return Changes(version, [], [], False)
+        return Changes(version, self.all(), [], True)
+
+
+def csv_to_snapshot(csv_filename: str, filename: str):
+    with open(csv_filename, newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        rows = list(reader)
+        fieldnames = list(reader.fieldnames or [])
+    write_snapshot(rows, filename, fieldnames)
+
+
+def snapshot_to_csv(filename: str, csv_filename: str):
+    with TaskSnapshot(filename) as snapshot:
+        fieldnames = snapshot.fieldnames or [
+            "id", "title", "description", "status", "priority"
+        ]
+        with atomic_write(csv_filename, newline="") as csvfile:
+            writer = csv.DictWriter(
+                csvfile, fieldnames=fieldnames, extrasaction="ignore"
+            )
+            writer.writeheader()
+            writer.writerows(snapshot)
+
+
+if __name__ == "__main__":
+    source, target = sys.argv[1:3]
+    with open(source, "rb") as file:
+        is_snapshot = file.read(len(MAGIC)) == MAGIC
+    if is_snapshot:
+        snapshot_to_csv(source, target)
+    else:
+        csv_to_snapshot(source, target)
@@ -0,0 +1,322 @@
+import sqlite3
+import threading
+from typing import Optional
+
+from store import DEFAULT_FIELDNAMES, Changes, parse_version
+
+# Columns of the 'tasks' table, 'priority' is only used by the v2 API.
+COLUMNS = DEFAULT_FIELDNAMES + ["priority"]
+
+
+# Task table stored in a SQLite database.
+# The database runs in WAL mode, so readers never wait for a writer and a
+# write only appends to the log, and the table is indexed on id (primary key),
+# status and title. Each thread gets its own connection, as sqlite3 connections
+# cannot be shared between threads.
+class SQLiteTaskStore:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id INTEGER PRIMARY KEY, "
+                "title TEXT NOT NULL, "
+                "description TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "priority TEXT)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_status "
+                "ON tasks (status)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_title "
+                "ON tasks (title)"
+            )
+            # Change log kept by triggers, so that the writes of every process
+            # (and of any other client of the database) are recorded: the
+            # version of the last change of each id, deleted ids included.
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS task_changes ("
+                "task_id INTEGER PRIMARY KEY, "
+                "version INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS task_changes_version "
+                "ON task_changes (version)"
+            )
+            for event, row in (
+                ("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")
+            ):
+                connection.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS tasks_{event.lower()} "
+                    f"AFTER {event} ON tasks BEGIN "
+                    "INSERT OR REPLACE INTO task_changes VALUES "
+                    f"({row}.id, (SELECT coalesce(max(version), 0) + 1 "
+                    "FROM task_changes)); END"
+                )
+            # Random id of this database, part of the versions it hands out,
+            # so a version of a deleted and recreated database is not reused.
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS store_info ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO store_info "
+                "VALUES ('epoch', lower(hex(randomblob(4))))"
+            )
+            (self._epoch,) = connection.execute(
+                "SELECT value FROM store_info WHERE key = 'epoch'"
+            ).fetchone()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=30)
+            connection.row_factory = sqlite3.Row
+            # SQLite's lower() only folds ASCII letters: searches use Python's
+            # str.lower(), as the in-memory index does ('Élan' matches 'élan').
+            connection.create_function(
+                "unicode_lower",
+                1,
+                lambda text: None if text is None else text.lower(),
+                deterministic=True,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs at checkpoints: a power loss can
+            # lose the last transactions but never corrupts the database.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        # Missing values are left out, so the models apply their defaults
+        # (e.g. 'priority' of the tasks created through the v1 API).
+        return {
+            key: row[key] for key in row.keys() if row[key] is not None
+        }
+
+    def _select(self, where: str = "", parameters=(), suffix: str = ""):
+        cursor = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM tasks {where} {suffix}",
+            parameters,
+        )
+        return [self._row(row) for row in cursor]
+
+    def _filters(
+        self,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+        after: Optional[int] = None,
+    ):
+        conditions, parameters = [], []
+        for column, value, operator in (
+            ("status", status, "="),
+            ("title", title, "="),
+            ("id", after, ">"),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                parameters.append(value)
+        where = (
+            "WHERE " + " AND ".join(conditions) if conditions else ""
+        )
+        return where, parameters
+
+    def refresh(self):
+        pass
+
+    def all(self) -> list[dict]:
+        return self._select(suffix="ORDER BY id")
+
+    def get(self, task_id: int) -> Optional[dict]:
+        rows = self._select("WHERE id = ?", (task_id,))
+        return rows[0] if rows else None
+
+    def find(
+        self,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]:
+        where, parameters = self._filters(status, title)
+        return self._select(where, parameters, "ORDER BY id")
+
+    def page(
+        self,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]:
+        where, parameters = self._filters(status, title, after)
+        return self._select(
+            where,
+            parameters + [-1 if limit is None else limit],
+            "ORDER BY id LIMIT ?",
+        )
+
+    def search(
+        self,
+        keyword: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> list[dict]:
+        # Same matching as the in-memory index (case-insensitive substring of
+        # title + description), with the matches in the title first.
+        return self._select(
+            "WHERE instr(unicode_lower(title || description), :keyword) > 0",
+            {
+                "keyword": keyword.lower(),
+                "limit": -1 if limit is None else limit,
+                "offset": offset,
+            },
+            "ORDER BY instr(unicode_lower(title), :keyword) = 0, id "
+            "LIMIT :limit OFFSET :offset",
+        )
+
+    def next_id(self) -> int:
+        (max_id,) = self._connection().execute(
+            "SELECT coalesce(max(id), 0) FROM tasks"
+        ).fetchone()
+        return max_id + 1
+
+    def create(self, fields: dict) -> dict:
+        # Without an explicit id, SQLite picks max(id) + 1 inside the
+        # INSERT itself, so concurrent writers never get the same id.
+        return self._write(fields)
+
+    def create_many(self, fields: list[dict]) -> list[dict]:
+        # BEGIN IMMEDIATE takes the write lock of the database before reading
+        # max(id), so the whole range of ids is reserved for this batch.
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            (max_id,) = connection.execute(
+                "SELECT coalesce(max(id), 0) FROM tasks"
+            ).fetchone()
+            rows = [
+                {**task_fields, "id": max_id + 1 + offset}
+                for offset, task_fields in enumerate(fields)
+            ]
+            self._insert_many(connection, rows)
+        return [self._clean(row) for row in rows]
+
+    def add(self, row: dict) -> dict:
+        return self._write(row)
+
+    def add_many(self, rows: list[dict]) -> list[dict]:
+        rows = [{**row, "id": int(row["id"])} for row in rows]
+        with self._connection() as connection:
+            self._insert_many(connection, rows)
+        return [self._clean(row) for row in rows]
+
+    @staticmethod
+    def _clean(row: dict) -> dict:
+        return {key: value for key, value in row.items() if value is not None}
+
+    @staticmethod
+    def _insert_many(connection: sqlite3.Connection, rows: list[dict]):
+        connection.executemany(
+            f"INSERT OR REPLACE INTO tasks ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join(':' + column for column in COLUMNS)})",
+            ({column: row.get(column) for column in COLUMNS} for row in rows),
+        )
+
+    def _write(self, row: dict) -> dict:
+        values = {column: row.get(column) for column in COLUMNS}
+        with self._connection() as connection:
+            cursor = connection.execute(
+                f"INSERT OR REPLACE INTO tasks ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join(':' + column for column in COLUMNS)})",
+                values,
+            )
+        return {**self._clean(row), "id": cursor.lastrowid}
+
+    def _update(
+        self, connection: sqlite3.Connection, task_id: int, fields: dict
+    ) -> Optional[dict]:
+        fields = {
+            key: value
+            for key, value in fields.items()
+            if key in COLUMNS and key != "id"
+        }
+        if not fields:
+            rows = self._select("WHERE id = ?", (task_id,))
+            return rows[0] if rows else None
+        row = connection.execute(
+            "UPDATE tasks SET "
+            + ", ".join(f"{key} = :{key}" for key in fields)
+            + f" WHERE id = :id RETURNING {', '.join(COLUMNS)}",
+            {**fields, "id": task_id},
+        ).fetchone()
+        return self._row(row) if row else None
+
+    def update(self, task_id: int, fields: dict) -> Optional[dict]:
+        return self.update_many([(task_id, fields)])[0]
+
+    def update_many(
+        self, updates: list[tuple[int, dict]]
+    ) -> list[Optional[dict]]:
+        # One transaction, so the batch is committed (and synced) once.
+        with self._connection() as connection:
+            return [
+                self._update(connection, task_id, fields)
+                for task_id, fields in updates
+            ]
+
+    def delete(self, task_id: int) -> Optional[dict]:
+        return self.delete_many([task_id])[0]
+
+    def delete_many(self, task_ids: list[int]) -> list[Optional[dict]]:
+        with self._connection() as connection:
+            rows = [
+                connection.execute(
+                    "DELETE FROM tasks WHERE id = ? "
+                    f"RETURNING {', '.join(COLUMNS)}",
+                    (task_id,),
+                ).fetchone()
+                for task_id in task_ids
+            ]
+        return [self._row(row) if row else None for row in rows]
+
+    def _version(self) -> int:
+        (version,) = self._connection().execute(
+            "SELECT coalesce(max(version), 0) FROM task_changes"
+        ).fetchone()
+        return version
+
+    def version(self) -> str:
+        return f"{self._epoch}.{self._version()}"
+
+    def changes(self, since: Optional[str] = None) -> Changes:
+        since_version = parse_version(since, self._epoch)
+        version = self._version()
+        if since_version is None or since_version > version:
+            return Changes(f"{self._epoch}.{version}", self.all(), [], True)
+        changed = self._connection().execute(
+            f"SELECT c.task_id, c.version, {', '.join('t.' + c for c in COLUMNS)} "
+            "FROM task_changes c LEFT JOIN tasks t ON t.id = c.task_id "
+            "WHERE c.version > ? ORDER BY c.version",
+            (since_version,),
+        ).fetchall()
+        rows, deleted = [], []
+        for change in changed:
+            version = max(version, change["version"])
+            if change["id"] is None:
+                deleted.append(change["task_id"])
+            else:
+                rows.append(
+                    {
+                        column: change[column]
+                        for column in COLUMNS
+                        if change[column] is not None
+                    }
+                )
+        return Changes(f"{self._epoch}.{version}", rows, deleted, False)
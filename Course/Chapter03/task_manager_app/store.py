@@ -0,0 +1,796 @@
+import csv
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import NamedTuple, Optional, Protocol
+
+from locking import ReadWriteLock, StorageLock, atomic_write
+from search_index import SearchIndex
+
+# Columns written when the CSV file does not exist yet (or has no header).
+DEFAULT_FIELDNAMES = [
+    "id", "title", "description", "status"
+]
+
+# Once the journal grows past this size (in bytes), a background thread folds
+# it into a fresh copy of the CSV file.
+JOURNAL_COMPACTION_THRESHOLD = 1024 * 1024
+
+
+def journal_filename(filename: str) -> str:
+    return filename + ".journal"
+
+
+def lock_filename(filename: str) -> str:
+    return filename + ".lock"
+
+
+def epoch_filename(filename: str) -> str:
+    return filename + ".epoch"
+
+
+def _file_signature(filename: str):
+    # A cheap fingerprint of the file on disk. If any of these values change,
+    # someone (another process, an editor, a test fixture) touched the file
+    # behind our back and the in-memory copy must be reloaded.
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _appended_from(old, new) -> Optional[int]:
+    # Compare two signatures of the same file. When the file only grew
+    # (same inode, bigger size), return the offset where the new data starts;
+    # otherwise return None, the whole file must be read again.
+    if old is None or new is None or old[0] != new[0]:
+        return None
+    if new[1] > old[1]:
+        return old[1]
+    return None
+
+
+def _entry_id(entry: dict) -> int:
+    return entry["row"]["id"] if entry["op"] == "put" else entry["id"]
+
+
+def new_epoch() -> str:
+    return os.urandom(4).hex()
+
+
+def shared_epoch(filename: str) -> str:
+    # Epoch of a database file, kept in a file next to it: every worker, and
+    # every restart, issues versions of the same epoch. The first process
+    # links its file in place, the others read it.
+    path = epoch_filename(filename)
+    try:
+        with open(path) as epochfile:
+            return epochfile.read()
+    except FileNotFoundError:
+        pass
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temporary, "w") as epochfile:
+        epochfile.write(new_epoch())
+    try:
+        os.link(temporary, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temporary)
+    with open(path) as epochfile:
+        return epochfile.read()
+
+
+def _parse_generation(generation: str) -> tuple[int, int]:
+    # The lock file holds "<number of compactions> <offset>", see
+    # TaskStore._stamp().
+    parts = generation.split()
+    return (
+        int(parts[0]) if parts else 0,
+        int(parts[1]) if len(parts) > 1 else 0,
+    )
+
+
+def parse_version(version: Optional[str], epoch: str) -> Optional[int]:
+    # Versions are "<epoch>.<counter>". The counter only means something for
+    # the change log that issued it, identified by the epoch: anything else
+    # (another process, a recreated database, garbage) gives None.
+    prefix, _, counter = (version or "").partition(".")
+    if prefix != epoch or not counter.isdigit():
+        return None
+    return int(counter)
+
+
+# Changes of the task table since a given version: the rows created or
+# modified, the ids of the deleted tasks and the version to ask from next time.
+# 'reset' means the version was unknown, and 'rows' holds the whole table.
+class Changes(NamedTuple):
+    version: str
+    rows: list[dict]
+    deleted: list[int]
+    reset: bool
+
+
+# Interface shared by the storage backends of the task table: the CSV store
+# below, its purely in-memory counterpart, and the SQLite store in
+# 'sqlite_store.py'. Rows are plain dicts with an integer 'id', and every list
+# of rows comes in id order (search results: best matches first, then by id).
+class TaskBackend(Protocol):
+    def refresh(self): ...
+
+    def all(self) -> list[dict]: ...
+
+    def get(self, task_id: int) -> Optional[dict]: ...
+
+    def find(
+        self,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]: ...
+
+    def page(
+        self,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]: ...
+
+    def search(
+        self,
+        keyword: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> list[dict]: ...
+
+    def next_id(self) -> int: ...
+
+    def create(self, fields: dict) -> dict: ...
+
+    def add(self, row: dict) -> dict: ...
+
+    def update(self, task_id: int, fields: dict) -> Optional[dict]: ...
+
+    def delete(self, task_id: int) -> Optional[dict]: ...
+
+    # Bulk versions of create/add/update/delete: one lock acquisition and one
+    # write pass for the whole batch, with one result per item (None for the
+    # updates and deletes of unknown ids).
+    def create_many(self, fields: list[dict]) -> list[dict]: ...
+
+    def add_many(self, rows: list[dict]) -> list[dict]: ...
+
+    def update_many(
+        self, updates: list[tuple[int, dict]]
+    ) -> list[Optional[dict]]: ...
+
+    def delete_many(self, task_ids: list[int]) -> list[Optional[dict]]: ...
+
+    # Version of the table, bumped by every change.
+    def version(self) -> str: ...
+
+    def changes(self, since: Optional[str] = None) -> Changes: ...
+
+
+# Task table kept in memory only, with an id-keyed dict of rows.
+# Two secondary indexes (status -> ids and title -> ids) answer the filters of
+# GET /tasks, a full-text index answers searches, and the highest id is cached
+# so allocating a new id is free. Nothing is persisted: this backend is
+# meant for tests, benchmarks and throwaway instances, and it is the base of
+# the CSV store.
+class MemoryTaskStore:
+    def __init__(self):
+        self._lock = ReadWriteLock()
+        self.fieldnames: list[str] = list(DEFAULT_FIELDNAMES)
+        # id -> row (all values are strings, except 'id' which is an int)
+        self._rows: dict[int, dict] = {}
+        # All ids in ascending order: every backend returns rows in id order,
+        # and pages are cut with a binary search (keyset pagination).
+        self._sorted_ids: list[int] = []
+        self._by_status: dict[str, set[int]] = {}
+        self._by_title: dict[str, set[int]] = {}
+        # Full-text index used by GET /tasks/search.
+        self._search_index = SearchIndex()
+        self._max_id = 0
+        # Change log: every insert or removal bumps the counter, and
+        # '_changes' maps each id to the counter of its last change, oldest
+        # first. Deleted ids stay in it, so deletions can be reported.
+        self._epoch = new_epoch()
+        self._version = 0
+        self._changes: dict[int, int] = {}
+        self._recording = True
+        # Versions older than this one cannot be answered from the log (e.g.
+        # they were issued before this process started).
+        self._log_start = 0
+
+    def _record(self, task_id: int):
+        if not self._recording:
+            return
+        self._version += 1
+        self._changes.pop(task_id, None)
+        self._changes[task_id] = self._version
+
+    def _clear(self):
+        self._rows.clear()
+        self._sorted_ids.clear()
+        self._by_status.clear()
+        self._by_title.clear()
+        self._search_index = SearchIndex()
+        self._max_id = 0
+
+    def refresh(self):
+        pass
+
+    def _index(self, row: dict):
+        self._by_status.setdefault(row["status"], set()).add(row["id"])
+        self._by_title.setdefault(row["title"], set()).add(row["id"])
+        self._search_index.add(
+            row["id"], row["title"], row["description"]
+        )
+
+    def _unindex(self, row: dict):
+        self._search_index.remove(row["id"])
+        for index, key in (
+            (self._by_status, row["status"]),
+            (self._by_title, row["title"]),
+        ):
+            ids = index.get(key)
+            if ids is None:
+                continue
+            ids.discard(row["id"])
+            if not ids:
+                del index[key]
+
+    def _insert(self, row: dict):
+        task_id = row["id"]
+        if task_id in self._rows:
+            # Duplicated id in the file: the last row wins, as it did when
+            # every lookup scanned the file from the top.
+            self._unindex(self._rows[task_id])
+        else:
+            insort(self._sorted_ids, task_id)
+        self._rows[task_id] = row
+        self._index(row)
+        self._max_id = max(self._max_id, task_id)
+        self._record(task_id)
+
+    def _remove(self, task_id: int) -> Optional[dict]:
+        row = self._rows.pop(task_id, None)
+        if row is None:
+            return None
+        self._unindex(row)
+        del self._sorted_ids[bisect_left(self._sorted_ids, task_id)]
+        if task_id == self._max_id:
+            # Only deleting the current maximum invalidates the cached value.
+            self._max_id = max(self._rows, default=0)
+        self._record(task_id)
+        return row
+
+    def _sorted(self, ids) -> list[dict]:
+        return [self._rows[task_id] for task_id in sorted(ids)]
+
+    def all(self) -> list[dict]:
+        with self._lock.read():
+            return [self._rows[task_id] for task_id in self._sorted_ids]
+
+    def get(self, task_id: int) -> Optional[dict]:
+        with self._lock.read():
+            return self._rows.get(task_id)
+
+    def _find_ids(
+        self,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> set[int]:
+        candidates = None
+        for index, key in (
+            (self._by_status, status),
+            (self._by_title, title),
+        ):
+            if key is None:
+                continue
+            ids = index.get(key, set())
+            candidates = (
+                ids if candidates is None else candidates & ids
+            )
+        return candidates
+
+    def find(
+        self,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]:
+        with self._lock.read():
+            if status is None and title is None:
+                return [self._rows[task_id] for task_id in self._sorted_ids]
+            return self._sorted(self._find_ids(status, title))
+
+    def page(
+        self,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        status: Optional[str] = None,
+        title: Optional[str] = None,
+    ) -> list[dict]:
+        # Keyset pagination: rows are ordered by id and a page starts right
+        # after the last id of the previous page, found with a binary search.
+        # Unlike an offset, the cursor stays valid while tasks are added or
+        # deleted, and a page costs the same wherever it is in the table.
+        with self._lock.read():
+            if status is None and title is None:
+                ids = self._sorted_ids
+            else:
+                ids = sorted(self._find_ids(status, title))
+            start = 0 if after is None else bisect_right(ids, after)
+            end = None if limit is None else start + limit
+            return [self._rows[task_id] for task_id in ids[start:end]]
+
+    def search(
+        self,
+        keyword: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> list[dict]:
+        with self._lock.read():
+            ids = self._search_index.search(keyword)
+            end = None if limit is None else offset + limit
+            return [self._rows[task_id] for task_id in ids[offset:end]]
+
+    def next_id(self) -> int:
+        return self._max_id + 1
+
+    def _numbered(self, fields: list[dict]) -> list[dict]:
+        # Give new tasks a contiguous range of ids, allocated once.
+        first_id = self.next_id()
+        return [
+            {**task_fields, "id": first_id + offset}
+            for offset, task_fields in enumerate(fields)
+        ]
+
+    def _put(self, task_id: int, fields: dict) -> Optional[dict]:
+        row = self._rows.get(task_id)
+        if row is None:
+            return None
+        row = {**row, **fields, "id": task_id}
+        self._insert(row)
+        return row
+
+    def create(self, fields: dict) -> dict:
+        return self.create_many([fields])[0]
+
+    def create_many(self, fields: list[dict]) -> list[dict]:
+        with self._lock.write():
+            return self.add_many(self._numbered(fields))
+
+    def add(self, row: dict) -> dict:
+        return self.add_many([row])[0]
+
+    def add_many(self, rows: list[dict]) -> list[dict]:
+        rows = [{**row, "id": int(row["id"])} for row in rows]
+        with self._lock.write():
+            for row in rows:
+                self._insert(row)
+        return rows
+
+    def update(self, task_id: int, fields: dict) -> Optional[dict]:
+        return self.update_many([(task_id, fields)])[0]
+
+    def update_many(
+        self, updates: list[tuple[int, dict]]
+    ) -> list[Optional[dict]]:
+        with self._lock.write():
+            return [
+                self._put(task_id, fields) for task_id, fields in updates
+            ]
+
+    def delete(self, task_id: int) -> Optional[dict]:
+        return self.delete_many([task_id])[0]
+
+    def delete_many(self, task_ids: list[int]) -> list[Optional[dict]]:
+        with self._lock.write():
+            return [self._remove(task_id) for task_id in task_ids]
+
+    def version(self) -> str:
+        return f"{self._epoch}.{self._version}"
+
+    def changes(self, since: Optional[str] = None) -> Changes:
+        with self._lock.read():
+            version = self.version()
+            since_version = parse_version(since, self._epoch)
+            if (
+                since_version is None
+                or since_version > self._version
+                or since_version < self._log_start
+            ):
+                rows = [self._rows[task_id] for task_id in self._sorted_ids]
+                return Changes(version, rows, [], True)
+            # Walk the log from the newest change back to 'since': the cost
+            # depends on the number of changes, not on the size of the table.
+            rows, deleted = [], []
+            for task_id in reversed(self._changes):
+                if self._changes[task_id] <= since_version:
+                    break
+                row = self._rows.get(task_id)
+                if row is None:
+                    deleted.append(task_id)
+                else:
+                    rows.append(row)
+            rows.reverse()
+            deleted.reverse()
+            return Changes(version, rows, deleted, False)
+
+
+# Task table stored in a CSV file, with an in-memory copy.
+# The file is parsed once into a MemoryTaskStore, so a point lookup is a
+# single dict access instead of a full file scan.
+#
+# Writes are log-structured: new tasks are appended to the CSV file, while
+# updates and deletes are appended to a journal file next to it
+# ("tasks.csv.journal") as JSON lines. Loading the store replays the journal
+# over the CSV rows, and once the journal is big enough it is compacted into
+# a new CSV file that atomically replaces the old one. Every mutation therefore
+# writes a single line, whatever the size of the table.
+#
+# The store is safe to use from several threads and several processes (uvicorn
+# workers). Reads share an in-process reader/writer lock, and every write holds
+# an exclusive 'fcntl' lock on "tasks.csv.lock". Before writing, a store first
+# reads what the other processes appended to the files since its last sync, so
+# new ids are always allocated from the real maximum id.
+class TaskStore(MemoryTaskStore):
+    def __init__(self, filename: str):
+        super().__init__()
+        self.filename = filename
+        self.journal = journal_filename(filename)
+        # Protects the in-memory state and the files against the background
+        # compactor, concurrent requests of the threadpool and other workers.
+        self._lock = StorageLock(lock_filename(filename))
+        # Number of compactions done on the files, stored in the lock file.
+        # Replaced files can get the inode of older ones, so the signatures
+        # alone cannot tell an append from a compaction by another process.
+        self.generation = ""
+        # Background thread running the last compaction, if any.
+        self.compactor: Optional[threading.Thread] = None
+        # Ids with at least one entry in the journal. A new task with one of
+        # these ids (the id of a deleted task can be reused) must go to the
+        # journal too, otherwise replaying the journal would delete it again.
+        self._journaled_ids: set[int] = set()
+        self._compacting = False
+        self.signature = None
+        # Versions must mean the same thing in every worker: the epoch is
+        # shared through a file, and the counters are positions in the files
+        # (see _stamp()). Changes are stamped once written.
+        self._epoch = shared_epoch(filename)
+        self._pending: list[int] = []
+        self.load()
+        # The deletions made before this process started are not in its log.
+        self._log_start = self._version
+
+    def _signature(self):
+        return (
+            _file_signature(self.filename),
+            _file_signature(self.journal),
+        )
+
+    def load(self):
+        with self._lock.sync():
+            # The change log survives a full reload: the rows are loaded
+            # without recording anything, then compared with the previous ones.
+            previous = self._rows
+            self._rows = {}
+            self._recording = False
+            try:
+                self._load()
+            finally:
+                self._recording = True
+            for task_id, row in self._rows.items():
+                if previous.get(task_id) != row:
+                    self._record(task_id)
+            for task_id in previous.keys() - self._rows.keys():
+                self._record(task_id)
+            self._stamp()
+
+    def _record(self, task_id: int):
+        if self._recording:
+            self._pending.append(task_id)
+
+    def _stamp(self):
+        # The counter of a version is the total size of the CSV file and the
+        # journal, plus the size they had before the previous compactions
+        # (the offset kept with the generation). Between two compactions both
+        # files only grow, so a change written after another one always gets
+        # a bigger counter, whichever worker wrote or read it. A worker may
+        # stamp a change later than the one writing it: the change is then
+        # reported once more, never missed.
+        _, offset = _parse_generation(self.generation)
+        version = offset + sum(
+            signature[1]
+            for signature in self.signature
+            if signature is not None
+        )
+        if self._pending:
+            # A file rewritten by hand can be smaller than before: counters
+            # still increase in this process.
+            version = max(version, self._version + 1)
+            for task_id in self._pending:
+                self._changes.pop(task_id, None)
+                self._changes[task_id] = version
+            self._pending.clear()
+        self._version = max(version, self._version)
+
+    def _load(self):
+        self._clear()
+        self._journaled_ids.clear()
+        self.signature = self._signature()
+        self.generation = self._read_generation()
+        if os.path.exists(self.filename):
+            with open(self.filename, newline="") as csvfile:
+                reader = csv.DictReader(csvfile)
+                if reader.fieldnames:
+                    self.fieldnames = list(reader.fieldnames)
+                self._read_rows(reader)
+        if os.path.exists(self.journal):
+            with open(self.journal) as journal:
+                self._replay(journal)
+
+    def _read_rows(self, reader):
+        for row in reader:
+            row["id"] = int(row["id"])
+            self._insert(row)
+
+    def _read_generation(self) -> str:
+        try:
+            with open(lock_filename(self.filename)) as lockfile:
+                return lockfile.read()
+        except FileNotFoundError:
+            return ""
+
+    def refresh(self):
+        # Cheap check done on every request: two os.stat() calls.
+        if self._signature() == self.signature:
+            return
+        with self._lock.sync():
+            self._sync()
+
+    def _sync(self):
+        # Catch up with the changes made by other processes. The lock on the
+        # files must be held. As both files are append-only between two
+        # compactions, only the new bytes are read; anything else (a compaction
+        # or a file rewritten by hand) triggers a full reload.
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        if self._read_generation() != self.generation:
+            self.load()
+            return
+        old_csv, old_journal = self.signature
+        new_csv, new_journal = signature
+        csv_offset = (
+            None if old_csv == new_csv else _appended_from(old_csv, new_csv)
+        )
+        if old_journal == new_journal:
+            journal_offset = None
+        elif old_journal is None and new_journal is not None:
+            journal_offset = 0
+        else:
+            journal_offset = _appended_from(old_journal, new_journal)
+        if (old_csv != new_csv and csv_offset is None) or (
+            old_journal != new_journal and journal_offset is None
+        ):
+            self.load()
+            return
+        if csv_offset is not None:
+            with open(self.filename, newline="") as csvfile:
+                csvfile.seek(csv_offset)
+                self._read_rows(
+                    csv.DictReader(csvfile, fieldnames=self.fieldnames)
+                )
+        if journal_offset is not None:
+            with open(self.journal) as journal:
+                journal.seek(journal_offset)
+                self._replay(journal)
+        self.signature = signature
+        self._stamp()
+
+    def _replay(self, lines):
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            self._journaled_ids.add(_entry_id(entry))
+            if entry["op"] == "put":
+                self._insert(entry["row"])
+            else:
+                self._remove(entry["id"])
+
+    def create_many(self, fields: list[dict]) -> list[dict]:
+        # Allocate the ids and write the rows while holding the lock on the
+        # files, so two workers can never hand out the same id.
+        with self._lock.write():
+            self._sync()
+            return self.add_many(self._numbered(fields))
+
+    def add_many(self, rows: list[dict]) -> list[dict]:
+        rows = [{**row, "id": int(row["id"])} for row in rows]
+        with self._lock.write():
+            self._sync()
+            new_rows = [
+                row for row in rows if row["id"] not in self._journaled_ids
+            ]
+            if new_rows:
+                # All the new rows are appended with a single write.
+                with open(
+                    self.filename, mode="a", newline=""
+                ) as csvfile:
+                    writer = csv.DictWriter(
+                        csvfile,
+                        fieldnames=self.fieldnames,
+                        extrasaction="ignore",
+                    )
+                    if self.signature[0] is None:
+                        writer.writeheader()
+                    writer.writerows(new_rows)
+            self._append_journal(
+                [
+                    {"op": "put", "row": row}
+                    for row in rows
+                    if row["id"] in self._journaled_ids
+                ]
+            )
+            for row in rows:
+                self._insert(row)
+            self.signature = self._signature()
+            self._stamp()
+        return rows
+
+    def update_many(
+        self, updates: list[tuple[int, dict]]
+    ) -> list[Optional[dict]]:
+        with self._lock.write():
+            self._sync()
+            # Rows are replaced, never mutated in place, so a compaction can
+            # work on a shallow copy of the table without holding the lock.
+            rows = [
+                self._put(task_id, fields) for task_id, fields in updates
+            ]
+            self._append_journal(
+                [{"op": "put", "row": row} for row in rows if row]
+            )
+            self.signature = self._signature()
+            self._stamp()
+        self._maybe_compact()
+        return rows
+
+    def delete_many(self, task_ids: list[int]) -> list[Optional[dict]]:
+        with self._lock.write():
+            self._sync()
+            rows = [self._remove(task_id) for task_id in task_ids]
+            self._append_journal(
+                [
+                    {"op": "delete", "id": row["id"]}
+                    for row in rows
+                    if row
+                ]
+            )
+            self.signature = self._signature()
+            self._stamp()
+        self._maybe_compact()
+        return rows
+
+    def _append_journal(self, entries: list[dict]):
+        if not entries:
+            return
+        with open(self.journal, mode="a") as journal:
+            journal.write(
+                "".join(json.dumps(entry) + "\n" for entry in entries)
+            )
+        self._journaled_ids.update(_entry_id(entry) for entry in entries)
+
+    def _maybe_compact(self):
+        with self._lock.read():
+            if self._compacting:
+                return
+            journal = _file_signature(self.journal)
+            if journal is None or journal[1] < JOURNAL_COMPACTION_THRESHOLD:
+                return
+            self.compactor = threading.Thread(
+                target=self.compact, daemon=True
+            )
+            self.compactor.start()
+
+    def compact(self):
+        # 1. Take a snapshot of the table and remember which part of the files
+        #    it contains. This is the only step that blocks writers besides the
+        #    final swap, and it is an in-memory copy.
+        with self._lock.write():
+            if self._compacting:
+                return
+            self._compacting = True
+            self._sync()
+            rows = list(self._rows.values())
+            fieldnames = list(self.fieldnames)
+            snapshot_csv, snapshot_journal = self.signature
+            snapshot_generation = self.generation
+        temporary_filename = f"{self.filename}.{os.getpid()}.compacting"
+        try:
+            # 2. Write the snapshot to a temporary file, without the lock.
+            with open(
+                temporary_filename, mode="w", newline=""
+            ) as csvfile:
+                writer = csv.DictWriter(
+                    csvfile,
+                    fieldnames=fieldnames,
+                    extrasaction="ignore",
+                )
+                writer.writeheader()
+                writer.writerows(rows)
+            # 3. Swap the files. What was written since the snapshot (by this
+            #    or another process) is carried over: new CSV rows are copied
+            #    at the end of the new file, and journal entries are kept in a
+            #    new, shorter journal.
+            with self._lock.write():
+                self._sync()
+                if self.generation != snapshot_generation:
+                    # Another process compacted the files in the meantime.
+                    return
+                csv_now, journal_now = self.signature
+                # Counters go on from the size of the files being replaced.
+                compactions, offset = _parse_generation(self.generation)
+                offset += sum(
+                    signature[1]
+                    for signature in self.signature
+                    if signature is not None
+                )
+                new_rows = b""
+                with open(temporary_filename, mode="ab") as csvfile:
+                    if snapshot_csv is not None and csv_now is not None:
+                        with open(self.filename, mode="rb") as current:
+                            current.seek(snapshot_csv[1])
+                            new_rows = current.read()
+                            csvfile.write(new_rows)
+                    csvfile.flush()
+                    os.fsync(csvfile.fileno())
+                tail = ""
+                if journal_now is not None:
+                    with open(self.journal) as journal:
+                        if snapshot_journal is not None:
+                            journal.seek(snapshot_journal[1])
+                        tail = journal.read()
+                os.replace(temporary_filename, self.filename)
+                if tail:
+                    with atomic_write(self.journal) as journal:
+                        journal.write(tail)
+                elif journal_now is not None:
+                    os.remove(self.journal)
+                self._journaled_ids = {
+                    _entry_id(json.loads(line))
+                    for line in tail.splitlines()
+                    if line.strip()
+                }
+                self.signature = self._signature()
+                self.generation = f"{compactions + 1} {offset}"
+                with open(lock_filename(self.filename), "w") as lockfile:
+                    lockfile.write(self.generation)
+        finally:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            with self._lock.write():
+                self._compacting = False
+
+
+# One store per database file, shared by every request of the process.
+_stores: dict[str, TaskStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_task_store(filename: str) -> TaskStore:
+    store = _stores.get(filename)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(filename)
+            if store is None:
+                store = _stores[filename] = TaskStore(filename)
+                return store
+    store.refresh()
+    return store
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import pytest
+
+import async_operations
+import operations
+from conftest import TEST_TASKS
+from models import Task
+
+@pytest.mark.asyncio
+async def test_async_operations_read_and_write():
+    tasks = await async_operations.read_all_tasks()
+    assert [task.model_dump() for task in tasks] == TEST_TASKS
+
+    created = await async_operations.create_task(
+        Task(title="Async", description="Task", status="Open")
+    )
+    assert created.id == 3
+    assert (await async_operations.read_task(3)) == created
+    assert [
+        task.id async for task in async_operations.iter_tasks(after=1)
+    ] == [2, 3]
+
+    assert await async_operations.modify_task(3, {"status": "Done"})
+    assert (await async_operations.remove_task(3)).status == "Done"
+    assert await async_operations.read_task(3) is None
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_reads_are_coalesced():
+    release = threading.Event()
+    calls = []
+    read_all_tasks = operations.read_all_tasks
+
+    def slow_read_all_tasks():
+        calls.append(1)
+        release.wait(timeout=5)
+        return read_all_tasks()
+
+    with patch(
+        "operations.read_all_tasks", slow_read_all_tasks
+    ):
+        reads = [
+            asyncio.ensure_future(async_operations.read_all_tasks())
+            for _ in range(10)
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(*reads)
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+
+@pytest.mark.asyncio
+async def test_read_after_write_is_not_coalesced_with_older_read():
+    release = threading.Event()
+    read_all_tasks = operations.read_all_tasks
+
+    def slow_read_all_tasks():
+        release.wait(timeout=5)
+        return read_all_tasks()
+
+    with patch(
+        "operations.read_all_tasks", slow_read_all_tasks
+    ):
+        # Started before the write, this read may or may not see it...
+        first = asyncio.ensure_future(async_operations.read_all_tasks())
+        await asyncio.sleep(0.05)
+        await async_operations.create_task(
+            Task(title="New", description="Task", status="Open")
+        )
+        # ...but a read started after the write must see it.
+        second = asyncio.ensure_future(async_operations.read_all_tasks())
+        release.set()
+        await first
+        assert [task.id for task in await second] == [1, 2, 3]
+
+@pytest.mark.asyncio
+async def test_writers_are_serialized():
+    running = []
+    overlaps = []
+    create_task = operations.create_task
+
+    def tracked_create_task(task):
+        running.append(1)
+        if len(running) > 1:
+            overlaps.append(1)
+        try:
+            return create_task(task)
+        finally:
+            running.pop()
+
+    with patch("operations.create_task", tracked_create_task):
+        created = await asyncio.gather(
+            *(
+                async_operations.create_task(
+                    Task(title=f"Task {number}", description="", status="Open")
+                )
+                for number in range(20)
+            )
+        )
+    assert not overlaps
+    assert sorted(task.id for task in created) == list(range(3, 23))
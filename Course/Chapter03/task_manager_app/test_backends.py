@@ -0,0 +1,145 @@
+import pytest
+
+from backends import BACKENDS, get_backend
+from snapshot import ReadOnlyStoreError, write_snapshot
+
+TASKS = [
+    {"title": "Buy milk", "description": "Lala brand", "status": "Ongoing"},
+    {"title": "Buy pizza", "description": "Pepperoni", "status": "Finished"},
+    {"title": "Read", "description": "A book about milk", "status": "Ongoing"},
+]
+
+
+WRITABLE_BACKENDS = [name for name in BACKENDS if name != "snapshot"]
+
+
+def make_backend(name, tmp_path):
+    filename = str(tmp_path / f"tasks.{name}")
+    if name == "snapshot":
+        # Read-only: the file is written beforehand.
+        write_snapshot(
+            [{**task, "id": id} for id, task in enumerate(TASKS, 1)],
+            filename,
+        )
+        return get_backend(name, filename)
+    backend = get_backend(name, filename)
+    for task in TASKS:
+        backend.create(task)
+    return backend
+
+
+# Every backend must behave the same way, so the same tests run on each of them.
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    return make_backend(request.param, tmp_path)
+
+
+def test_backend_reads(backend):
+    assert [row["id"] for row in backend.all()] == [1, 2, 3]
+    assert backend.get(2)["title"] == "Buy pizza"
+    assert backend.get(9) is None
+    assert backend.next_id() == 4
+
+
+def test_backend_filters_and_pages(backend):
+    assert [row["id"] for row in backend.find(status="Ongoing")] == [1, 3]
+    assert [
+        row["id"] for row in backend.find(status="Ongoing", title="Read")
+    ] == [3]
+    assert [row["id"] for row in backend.page(after=1, limit=1)] == [2]
+    assert [
+        row["id"] for row in backend.page(after=1, status="Ongoing")
+    ] == [3]
+
+
+def test_backend_search(backend):
+    assert [row["id"] for row in backend.search("MILK")] == [1, 3]
+    assert [row["id"] for row in backend.search("milk", limit=1, offset=1)] == [3]
+
+
+# Case folding is not limited to ASCII letters.
+@pytest.mark.parametrize("backend", WRITABLE_BACKENDS, indirect=True)
+def test_backend_search_non_ascii(backend):
+    backend.create(
+        {"title": "Élan vital", "description": "", "status": "Ongoing"}
+    )
+    assert [row["id"] for row in backend.search("élan")] == [4]
+    assert [row["id"] for row in backend.search("ÉLAN VITAL")] == [4]
+
+
+# Every list of rows comes in id order, whatever the order of the writes.
+@pytest.mark.parametrize("backend", WRITABLE_BACKENDS, indirect=True)
+def test_backend_id_order(backend):
+    backend.delete(1)
+    backend.add({**TASKS[0], "id": 1})
+    assert [row["id"] for row in backend.all()] == [1, 2, 3]
+    assert [row["id"] for row in backend.find(status="Ongoing")] == [1, 3]
+    assert [row["id"] for row in backend.search("milk")] == [1, 3]
+    assert [row["id"] for row in backend.changes().rows] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("backend", WRITABLE_BACKENDS, indirect=True)
+def test_backend_writes(backend):
+    assert backend.update(1, {"status": "Finished"})["status"] == "Finished"
+    assert backend.update(9, {"status": "Finished"}) is None
+    assert [row["id"] for row in backend.find(status="Finished")] == [1, 2]
+
+    assert backend.delete(3)["title"] == "Read"
+    assert backend.delete(3) is None
+    assert backend.next_id() == 3
+    assert backend.create(TASKS[2])["id"] == 3
+    assert backend.get(3)["title"] == "Read"
+
+
+@pytest.mark.parametrize("backend", WRITABLE_BACKENDS, indirect=True)
+def test_backend_bulk_writes(backend):
+    created = backend.create_many(TASKS)
+    assert [row["id"] for row in created] == [4, 5, 6]
+    assert backend.get(6)["title"] == "Read"
+
+    updated = backend.update_many(
+        [(4, {"status": "Finished"}), (9, {"status": "Finished"})]
+    )
+    assert updated[0]["status"] == "Finished"
+    assert updated[1] is None
+
+    deleted = backend.delete_many([5, 9, 6])
+    assert [row and row["id"] for row in deleted] == [5, None, 6]
+    assert [row["id"] for row in backend.all()] == [1, 2, 3, 4]
+    # A deleted id is given again by the next bulk creation.
+    assert [row["id"] for row in backend.create_many(TASKS[:1])] == [5]
+
+
+@pytest.mark.parametrize("backend", WRITABLE_BACKENDS, indirect=True)
+def test_backend_changes(backend):
+    first = backend.changes()
+    assert first.reset
+    assert [row["id"] for row in first.rows] == [1, 2, 3]
+    assert backend.changes(first.version) == (first.version, [], [], False)
+
+    backend.update(2, {"status": "Ongoing"})
+    backend.delete(1)
+    backend.create_many(TASKS[:1])
+    changes = backend.changes(first.version)
+    assert not changes.reset
+    assert [row["id"] for row in changes.rows] == [2, 4]
+    assert changes.deleted == [1]
+    assert changes.version == backend.version() != first.version
+
+    assert backend.changes("elsewhere.1").reset
+
+
+def test_snapshot_backend_is_read_only(tmp_path):
+    backend = make_backend("snapshot", tmp_path)
+    with pytest.raises(ReadOnlyStoreError):
+        backend.create(TASKS[0])
+    with pytest.raises(ReadOnlyStoreError):
+        backend.delete_many([1])
+    assert backend.changes(backend.version()) == (
+        backend.version(), [], [], False
+    )
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        get_backend("mongodb", str(tmp_path / "tasks"))
@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import operations
+from locking import ReadWriteLock
+from store import TaskStore
+
+
+def test_readers_share_the_lock_and_writers_wait():
+    lock = ReadWriteLock()
+    events = []
+
+    def writer():
+        with lock.write():
+            events.append("write")
+
+    with lock.read():
+        with lock.read():
+            thread = threading.Thread(target=writer)
+            thread.start()
+            time.sleep(0.05)
+            # The writer is blocked while the readers hold the lock.
+            assert events == []
+    thread.join()
+    assert events == ["write"]
+
+
+def test_write_lock_is_reentrant():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                assert lock.owned()
+    assert not lock.owned()
+
+
+def test_two_stores_on_the_same_file_see_each_other_writes():
+    # Two stores on the same file behave like two uvicorn workers.
+    first = TaskStore(operations.DATABASE_FILENAME)
+    second = TaskStore(operations.DATABASE_FILENAME)
+
+    assert first.create({"title": "A", "description": "", "status": "Open"})["id"] == 3
+    assert second.create({"title": "B", "description": "", "status": "Open"})["id"] == 4
+    second.update(3, {"status": "Done"})
+    first.delete(4)
+
+    first.refresh()
+    second.refresh()
+    assert first.all() == second.all()
+    assert first.get(3)["status"] == "Done"
+    assert second.get(4) is None
+
+
+def test_concurrent_threads_get_unique_ids():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        ids = list(
+            executor.map(
+                lambda number: operations.get_store().create(
+                    {"title": f"T{number}", "description": "", "status": "Open"}
+                )["id"],
+                range(50),
+            )
+        )
+    assert sorted(ids) == list(range(3, 53))
+
+
+def _create_tasks(filename: str, count: int):
+    store = TaskStore(filename)
+    for number in range(count):
+        store.create(
+            {"title": f"T{number}", "description": "", "status": "Open"}
+        )
+
+
+def test_concurrent_processes_get_unique_ids():
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(
+            target=_create_tasks,
+            args=(operations.DATABASE_FILENAME, 25),
+        )
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    ids = [row["id"] for row in TaskStore(operations.DATABASE_FILENAME).all()]
+    assert sorted(ids) == list(range(1, 103))
+
+
+def _mutate_tasks(filename: str, count: int):
+    store = TaskStore(filename)
+    for number in range(count):
+        row = store.create(
+            {"title": f"T{number}", "description": "", "status": "Open"}
+        )
+        store.update(row["id"], {"status": "Done"})
+        if number % 3 == 0:
+            store.delete(row["id"])
+    if store.compactor:
+        store.compactor.join()
+
+
+def test_concurrent_processes_with_compactions():
+    context = multiprocessing.get_context("fork")
+    # Compact very often, while the other workers keep writing.
+    with patch("store.JOURNAL_COMPACTION_THRESHOLD", 500):
+        workers = [
+            context.Process(
+                target=_mutate_tasks,
+                args=(operations.DATABASE_FILENAME, 30),
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    rows = TaskStore(operations.DATABASE_FILENAME).all()
+    assert len(rows) == 2 + 4 * 20
+    assert len({row["id"] for row in rows}) == len(rows)
+    assert all(row["status"] == "Done" for row in rows[2:])
@@ -1,7 +1,9 @@
+import json
+
 # To test the endpoints, FastAPI provides a specific TestClient class that allows the testing of the endpoints without running the server.
 from fastapi.testclient import TestClient
 from main import app
-from conftest import TEST_TASKS
+from conftest import TEST_TASKS, TEST_TASKS_CSV
 from operations import (
     read_all_tasks,
     read_task,
@@ -72,3 +74,180 @@ def test_endpoint_delete_task():
 
 
 
+# GET /tasks/search endpoint
+def test_endpoint_search_tasks():
+    response = client.get(
+        "/tasks/search", params={"keyword": "two"}
+    )
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json()] == [2]
+
+    # Substrings still match, even across title and description.
+    response = client.get(
+        "/tasks/search", params={"keyword": "onetest desc"}
+    )
+    assert response.json() == [
+        {**TEST_TASKS_CSV[0], "id": 1}
+    ]
+
+    response = client.get(
+        "/tasks/search",
+        params={"keyword": "test", "limit": 1, "offset": 1},
+    )
+    assert [task["id"] for task in response.json()] == [2]
+
+# GET /tasks pagination, projection and streaming
+def test_endpoint_read_tasks_by_pages():
+    response = client.get("/tasks", params={"limit": 1})
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json()] == [1]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(
+        "/tasks", params={"limit": 1, "after": cursor}
+    )
+    assert [task["id"] for task in response.json()] == [2]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(
+        "/tasks", params={"limit": 1, "after": cursor}
+    )
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+def test_endpoint_read_tasks_with_fields():
+    response = client.get(
+        "/tasks", params={"fields": "title", "status": "Ongoing"}
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": 2, "title": "Test Task Two"}
+    ]
+
+    response = client.get("/tasks", params={"fields": "owner"})
+    assert response.status_code == 400
+
+def test_endpoint_stream_tasks_as_ndjson():
+    response = client.get(
+        "/v2/tasks",
+        params={"format": "ndjson", "fields": "priority"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [
+        json.loads(line) for line in response.text.splitlines()
+    ] == [
+        {"id": 1, "priority": "low"},
+        {"id": 2, "priority": "low"},
+    ]
+
+def test_endpoint_batch_create_update_delete_tasks():
+    response = client.post(
+        "/tasks/batch",
+        json=[
+            {"title": f"Task {number}", "description": "", "status": "Open"}
+            for number in range(3)
+        ],
+    )
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json()] == [3, 4, 5]
+    assert read_task(5).title == "Task 2"
+
+    response = client.patch(
+        "/tasks/batch",
+        json=[{"id": 3, "status": "Done"}, {"id": 9, "status": "Done"}],
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "id": 3,
+            "task": {"title": "Task 0", "description": "", "status": "Done"},
+            "error": None,
+        },
+        {"id": 9, "task": None, "error": "task not found"},
+    ]
+
+    response = client.request("DELETE", "/tasks/batch", json=[4, 9, 5])
+    assert response.status_code == 200
+    assert [result["error"] for result in response.json()] == [
+        None, "task not found", None
+    ]
+    assert [task.id for task in read_all_tasks()] == [1, 2, 3]
+
+def test_endpoint_conditional_get_with_etag():
+    response = client.get("/tasks")
+    etag = response.headers["ETag"]
+
+    response = client.get("/tasks", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    response = client.get("/task/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = client.get("/v2/tasks", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.put("/task/1", json={"status": "Done"})
+    response = client.get("/tasks", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_endpoint_task_changes():
+    response = client.get("/tasks/changes")
+    assert response.status_code == 200
+    changes = response.json()
+    assert changes["reset"] is True
+    assert [task["id"] for task in changes["tasks"]] == [1, 2]
+
+    client.put("/task/2", json={"status": "Done"})
+    client.delete("/task/1")
+    response = client.get(
+        "/tasks/changes", params={"since": changes["version"]}
+    )
+    delta = response.json()
+    assert delta["reset"] is False
+    assert [task["id"] for task in delta["tasks"]] == [2]
+    assert delta["tasks"][0]["status"] == "Done"
+    assert delta["deleted"] == [1]
+
+    response = client.get(
+        "/tasks/changes", params={"since": delta["version"]}
+    )
+    assert response.json()["tasks"] == []
+    assert response.json()["deleted"] == []
+
+    response = client.get("/tasks/changes", params={"since": "unknown.3"})
+    assert response.json()["reset"] is True
+
+# Rate limits: /token accepts 20 requests per minute from an IP. The requests
+# past that are refused by the middleware, before the endpoint runs.
+def test_endpoint_token_rate_limit():
+    response = client.get("/tasks")
+    assert response.headers["RateLimit-Policy"] == "600;w=60;burst=100"
+    for _ in range(20):
+        response = client.post(
+            "/token", data={"username": "johndoe", "password": "wrong"}
+        )
+        assert response.status_code == 400
+    response = client.post(
+        "/token", data={"username": "johndoe", "password": "secret"}
+    )
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+# The other requests are counted per user, for the tokens already resolved,
+# else per IP: made-up tokens do not get a bucket of their own.
+def test_endpoint_api_rate_limit():
+    token = client.post(
+        "/token", data={"username": "johndoe", "password": "secret"}
+    ).json()["access_token"]
+    user = {"Authorization": f"Bearer {token}"}
+    assert client.get("/users/me", headers=user).status_code == 200
+    # The bucket of the IP holds 100 requests, and refills meanwhile.
+    for number in range(200):
+        response = client.get(
+            "/tasks", headers={"Authorization": f"Bearer made-up{number}"}
+        )
+        if response.status_code != 200:
+            break
+    assert response.status_code == 429
+    assert client.get("/users/me", headers=user).status_code == 200
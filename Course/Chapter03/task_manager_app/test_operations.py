@@ -1,12 +1,17 @@
+from unittest.mock import patch
+
 from conftest import TEST_TASKS_CSV
-from models import Task, TaskWithID
+from models import Task, TaskV2WithID, TaskWithID
 from operations import (
     create_task,
     get_next_id,
+    iter_tasks,
     modify_task,
     read_all_tasks,
+    read_all_tasks_v2,
     read_task,
     remove_task,
+    search_tasks_by_keyword,
     write_task_into_csv,
 )
 
@@ -66,4 +71,79 @@ def test_modify_task():
 
 def test_remove_task():
     remove_task(1)
-    assert read_task(1) is None
\ No newline at end of file
+    assert read_task(1) is None
+
+def test_search_tasks_by_keyword():
+    assert search_tasks_by_keyword("missing") == []
+    assert [
+        task.id for task in search_tasks_by_keyword("Task")
+    ] == [1, 2]
+
+    # The index follows creations, updates and deletions.
+    modify_task(1, {"title": "Renamed"})
+    assert [
+        task.id for task in search_tasks_by_keyword("Task")
+    ] == [2]
+    create_task(
+        Task(title="Another task", description="x", status="Open")
+    )
+    remove_task(2)
+    assert [
+        task.id for task in search_tasks_by_keyword("task")
+    ] == [3]
+
+def test_search_tasks_by_keyword_ranking():
+    create_task(
+        Task(title="Inbox", description="One more", status="Open")
+    )
+    # "one" is a whole word in tasks 1 and 3, but only task 1 has it in the title.
+    assert [
+        task.id for task in search_tasks_by_keyword("one")
+    ] == [1, 3]
+    # Whole-word matches first, then matches in the title.
+    create_task(
+        Task(title="Twofold", description="Plan", status="Open")
+    )
+    create_task(
+        Task(title="Plan", description="Two", status="Open")
+    )
+    assert [
+        task.id for task in search_tasks_by_keyword("two")
+    ] == [2, 5, 4]
+    assert [
+        task.id for task in search_tasks_by_keyword("on")
+    ] == [1, 2, 3]
+    # "İ".lower() is two characters long: the words of the description are
+    # still split at the right place.
+    create_task(
+        Task(title="İİİ", description="Kit", status="Open")
+    )
+    assert [
+        task.id for task in search_tasks_by_keyword("kit")
+    ][0] == 6
+
+def test_iter_tasks_walks_the_table_by_batches():
+    for number in range(5):
+        create_task(
+            Task(title=f"Task {number}", description="", status="Open")
+        )
+    with patch("operations.STREAM_BATCH_SIZE", 2):
+        assert [task.id for task in iter_tasks()] == list(range(1, 8))
+        assert [
+            task.id for task in iter_tasks(after=2, limit=3)
+        ] == [3, 4, 5]
+        assert [
+            task.id for task in iter_tasks(status="Open")
+        ] == [3, 4, 5, 6, 7]
+
+def test_trusted_reads_match_validated_models():
+    # Models built without validation compare and serialize like the
+    # validated ones, with the defaults of the model filled in.
+    tasks = read_all_tasks_v2()
+    assert tasks == [
+        TaskV2WithID(**task) for task in TEST_TASKS_CSV
+    ]
+    assert tasks[0].priority == "low"
+    assert tasks[0].model_dump_json() == (
+        TaskV2WithID(**TEST_TASKS_CSV[0]).model_dump_json()
+    )
@@ -0,0 +1,63 @@
+from fastapi.testclient import TestClient
+
+import security
+from main import app
+from security import (
+    fake_token_resolver,
+    invalidate_user,
+    resolve_token,
+    set_token_resolver,
+    token_cache,
+)
+from token_cache import TTLCache
+
+client = TestClient(app)
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1, tag="x")
+    cache.set("b", 2, tag="x")
+    assert cache.get("a") == 1
+    # "b" is now the least recently used entry.
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+    cache.invalidate_tag("x")
+    assert cache.get("a") is None
+    now[0] = 11
+    assert cache.get("c") is None
+    assert cache.stats() == {
+        "size": 0, "maxsize": 2, "hits": 2, "misses": 3
+    }
+
+def test_token_resolution_is_cached():
+    calls = []
+
+    def counting_resolver(token):
+        calls.append(token)
+        return fake_token_resolver(token)
+
+    set_token_resolver(counting_resolver)
+    try:
+        for _ in range(3):
+            response = client.get(
+                "/users/me",
+                headers={"Authorization": "Bearer tokenizedjohndoe"},
+            )
+            assert response.json() == {"username": "johndoe"}
+        assert calls == ["tokenizedjohndoe"]
+
+        # Unknown tokens are resolved every time, and never cached.
+        assert resolve_token("tokenizedsomeone") is None
+        assert resolve_token("tokenizedsomeone") is None
+        assert len(token_cache) == 1
+
+        invalidate_user("johndoe")
+        assert resolve_token("tokenizedjohndoe").username == "johndoe"
+        assert calls.count("tokenizedjohndoe") == 2
+    finally:
+        set_token_resolver(fake_token_resolver)
+    assert security.token_resolver is fake_token_resolver
+    assert len(token_cache) == 0
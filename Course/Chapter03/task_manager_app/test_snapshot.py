@@ -0,0 +1,94 @@
+import csv
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import operations
+from conftest import TEST_TASKS_CSV
+from main import app
+from snapshot import (
+    SnapshotTaskStore,
+    TaskSnapshot,
+    csv_to_snapshot,
+    snapshot_to_csv,
+    write_snapshot,
+)
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot = str(tmp_path / "tasks.snapshot")
+    csv_copy = str(tmp_path / "tasks.csv")
+    csv_to_snapshot(operations.DATABASE_FILENAME, snapshot)
+    snapshot_to_csv(snapshot, csv_copy)
+
+    with open(csv_copy, newline="") as csvfile:
+        assert list(csv.DictReader(csvfile)) == TEST_TASKS_CSV
+
+
+def test_snapshot_reads(tmp_path):
+    filename = str(tmp_path / "tasks.snapshot")
+    write_snapshot(
+        [
+            {"id": 3, "title": "Café", "description": "", "status": "Open", "priority": "high"},
+            {"id": 1, "title": "One", "description": "First", "status": "Done"},
+            {"id": 2, "title": "Two", "description": "Second", "status": "Open"},
+        ],
+        filename,
+    )
+    with TaskSnapshot(filename) as snapshot:
+        assert len(snapshot) == 3
+        # Rows keep the order they were written in.
+        assert list(snapshot.ids) == [3, 1, 2]
+        assert snapshot.row(0) == {
+            "id": 3,
+            "title": "Café",
+            "description": "",
+            "status": "Open",
+            "priority": "high",
+        }
+        assert snapshot.row(2)["description"] == "Second"
+        assert "priority" not in snapshot.row(2)
+        assert [row["status"] for row in snapshot] == ["Open", "Done", "Open"]
+
+
+def test_snapshot_store_filters_on_the_status_column(tmp_path):
+    filename = str(tmp_path / "tasks.snapshot")
+    write_snapshot(
+        [
+            {"id": 3, "title": "Élan", "description": "", "status": "Open"},
+            {"id": 1, "title": "One", "description": "First", "status": "Done"},
+            {"id": 2, "title": "Two", "description": "Second", "status": "Open"},
+        ],
+        filename,
+    )
+    store = SnapshotTaskStore(filename)
+    # Rows come in id order, as with the other backends.
+    assert [row["id"] for row in store.find(status="Open")] == [2, 3]
+    assert store.find(status="Open", title="Élan")[0]["id"] == 3
+    assert store.find(status="Unknown") == []
+    assert [row["id"] for row in store.page(status="Open")] == [2, 3]
+    assert store.get(1)["description"] == "First"
+
+    # Replacing the file is picked up by the next refresh.
+    version = store.version()
+    csv_to_snapshot(operations.DATABASE_FILENAME, filename)
+    store.refresh()
+    assert store.version() != version
+    assert [row["id"] for row in store.find(status="Ongoing")] == [2]
+
+
+def test_snapshot_backend_serves_the_api(tmp_path):
+    filename = str(tmp_path / "tasks.snapshot")
+    csv_to_snapshot(operations.DATABASE_FILENAME, filename)
+    client = TestClient(app)
+    with patch("operations.STORAGE_BACKEND", "snapshot"), patch(
+        "operations.DATABASE_FILENAME", filename
+    ):
+        response = client.get("/tasks", params={"status": "Ongoing"})
+        assert response.status_code == 200
+        assert response.json() == [{**TEST_TASKS_CSV[1], "id": 2}]
+        response = client.post(
+            "/task",
+            json={"title": "New", "description": "", "status": "Open"},
+        )
+        assert response.status_code == 405
@@ -0,0 +1,146 @@
+import csv
+import os
+from unittest.mock import patch
+
+import operations
+from conftest import TEST_TASKS_CSV
+from models import Task
+from operations import filter_tasks, get_store
+from store import TaskStore, get_task_store, journal_filename
+
+
+def test_store_is_loaded_once():
+    assert get_store() is get_store()
+
+
+def test_store_point_lookup():
+    store = get_store()
+    assert store.get(2)["title"] == TEST_TASKS_CSV[1]["title"]
+    assert store.get(42) is None
+
+
+def test_filter_tasks_uses_indexes():
+    assert [task.id for task in filter_tasks(status="Ongoing")] == [2]
+    assert [
+        task.id
+        for task in filter_tasks(
+            status="Incomplete", title="Test Task One"
+        )
+    ] == [1]
+    assert filter_tasks(status="Unknown") == []
+
+
+def test_store_reloads_when_file_changes():
+    store = get_store()
+    # Append a row behind the store's back, as another process would do.
+    with open(operations.DATABASE_FILENAME, "a", newline="") as csvfile:
+        csvfile.write("7,External,Added by hand,Open\r\n")
+    assert get_task_store(operations.DATABASE_FILENAME) is store
+    assert store.get(7)["title"] == "External"
+    assert store.next_id() == 8
+
+
+def test_next_id_after_removing_the_last_task():
+    store = get_store()
+    store.delete(2)
+    assert store.next_id() == 2
+
+
+def test_updates_and_deletes_go_to_the_journal():
+    store = get_store()
+    with open(operations.DATABASE_FILENAME) as csvfile:
+        csv_before = csvfile.read()
+
+    operations.modify_task(1, {"status": "Finished"})
+    operations.remove_task(2)
+
+    # The CSV file is untouched, the mutations were appended to the journal.
+    with open(operations.DATABASE_FILENAME) as csvfile:
+        assert csvfile.read() == csv_before
+    with open(journal_filename(operations.DATABASE_FILENAME)) as journal:
+        assert len(journal.readlines()) == 2
+
+    # A fresh store replays the journal over the CSV rows.
+    reloaded = TaskStore(operations.DATABASE_FILENAME)
+    assert reloaded.all() == store.all()
+    assert reloaded.get(1)["status"] == "Finished"
+    assert reloaded.get(2) is None
+
+
+def test_reused_id_after_delete_survives_a_reload():
+    operations.remove_task(2)
+    operations.create_task(
+        Task(title="Again", description="Reused id", status="Open")
+    )
+    assert TaskStore(operations.DATABASE_FILENAME).get(2)["title"] == "Again"
+
+
+def test_compaction_folds_the_journal_into_the_csv():
+    store = get_store()
+    operations.modify_task(2, {"title": "Compacted"})
+    store.compact()
+
+    assert not os.path.exists(
+        journal_filename(operations.DATABASE_FILENAME)
+    )
+    with open(operations.DATABASE_FILENAME, newline="") as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    assert [row["title"] for row in rows] == ["Test Task One", "Compacted"]
+    assert get_task_store(operations.DATABASE_FILENAME) is store
+
+
+def test_compaction_starts_in_background_past_threshold():
+    store = get_store()
+    with patch("store.JOURNAL_COMPACTION_THRESHOLD", 1):
+        operations.modify_task(1, {"status": "Finished"})
+        store.compactor.join()
+
+    assert not os.path.exists(
+        journal_filename(operations.DATABASE_FILENAME)
+    )
+    assert TaskStore(operations.DATABASE_FILENAME).get(1)["status"] == "Finished"
+
+
+def test_change_log_survives_a_full_reload():
+    store = get_store()
+    version = store.version()
+    # Rewrite the file behind the store's back: it is reloaded from scratch,
+    # and only the rows that differ are reported as changes.
+    with open(operations.DATABASE_FILENAME, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=TEST_TASKS_CSV[0])
+        writer.writeheader()
+        writer.writerow({**TEST_TASKS_CSV[0], "status": "Done"})
+        writer.writerow({**TEST_TASKS_CSV[1], "id": "3"})
+    store.refresh()
+    changes = store.changes(version)
+    assert not changes.reset
+    assert [row["id"] for row in changes.rows] == [1, 3]
+    assert changes.deleted == [2]
+
+
+def test_versions_are_shared_by_the_workers():
+    # Two stores on the same file behave like two uvicorn workers.
+    first = TaskStore(operations.DATABASE_FILENAME)
+    second = TaskStore(operations.DATABASE_FILENAME)
+    assert first.version() == second.version()
+    version = first.version()
+
+    second.update(1, {"status": "Done"})
+    first.create({"title": "A", "description": "", "status": "Open"})
+    second.refresh()
+    assert first.version() == second.version()
+    # A version issued by one worker is understood by the other.
+    changes = second.changes(version)
+    assert not changes.reset
+    assert [row["id"] for row in changes.rows] == [1, 3]
+
+    # Compactions do not reset the versions.
+    version = second.version()
+    first.compact()
+    second.refresh()
+    second.delete(2)
+    first.refresh()
+    assert first.version() == second.version()
+    changes = first.changes(version)
+    assert not changes.reset
+    assert changes.deleted == [2]
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+# Bounded cache whose entries expire after 'ttl' seconds.
+# Once 'maxsize' entries are stored, adding one evicts the least recently used
+# entry. An entry can be given a tag (e.g. the username of a cached user), so
+# that every entry of a tag is invalidated at once when the tagged object
+# changes. All operations are O(1) and safe to use from several threads, and
+# the 'hits' and 'misses' counters tell how well the cache works.
+class TTLCache:
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expiry time, tag, value), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        # tag -> keys of the entries with that tag
+        self._tags: dict[Hashable, set] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _discard(self, key):
+        _, tag, _ = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def peek(self, key, default=None):
+        # Like get(), without counting a hit or a miss, nor making the entry
+        # the most recently used (e.g. for the rate limits of main.py).
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            return default
+        return entry[2]
+
+    def set(self, key, value, tag: Optional[Hashable] = None):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (self._clock() + self.ttl, tag, value)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+
+    def invalidate_tag(self, tag: Hashable):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,28 +1,337 @@
-from typing import Optional
+"""
+API keys of the machine clients, stored as their SHA-256 digest with their
+scopes and their quota, and checked against an in-memory cache of the active
+keys without a database query.
+"""
 
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import hashlib
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from typing import Annotated, Callable, Iterable, Optional
+from weakref import WeakKeyDictionary
 
-VALID_API_KEYS = [
-    "verysecureapikey",
-    "anothersecureapi",
-    "onemoresecureapi",
-]
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from pydantic import BaseModel, Field
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
 
+from db_connection import get_async_session, get_async_session_factory
+from models import APIKey
+from permissions import Permission, Principal, permission_table
+from rbac import authorize
 
-async def get_api_key(api_key: Optional[str]):
-    if api_key not in VALID_API_KEYS:
-        raise HTTPException(
-            status_code=403, detail="Invalid API Key"
+
+# The cache is reloaded after any committed change to the keys in this
+# process, and every API_KEY_CACHE_TTL seconds for the changes made by other
+# workers (a revoked key stays usable that long in them).
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "60"))
+# Keys accepted before they were stored in the database (the former
+# VALID_API_KEYS list), space-separated. The app adds the missing ones to the
+# table at startup. Opt-in: the former keys are public, so set it only while
+# their clients move to new keys, then revoke them and unset it.
+API_KEYS_SEED = os.getenv("API_KEYS_SEED", "")
+
+
+def generate_api_key() -> str:
+    return "sk_" + secrets.token_urlsafe(32)
+
+
+# A fast hash is enough: unlike a password, a random key of 256 bits cannot be
+# guessed from its digest.
+def hash_api_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# What the cache keeps of a key: an immutable copy of its row.
+@dataclass(frozen=True)
+class APIKeyRecord:
+    id: int
+    name: str
+    scopes: frozenset[str]
+    rate_limit: int
+    burst: int
+
+
+class APIKeyCache:
+    def __init__(
+        self,
+        ttl: float = API_KEY_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self._clock = clock
+        # key digest -> record, None until loaded.
+        self._keys: Optional[dict[str, APIKeyRecord]] = None
+        self._loaded_at = 0.0
+        # Reload in progress, per event loop.
+        self._reloads: WeakKeyDictionary = WeakKeyDictionary()
+        self.reloads = 0
+        self.invalidations = 0
+
+    async def _reload(
+        self, sessions: async_sessionmaker[AsyncSession]
+    ) -> dict[str, APIKeyRecord]:
+        # Read before loading: if a key changes meanwhile, the loaded
+        # snapshot serves the waiting requests but is not kept.
+        invalidations = self.invalidations
+        loaded_at = self._clock()
+        self.reloads += 1
+        # Shared by all the requests waiting for the keys, and may outlive
+        # the one that started it: it uses its own session.
+        async with sessions() as session:
+            rows = await session.scalars(
+                select(APIKey).where(APIKey.active.is_(True))
+            )
+            keys = {
+                row.key_hash: APIKeyRecord(
+                    id=row.id,
+                    name=row.name,
+                    scopes=frozenset(row.scopes.split()),
+                    rate_limit=row.rate_limit,
+                    burst=row.burst,
+                )
+                for row in rows
+            }
+        if invalidations == self.invalidations:
+            self._keys = keys
+            self._loaded_at = loaded_at
+        return keys
+
+    async def keys(
+        self, sessions: async_sessionmaker[AsyncSession]
+    ) -> dict[str, APIKeyRecord]:
+        keys = self._keys
+        if keys is not None and self._clock() - self._loaded_at < self.ttl:
+            return keys
+        # After an invalidation, the concurrent requests share one reload
+        # instead of each querying the table.
+        loop = asyncio.get_running_loop()
+        task = self._reloads.get(loop)
+        if task is None:
+            task = asyncio.ensure_future(self._reload(sessions))
+            self._reloads[loop] = task
+
+            def forget(task: asyncio.Task):
+                if self._reloads.get(loop) is task:
+                    del self._reloads[loop]
+
+            task.add_done_callback(forget)
+        # shield(): a cancelled request does not cancel the reload that the
+        # other requests are waiting for.
+        return await asyncio.shield(task)
+
+    async def get(
+        self, sessions: async_sessionmaker[AsyncSession], key: str
+    ) -> Optional[APIKeyRecord]:
+        keys = await self.keys(sessions)
+        return keys.get(hash_api_key(key))
+
+    def peek(self, key: str) -> Optional[APIKeyRecord]:
+        # Record of 'key' if it is among the keys loaded, without any query,
+        # even past the TTL: for the rate limits of main.py.
+        keys = self._keys
+        return keys.get(hash_api_key(key)) if keys is not None else None
+
+    def invalidate(self):
+        self.invalidations += 1
+        self._keys = None
+        # The reloads in progress may predate the change: the next requests
+        # start a new one.
+        self._reloads.clear()
+
+
+# Quota of each key: 'burst' requests at once, refilled at 'rate_limit'
+# requests per minute.
+class TokenBuckets:
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key id -> (tokens left, time of the last update)
+        self._buckets: dict[int, tuple[float, float]] = {}
+
+    def take(self, record: APIKeyRecord) -> float:
+        # Takes a token from the bucket of the key. Returns 0 if the request
+        # is allowed, else the number of seconds until a token is available.
+        rate = record.rate_limit / 60
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(
+                record.id, (record.burst, now)
+            )
+            tokens = min(record.burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[record.id] = (tokens, now)
+                return (1 - tokens) / rate if rate else float("inf")
+            self._buckets[record.id] = (tokens - 1, now)
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+def seed_api_keys(session: Session, keys: Iterable[str]) -> int:
+    # Stores the digests of 'keys' missing from the table, with the scope of
+    # /secure-data. Keys already there, even revoked, are left as they are.
+    # Returns the number of keys added.
+    digests = {hash_api_key(key) for key in keys}
+    if not digests:
+        return 0
+    existing = set(
+        session.scalars(
+            select(APIKey.key_hash).where(APIKey.key_hash.in_(digests))
         )
-    return api_key
+    )
+    missing = sorted(digests - existing)
+    session.add_all(
+        APIKey(name="seeded key", key_hash=digest, scopes="data:read")
+        for digest in missing
+    )
+    session.commit()
+    return len(missing)
+
+
+api_key_cache = APIKeyCache()
+token_buckets = TokenBuckets()
+
+
+# Any committed change to the api_keys table reloads the cache.
+@event.listens_for(APIKey, "after_insert")
+@event.listens_for(APIKey, "after_update")
+@event.listens_for(APIKey, "after_delete")
+def _remember_changed_key(mapper, connection, target: APIKey):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["api_keys_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_api_keys(session: Session):
+    if session.info.pop("api_keys_changed", False):
+        api_key_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_keys(session: Session):
+    session.info.pop("api_keys_changed", None)
+
+
+def require_api_key(scope: str):
+    # Dependency accepting the requests with an active key holding 'scope',
+    # within its quota. The key is read from the X-API-Key header, or from
+    # the 'api_key' query parameter.
+    async def get_api_key(
+        api_key: Optional[str] = None,
+        x_api_key: Annotated[Optional[str], Header()] = None,
+        sessions: async_sessionmaker[AsyncSession] = Depends(
+            get_async_session_factory
+        ),
+    ) -> APIKeyRecord:
+        key = x_api_key or api_key
+        if not key:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Invalid API Key",
+            )
+        record = await api_key_cache.get(sessions, key)
+        if record is None or scope not in record.scopes:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Invalid API Key",
+            )
+        retry_after = token_buckets.take(record)
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="API key quota exceeded",
+                headers={"Retry-After": str(int(retry_after) + 1)},
+            )
+        return record
+
+    return get_api_key
 
 
 router = APIRouter(tags=["API Key Security"])
 
 
-@router.get("/secure-data")
+@router.get(
+    "/secure-data",
+    responses={
+        status.HTTP_403_FORBIDDEN: {"description": "Invalid API Key"},
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "API key quota exceeded"
+        },
+    },
+)
 async def get_secure_data(
-    api_key: str = Depends(get_api_key),
+    api_key: APIKeyRecord = Depends(require_api_key("data:read")),
 ):
     return {"message": "Access to secure data granted"}
 
+
+class APIKeyCreateBody(BaseModel):
+    name: str
+    scopes: list[str] = ["data:read"]
+    rate_limit: Annotated[int, Field(gt=0)] = 60
+    burst: Annotated[int, Field(gt=0)] = 10
+
+
+# Keys are created and revoked by administrators.
+@router.post(
+    "/api-keys",
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User not authorized"
+        },
+    },
+)
+@permission_table.require(Permission.manage_api_keys)
+async def create_api_key(
+    body: APIKeyCreateBody,
+    principal: Principal = Depends(authorize),
+    session: AsyncSession = Depends(get_async_session),
+):
+    key = generate_api_key()
+    row = APIKey(
+        name=body.name,
+        key_hash=hash_api_key(key),
+        scopes=" ".join(body.scopes),
+        rate_limit=body.rate_limit,
+        burst=body.burst,
+    )
+    session.add(row)
+    await session.commit()
+    # The key itself is only returned here, it cannot be retrieved later.
+    return {"id": row.id, "name": row.name, "api_key": key}
+
+
+@router.delete(
+    "/api-keys/{key_id}",
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User not authorized"
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "API key not found"},
+    },
+)
+@permission_table.require(Permission.manage_api_keys)
+async def revoke_api_key(
+    key_id: int,
+    principal: Principal = Depends(authorize),
+    session: AsyncSession = Depends(get_async_session),
+):
+    row = await session.get(APIKey, key_id)
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="API key not found",
+        )
+    row.active = False
+    await session.commit()
+    return {"message": "API key revoked"}
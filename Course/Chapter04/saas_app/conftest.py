@@ -1,9 +1,18 @@
 import pytest
+import pytest_asyncio
 from passlib.context import CryptContext
-from sqlalchemy import QueuePool, create_engine
+from sqlalchemy import NullPool, QueuePool, create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from models import Base, Role, User
+from api_key import api_key_cache, token_buckets
+from main import rate_limit_store
+from mfa_service import mfa_service
+from rbac import principal_cache
+from security import token_cache
+from session_store import session_store
+from third_party_login import github_identity_cache
 
 # Security configuration for password hashing in tests.
 # We need this to insert users with valid hashed passwords into the test database.
@@ -12,18 +21,39 @@ pwd_context = CryptContext(
 )
 
 
+# Every test starts with an empty cache of verified tokens: each test has its
+# own database, and a token cached by a previous test must not leak into it.
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    token_cache.clear()
+    principal_cache.clear()
+    github_identity_cache.clear()
+    session_store.clear()
+    mfa_service.clear()
+    api_key_cache.invalidate()
+    token_buckets.clear()
+    rate_limit_store.clear()
+    yield
+
+
+# Each test gets its own SQLite database file, shared by the synchronous
+# session and the async sessions (aiosqlite) of the test.
+@pytest.fixture
+def database_path(tmp_path):
+    return tmp_path / "test.db"
+
+
 # Fixture to create a fresh database session for each test.
 @pytest.fixture
-def session():
-    # Create an in-memory SQLite engine.
+def session(database_path):
     # 'check_same_thread=False' is needed because FastAPI/Starlette runs in a different thread context during tests.
     engine = create_engine(
-        "sqlite:///:memory:",
+        f"sqlite:///{database_path}",
         connect_args={"check_same_thread": False},
         poolclass=QueuePool,
     )
 
-    # Create a session factory bound to the in-memory engine.
+    # Create a session factory bound to the test engine.
     session_local = sessionmaker(engine)
 
     # Instantiate a new session.
@@ -36,9 +66,27 @@ def session():
     yield db_session
 
     # Teardown: Drop all tables and close the session after the test finishes.
+    db_session.close()
     Base.metadata.drop_all(bind=engine)
+    engine.dispose()
 
-    db_session.close()
+
+# Factory of async sessions on the database of the 'session' fixture.
+# NullPool: the TestClient runs the app in an event loop of its own, so no
+# connection is kept around to be reused from another loop.
+@pytest.fixture
+def async_session_factory(session, database_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool
+    )
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    engine.sync_engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def async_session(async_session_factory):
+    async with async_session_factory() as db_session:
+        yield db_session
 
 
 # Fixture to pre-populate the database with sample users.
@@ -84,7 +132,7 @@ def fill_database_session(session):
             )
         ),
     )
-    # Commit the transaction to save these users to the in-memory database.
+    # Commit the transaction to save these users to the test database.
     session.commit()
     # Yield the session containing the data.
     yield session
\ No newline at end of file
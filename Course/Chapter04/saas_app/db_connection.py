@@ -1,32 +1,227 @@
+import os
+import threading
 from functools import lru_cache
+from typing import Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
 
-# Database connection URL configuration (SQLite in this case)
-SQLALCHEMY_DATABASE_URL = "sqlite:///database.db"
+# Database connection URL configuration (SQLite by default), e.g.:
+#   $ DATABASE_URL=sqlite:////var/lib/saas/database.db uvicorn main:app
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL", "sqlite:///database.db"
+)
+
+# Same database, through an async driver: aiosqlite for SQLite, and e.g.
+# "postgresql+asyncpg://..." for PostgreSQL. By default, the async driver of
+# SQLite is used on the database of SQLALCHEMY_DATABASE_URL.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite"}
+
+
+def async_url(url: str) -> str:
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    if driver is not None:
+        url = url.set(drivername=driver)
+    return url.render_as_string(hide_password=False)
+
+
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL", async_url(SQLALCHEMY_DATABASE_URL)
+)
+
+# Connection pool settings:
+# - POOL_SIZE connections are kept open, and up to MAX_OVERFLOW more are
+#   opened under load (and closed once returned);
+# - a request waits at most POOL_TIMEOUT seconds for a free connection;
+# - connections older than POOL_RECYCLE seconds are replaced.
+POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "3600"))
+
+# Size of the memory-mapped part of a SQLite database file (256 MB):
+# reads of the mapped pages skip a copy from the OS page cache.
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+
+# Counters of the connection pool, updated by pool events.
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+
+    def on_connect(self, *args):
+        with self._lock:
+            self.connections += 1
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(
+                self.max_checked_out, self.checked_out
+            )
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checkins += 1
+            self.checked_out -= 1
+
+    def as_dict(self) -> dict:
+        return {
+            "connections": self.connections,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+        }
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL: readers no longer wait for the writer (and the other way round),
+    # a write only appends to the log file.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only syncs at checkpoints: a power loss can lose the
+    # last transactions but never corrupts the database.
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _engine_options(url: URL) -> dict:
+    in_memory = url.get_backend_name() == "sqlite" and url.database in (
+        None, "", ":memory:"
+    )
+    # In-memory SQLite databases use a single-connection pool, which
+    # takes none of the sizing options.
+    if in_memory:
+        return {}
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+    }
+
+
+def _listen(
+    engine: Engine, url: URL, metrics: Optional[PoolMetrics]
+):
+    if url.get_backend_name() == "sqlite" and _engine_options(url):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    if metrics is not None:
+        event.listen(engine, "connect", metrics.on_connect)
+        event.listen(engine, "checkout", metrics.on_checkout)
+        event.listen(engine, "checkin", metrics.on_checkin)
+
+
+def create_db_engine(
+    url: str, metrics: Optional[PoolMetrics] = None
+) -> Engine:
+    url = make_url(url)
+    engine = create_engine(url, **_engine_options(url))
+    _listen(engine, url, metrics)
+    return engine
+
+
+def create_async_db_engine(
+    url: str, metrics: Optional[PoolMetrics] = None
+) -> AsyncEngine:
+    # Same settings as create_db_engine(). Pool events are emitted by the
+    # synchronous engine wrapped by the async one.
+    url = make_url(url)
+    engine = create_async_engine(url, **_engine_options(url))
+    _listen(engine.sync_engine, url, metrics)
+    return engine
 
 
 # @lru_cache converts this function into an effective Singleton.
 # Creates and returns the database engine only once.
 @lru_cache
-def get_engine():
-    return create_engine(
-        SQLALCHEMY_DATABASE_URL,
-    )
+def get_engine() -> Engine:
+    return create_db_engine(SQLALCHEMY_DATABASE_URL, pool_metrics)
 
-# Generator for database session management.
-def get_session():
-    # Create a session factory configured without autocommit/autoflush
-    Session = sessionmaker(
+
+# The session factory is built once as well: creating a session from it is
+# cheap, and no connection is taken from the pool until the first query.
+@lru_cache
+def get_sessionmaker() -> sessionmaker:
+    return sessionmaker(
         autocommit=False,
         autoflush=False,
         bind=get_engine(),
     )
+
+
+@lru_cache
+def get_async_engine() -> AsyncEngine:
+    return create_async_db_engine(
+        SQLALCHEMY_ASYNC_DATABASE_URL, async_pool_metrics
+    )
+
+
+@lru_cache
+def get_async_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    # expire_on_commit=False: objects stay readable after a commit, where a
+    # lazy reload would need an 'await'.
+    return async_sessionmaker(
+        get_async_engine(),
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+def get_pool_metrics() -> dict:
+    # Counters of the pool, with its current state ("Pool size: 5
+    # Connections in pool: 1 Current Overflow: -4 Current Checked out
+    # connections: 0" for a QueuePool).
+    return {
+        **pool_metrics.as_dict(),
+        "status": get_engine().pool.status(),
+        "async": {
+            **async_pool_metrics.as_dict(),
+            "status": get_async_engine().pool.status(),
+        },
+    }
+
+
+# Generator for database session management.
+def get_session():
+    session = get_sessionmaker()()
     try:
-        session = Session()
         # Yield the session to the caller (e.g., FastAPI route)
         yield session
     finally:
         # Ensure the session is closed upon completion, freeing resources
-        session.close()
\ No newline at end of file
+        session.close()
+
+
+# Dependency giving the factory of async sessions, for work that may outlive
+# the request (e.g. a lookup shared by concurrent requests): it opens its own
+# session instead of borrowing the one of the request.
+def get_async_session_factory() -> async_sessionmaker[AsyncSession]:
+    return get_async_sessionmaker()
+
+
+# Async version of get_session(), for 'async def' routes: queries are awaited
+# on the event loop instead of blocking a thread of the threadpool.
+async def get_async_session():
+    async with get_async_sessionmaker()() as session:
+        yield session
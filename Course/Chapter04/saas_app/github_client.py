@@ -0,0 +1,143 @@
+"""
+Shared HTTP client for the calls to GitHub (OAuth code exchange, user
+profile): one httpx.AsyncClient, created on first use and closed by the
+lifespan of the app. Any failure to get an answer raises GitHubUnavailable,
+which the app turns into "502 Bad Gateway".
+"""
+
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+
+
+# GITHUB_URL and GITHUB_API_URL can point at a local stub (tests, benchmarks).
+GITHUB_URL = os.getenv("GITHUB_URL", "https://github.com")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_HTTP_TIMEOUT = float(os.getenv("GITHUB_HTTP_TIMEOUT", "5"))
+GITHUB_HTTP_RETRIES = int(os.getenv("GITHUB_HTTP_RETRIES", "2"))
+GITHUB_HTTP_MAX_CONNECTIONS = int(
+    os.getenv("GITHUB_HTTP_MAX_CONNECTIONS", "100")
+)
+
+RETRY_STATUS_CODES = {502, 503, 504}
+RETRY_BACKOFF = 0.1
+
+
+class GitHubUnavailable(Exception):
+    pass
+
+
+class GitHubClient:
+    def __init__(
+        self,
+        url: str = GITHUB_URL,
+        api_url: str = GITHUB_API_URL,
+        timeout: float = GITHUB_HTTP_TIMEOUT,
+        retries: int = GITHUB_HTTP_RETRIES,
+        max_connections: int = GITHUB_HTTP_MAX_CONNECTIONS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.url = url.rstrip("/")
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        # A custom transport (e.g. httpx.MockTransport) replaces the network.
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                # Retries are made by _request() only, not by the transport.
+                transport=self._transport,
+                headers={"Accept": "application/json"},
+            )
+        return self._client
+
+    async def _request(
+        self, method: str, url: str, idempotent: bool, **kwargs
+    ) -> httpx.Response:
+        # Up to 'retries' retries, with a short exponential backoff. Failed
+        # connections are retried for every call, as nothing was sent. Other
+        # errors (timeouts, 502/503/504) only for idempotent calls: retrying
+        # the code exchange could spend the (single use) code twice.
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                response = await self.client.request(
+                    method, url, **kwargs
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout) as exc:
+                error = exc
+                continue
+            except httpx.TransportError as exc:
+                error = exc
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} from GitHub",
+                    request=response.request,
+                    response=response,
+                )
+            if not idempotent:
+                break
+        raise GitHubUnavailable(f"GitHub not reachable: {error}")
+
+    async def exchange_code(
+        self,
+        code: str,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+    ) -> dict:
+        # Exchange an OAuth authorization code for an access token.
+        response = await self._request(
+            "POST",
+            f"{self.url}/login/oauth/access_token",
+            idempotent=False,
+            data={
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "code": code,
+                "redirect_uri": redirect_uri,
+            },
+        )
+        if response.is_error:
+            return {}
+        return response.json()
+
+    async def get_user(self, access_token: str) -> dict:
+        # Profile of the user of an access token, {} if GitHub rejects it.
+        response = await self._request(
+            "GET",
+            f"{self.api_url}/user",
+            idempotent=True,
+            headers={"Authorization": access_token},
+        )
+        if response.is_error:
+            return {}
+        return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+github_client = GitHubClient()
+
+
+# Dependency giving the shared client (overridden with a stub in tests).
+def get_github_client() -> GitHubClient:
+    return github_client
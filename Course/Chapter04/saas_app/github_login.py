@@ -1,6 +1,6 @@
-import httpx
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 
+from github_client import GitHubClient, get_github_client
 from security import Token
 from third_party_login import (
     GITHUB_AUTHORIZATION_URL,
@@ -25,21 +25,24 @@ def github_login():
     responses={
         status.HTTP_401_UNAUTHORIZED: {
             "description": "User not registered"
-        }
+        },
+        status.HTTP_502_BAD_GATEWAY: {
+            "description": "GitHub not reachable"
+        },
     },
 )
-async def github_callback(code: str):
+async def github_callback(
+    code: str,
+    github: GitHubClient = Depends(get_github_client),
+):
     # Exchange the authorization code for an access token.
-    token_response = httpx.post(
-        "https://github.com/login/oauth/access_token",
-        data={
-            "client_id": GITHUB_CLIENT_ID,
-            "client_secret": GITHUB_CLIENT_SECRET,
-            "code": code,
-            "redirect_uri": GITHUB_REDIRECT_URI,
-        },
-        headers={"Accept": "application/json"},
-    ).json()
+    # The request is awaited: other requests keep being served meanwhile.
+    token_response = await github.exchange_code(
+        code,
+        client_id=GITHUB_CLIENT_ID,
+        client_secret=GITHUB_CLIENT_SECRET,
+        redirect_uri=GITHUB_REDIRECT_URI,
+    )
     # Extract the access token from the response.
     access_token = token_response.get("access_token")
     # If the token is missing, raise an authentication error.
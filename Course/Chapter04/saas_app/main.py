@@ -1,13 +1,17 @@
-from typing import Annotated
+import os
+from typing import Annotated, Optional
 from contextlib import asynccontextmanager
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import (
     FastAPI, 
     Depends, 
     HTTPException, 
+    Request,
     status
 )
+from fastapi.responses import JSONResponse
+from starlette.requests import HTTPConnection
 
 import api_key
 import security
@@ -15,21 +19,61 @@ import premium_access
 import rbac
 import mfa
 import github_login
+import user_import
 import user_session
 from responses import ResponseCreateUser, UserCreateBody, UserCreateResponse
-from db_connection import get_engine, get_session
+from db_connection import (
+    get_async_engine,
+    get_async_session,
+    get_engine,
+    get_sessionmaker,
+)
+from github_client import GitHubUnavailable, github_client
 from models import Base
-from operations import add_user
+from operations import add_user_async, seed_admin
+from password_hashing import HashingSaturated, password_hasher
+from permissions import permission_table
+from rate_limit import (
+    RateLimit,
+    RateLimitMiddleware,
+    SlidingWindow,
+    TokenBucket,
+    by_ip,
+    create_rate_limit_store,
+    first_of,
+    parse_rate,
+)
+from session_store import SESSION_COOKIE_NAME, peek_session
 from third_party_login import resolve_github_token
 
+# Administrator created at startup when both ADMIN_USERNAME and ADMIN_PASSWORD
+# are set (only admins can create API keys and import users).
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "")
+ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@localhost")
+
 # This context manager handles the application's lifecycle (startup and shutdown events).
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Connect to the database and create tables defined in 'models.py'
     # if they do not exist yet.
     Base.metadata.create_all(bind=get_engine())
+    # Store the API keys accepted before keys lived in the database.
+    with get_sessionmaker()() as session:
+        api_key.seed_api_keys(session, api_key.API_KEYS_SEED.split())
+        if ADMIN_USERNAME and ADMIN_PASSWORD:
+            seed_admin(session, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_EMAIL)
+    # Compile the permissions required by the routes into a lookup table.
+    permission_table.compile()
     # Yield control to FastAPI to start handling requests.
     yield
+    # Shutdown: stop the worker processes of the password hashing service,
+    # and close the connections of the async engine and of the GitHub client.
+    password_hasher.shutdown()
+    await get_async_engine().dispose()
+    await github_client.aclose()
+    # Stop the worker processes of the user imports.
+    user_import.shutdown()
 
 # Initialize the main FastAPI application.
 # We pass the 'lifespan' context manager to handle the startup logic.
@@ -37,6 +81,90 @@ app = FastAPI(
     title="Saas application", lifespan=lifespan,
 )
 
+# Admission control, before any endpoint runs (see rate_limit.py):
+# - the endpoints hashing a password or checking a code (bcrypt, database)
+#   accept RATE_LIMIT_AUTH requests per IP;
+# - every request takes a token from the bucket of its client: its API key,
+#   else its user (session cookie or access token), else its IP.
+# Only credentials this process already verified count as a client: they are
+# looked up in the in-memory caches, without a query or a signature check.
+# Anything else, e.g. a made-up header, is counted against the IP.
+RATE_LIMIT_AUTH = os.getenv("RATE_LIMIT_AUTH", "20/minute")
+RATE_LIMIT_API = os.getenv("RATE_LIMIT_API", "600/minute")
+RATE_LIMIT_API_BURST = int(os.getenv("RATE_LIMIT_API_BURST", "100"))
+
+
+def by_api_key(scope: dict) -> Optional[str]:
+    connection = HTTPConnection(scope)
+    # Same places as api_key.require_api_key(): header, else query.
+    key = connection.headers.get("x-api-key")
+    key = key or connection.query_params.get("api_key")
+    record = key and api_key.api_key_cache.peek(key)
+    if record:
+        return f"key:{record.id}"
+
+
+def by_user(scope: dict) -> Optional[str]:
+    connection = HTTPConnection(scope)
+    user_session = peek_session(connection.cookies.get(SESSION_COOKIE_NAME))
+    if user_session is not None:
+        return f"user:{user_session.username}"
+    authorization = connection.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return
+    # Tokens verified by the routes of rbac.py, or by decode_access_token().
+    user = rbac.principal_cache.peek(token)
+    user = user or security.token_cache.peek(token)
+    if user is not None:
+        return f"user:{user.username}"
+
+
+rate_limit_store = create_rate_limit_store()
+app.add_middleware(
+    RateLimitMiddleware,
+    rules=[
+        RateLimit(
+            "auth",
+            SlidingWindow(*parse_rate(RATE_LIMIT_AUTH)),
+            by_ip,
+            paths=("/token", "/login", "/verify-totp", "/register"),
+            methods=("POST",),
+        ),
+        RateLimit(
+            "api",
+            TokenBucket(
+                *parse_rate(RATE_LIMIT_API), burst=RATE_LIMIT_API_BURST
+            ),
+            first_of(by_api_key, by_user, by_ip),
+        ),
+    ],
+    store=rate_limit_store,
+)
+
+# Backpressure: when the password hashing service already has as many logins
+# and registrations as it accepts, new ones are refused right away, instead of
+# waiting in a queue and slowing down the whole application.
+@app.exception_handler(HashingSaturated)
+async def hashing_saturated_handler(
+    request: Request, exc: HashingSaturated
+):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+# GitHub did not answer (timeouts, connection errors, 5xx after the retries).
+@app.exception_handler(GitHubUnavailable)
+async def github_unavailable_handler(
+    request: Request, exc: GitHubUnavailable
+):
+    return JSONResponse(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        content={"detail": str(exc)},
+    )
+
 @app.post(
     "/register/user",
     status_code=status.HTTP_201_CREATED,
@@ -44,15 +172,18 @@ app = FastAPI(
     responses = {
         status.HTTP_409_CONFLICT: {
             "description": "The user already exists"
-        }
+        },
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many registrations in progress"
+        },
     },
     tags=["User Registration with Basic Access"],
 )
-def register(
+async def register(
     user: UserCreateBody,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ) -> dict[str, UserCreateResponse]:
-    user = add_user(
+    user = await add_user_async(
         session=session, **user.model_dump()
     )
     if not user:
@@ -75,6 +206,7 @@ app.include_router(github_login.router)
 app.include_router(mfa.router)
 app.include_router(user_session.router)
 app.include_router(api_key.router)
+app.include_router(user_import.router)
 
 
 @app.get(
@@ -82,7 +214,10 @@ app.include_router(api_key.router)
     responses={
         status.HTTP_403_FORBIDDEN: {
             "description": "token not valid"
-        }
+        },
+        status.HTTP_502_BAD_GATEWAY: {
+            "description": "GitHub not reachable"
+        },
     },
     tags=["Homepage"],
 )
@@ -5,10 +5,11 @@ from fastapi import (
     HTTPException,
     status,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db_connection import get_session
-from operations import get_user
+from db_connection import get_async_session
+from mfa_service import Verification, mfa_service
+from operations import get_user_async
 from rbac import get_current_user
 from responses import UserCreateResponse
 
@@ -31,20 +32,20 @@ router = APIRouter(tags=["Multi-Factor Authentication (MFA)"])
 
 # Endpoint to enable Multi-Factor Authentication (MFA) for the currently logged-in user.
 @router.post("/user/enable-mfa")
-def enable_mfa(
+async def enable_mfa(
     user: UserCreateResponse = Depends(
         get_current_user
     ),
-    db_session: Session = Depends(get_session),
+    db_session: AsyncSession = Depends(get_async_session),
 ):
     # 1. Generate a new random secret for this user.
     secret = generate_totp_secret()
     # 2. Retrieve the user record from the database to update it.
-    db_user = get_user(db_session, user.username)
+    db_user = await get_user_async(db_session, user.username)
     # 3. Store the generated secret in the user's record.
     db_user.totp_secret = secret
     db_session.add(db_user)
-    db_session.commit()
+    await db_session.commit()
     # 4. Generate the URI needed for the authenticator app.
     totp_uri = generate_totp_uri(secret, user.email)
 
@@ -59,25 +60,54 @@ def enable_mfa(
 # Endpoint to verify a TOTP code provided by the user.
 # This is used to confirm that the user has correctly set up their authenticator app
 # or to grant access during a login flow requiring 2FA.
-@router.post("/verify-totp")
-def verify_totp(
+# The MFA service (mfa_service.py) keeps the TOTP state of the users seen
+# recently: their codes are checked in memory, each code is accepted once, and
+# failed attempts are limited per time step.
+@router.post(
+    "/verify-totp",
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "MFA not activated"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid TOTP token"},
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many attempts"
+        },
+    },
+)
+async def verify_totp(
     code: str,
     username: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    # 1. Retrieve the user from the database.
-    user = get_user(session, username)
-    # 2. Check if MFA is actually enabled for this user (i.e., they have a secret stored).
-    if not user.totp_secret:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="MFA not activated",
+    # 1. Retrieve the user's secret from the database, unless the service
+    # already knows it. The username may also be the email of the user.
+    user_id = mfa_service.user_id(username)
+    if user_id is None:
+        invalidations = mfa_service.invalidations
+        user = await get_user_async(session, username)
+        # 2. Check if MFA is actually enabled for this user (i.e., they have a secret stored).
+        if not user or not user.totp_secret:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="MFA not activated",
+            )
+        user_id = user.id
+        mfa_service.remember(
+            username, user.id, user.totp_secret, invalidations
         )
 
-    # 3. Initialize the TOTP object with the user's stored secret.
-    totp = pyotp.TOTP(user.totp_secret)
-    # 4. Verify the provided code against the generated code for the current time.
-    if not totp.verify(code):
+    # 3. Verify the provided code against the codes of the current time window.
+    # The used codes and the attempts are counted per user, whatever the
+    # login given.
+    result = mfa_service.verify(user_id, code)
+    if result is Verification.locked:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts",
+            headers={
+                "Retry-After": str(mfa_service.seconds_to_next_step())
+            },
+        )
+    if result is not Verification.valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid TOTP token",
@@ -0,0 +1,184 @@
+"""
+Verification of TOTP codes for mfa.py, in memory: per user, the codes of the
+valid window (computed once per time step), the codes already accepted
+(replay protection) and the failed attempts of the current step.
+"""
+
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Callable, Optional
+
+import pyotp
+
+from user_lookup import user_change_listeners
+
+
+# The state is kept for the MFA_CACHE_SIZE most recently seen users. It is per
+# process: with several workers, a user gets MFA_MAX_ATTEMPTS per worker.
+MFA_CACHE_SIZE = int(os.getenv("MFA_CACHE_SIZE", "10000"))
+# Failed attempts allowed per time step, then the user is locked out until the
+# next step.
+MFA_MAX_ATTEMPTS = int(os.getenv("MFA_MAX_ATTEMPTS", "5"))
+# Number of time steps accepted before and after the current one.
+MFA_VALID_WINDOW = 1
+
+
+class Verification(str, Enum):
+    valid = "valid"
+    invalid = "invalid"
+    replayed = "replayed"
+    locked = "locked"
+
+
+class _UserTOTP:
+    def __init__(self, user_id: int, secret: str):
+        self.user_id = user_id
+        self.secret = secret
+        self.totp = pyotp.TOTP(secret)
+        # time step -> code of that step, for the valid window.
+        self.codes: dict[int, str] = {}
+        # Time steps whose code was accepted.
+        self.used: set[int] = set()
+        self.attempts_step = 0
+        self.attempts = 0
+        # Set when the user changed: the secret must be read again.
+        self.stale = False
+        # Usernames and emails the user was looked up with.
+        self.aliases: set[str] = set()
+
+    def window(self, step: int) -> dict[int, str]:
+        steps = range(step - MFA_VALID_WINDOW, step + MFA_VALID_WINDOW + 1)
+        if min(self.codes, default=None) != steps[0]:
+            # Codes already computed for the previous step are reused.
+            self.codes = {
+                s: self.codes.get(s) or self.totp.generate_otp(s)
+                for s in steps
+            }
+            self.used = {s for s in self.used if s >= steps[0]}
+        return self.codes
+
+
+class MFAService:
+    def __init__(
+        self,
+        maxsize: int = MFA_CACHE_SIZE,
+        max_attempts: int = MFA_MAX_ATTEMPTS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._lock = threading.Lock()
+        # user id -> state, least recently used first. The state is keyed by
+        # user, not by login: the username and the email of a user share
+        # their used codes and their attempts.
+        self._users: OrderedDict[int, _UserTOTP] = OrderedDict()
+        # username or email -> user id, for the users in _users.
+        self._aliases: dict[str, int] = {}
+        # Number of invalidations so far, see remember().
+        self.invalidations = 0
+
+    def step(self) -> int:
+        return int(self._clock()) // 30
+
+    def seconds_to_next_step(self) -> int:
+        return 30 - int(self._clock()) % 30
+
+    def user_id(self, login: str) -> Optional[int]:
+        # Id of the user known by 'login' (username or email), if their
+        # secret is known and current.
+        with self._lock:
+            user_id = self._aliases.get(login)
+            state = self._users.get(user_id)
+            if state is None or state.stale:
+                return None
+            return user_id
+
+    def remember(
+        self,
+        login: str,
+        user_id: int,
+        secret: str,
+        invalidations: Optional[int] = None,
+    ):
+        # 'invalidations' is the value of the counter read before loading the
+        # secret: if the user changed since, the secret may be stale.
+        with self._lock:
+            if (
+                invalidations is not None
+                and invalidations != self.invalidations
+            ):
+                return
+            state = self._users.get(user_id)
+            # Same secret: the used codes and the attempts are kept.
+            if state is None or state.secret != secret:
+                if state is not None:
+                    self._drop_aliases(state)
+                state = self._users[user_id] = _UserTOTP(user_id, secret)
+            state.stale = False
+            state.aliases.add(login)
+            self._aliases[login] = user_id
+            while len(self._users) > self.maxsize:
+                _, evicted = self._users.popitem(last=False)
+                self._drop_aliases(evicted)
+
+    # Called with the lock held.
+    def _drop_aliases(self, state: _UserTOTP):
+        for alias in state.aliases:
+            if self._aliases.get(alias) == state.user_id:
+                del self._aliases[alias]
+        state.aliases.clear()
+
+    def verify(self, user_id: int, code: str) -> Verification:
+        step = self.step()
+        with self._lock:
+            state = self._users.get(user_id)
+            # Evicted since the caller called user_id().
+            if state is None:
+                return Verification.invalid
+            self._users.move_to_end(user_id)
+            if state.attempts_step != step:
+                state.attempts_step = step
+                state.attempts = 0
+            if state.attempts >= self.max_attempts:
+                return Verification.locked
+            matched = None
+            # Every code of the window is compared, in constant time.
+            for code_step, expected in state.window(step).items():
+                if hmac.compare_digest(
+                    code.encode(), expected.encode()
+                ):
+                    matched = code_step
+            if matched is None:
+                state.attempts += 1
+                return Verification.invalid
+            if matched in state.used:
+                state.attempts += 1
+                return Verification.replayed
+            state.used.add(matched)
+            return Verification.valid
+
+    def forget_user(self, user_id: int):
+        with self._lock:
+            self.invalidations += 1
+            state = self._users.get(user_id)
+            if state is not None:
+                # The username or the email may now be another user's.
+                state.stale = True
+                self._drop_aliases(state)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += 1
+            self._users.clear()
+            self._aliases.clear()
+
+
+mfa_service = MFAService()
+
+# A committed change to a user (e.g. a new TOTP secret) is seen by the service.
+user_change_listeners.append(mfa_service.forget_user)
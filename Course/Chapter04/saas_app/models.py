@@ -13,10 +13,11 @@ class Base(DeclarativeBase):
 
 
 # Enumeration for user roles. Inherits from str and Enum for strict typing.
-# Stored as text in the DB ("basic" or "premium").
+# Stored as text in the DB ("basic", "premium" or "admin").
 class Role(str, Enum):
     basic = "basic"
     premium = "premium"
+    admin = "admin"
 
 
 # Represents the 'users' table in the database.
@@ -43,3 +44,20 @@ class User(Base):
     totp_secret: Mapped[str] = mapped_column(
         nullable=True
     )
+
+
+# Represents the 'api_keys' table: keys of the machine clients.
+class APIKey(Base):
+    __tablename__ = "api_keys"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Name given to the key by its owner, e.g. "billing service".
+    name: Mapped[str]
+    # SHA-256 of the key: the key itself is only shown once, when created.
+    key_hash: Mapped[str] = mapped_column(unique=True, index=True)
+    # Space-separated scopes granted to the key, e.g. "data:read".
+    scopes: Mapped[str] = mapped_column(default="")
+    # Quota of the key: requests per minute, and burst size.
+    rate_limit: Mapped[int] = mapped_column(default=60)
+    burst: Mapped[int] = mapped_column(default=10)
+    # Revoked keys are kept, but no longer accepted.
+    active: Mapped[bool] = mapped_column(default=True)
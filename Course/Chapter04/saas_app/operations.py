@@ -1,18 +1,10 @@
-from passlib.context import CryptContext
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from email_validator import (
-    EmailNotValidError,
-    validate_email,
-)
 
 from models import User, Role
-
-# Security configuration: Use bcrypt for hashing passwords.
-# 'deprecated="auto"' allows upgrading hashes if the scheme changes in the future.
-pwd_context = CryptContext(
-    schemes=["bcrypt"], deprecated="auto"
-)
+from password_hashing import password_hasher, pwd_context
+from user_lookup import find_user, find_user_async
 
 def add_user(
     session: Session,
@@ -23,7 +15,43 @@ def add_user(
 ) -> User | None:
     # Hash the plain text password before storing it.
     hashed_password = pwd_context.hash(password)
+    return insert_user(
+        session, username, hashed_password, email, role
+    )
+
+async def add_user_async(
+    session: AsyncSession,
+    username: str,
+    password: str,
+    email: str,
+    role: Role = Role.basic,
+) -> User | None:
+    # Same as add_user(), for async routes: the password is hashed in the
+    # process pool of the hashing service, and the database work is awaited
+    # through the async driver, so the event loop is never blocked.
+    hashed_password = await password_hasher.hash(password)
+    db_user = User(
+        username=username,
+        email=email,
+        hashed_password=hashed_password,
+        role=role,
+    )
+    session.add(db_user)
+    try:
+        await session.commit()
+        await session.refresh(db_user)
+    except IntegrityError:
+        await session.rollback()
+        return
+    return db_user
 
+def insert_user(
+    session: Session,
+    username: str,
+    hashed_password: str,
+    email: str,
+    role: Role = Role.basic,
+) -> User | None:
     # Create the User model instance.
     db_user = User(
         username=username,
@@ -44,20 +72,28 @@ def add_user(
         return
     return db_user
 
-def get_user(
-    session: Session, username_or_email: str
+def seed_admin(
+    session: Session, username: str, password: str, email: str
 ) -> User | None:
-    try:
-        validate_email(username_or_email)
-        query_filter = User.email
-    except EmailNotValidError:
-        query_filter = User.username
-    user = (
-        session.query(User)
-        .filter(query_filter == username_or_email)
-        .first()
-    )
+    # First administrator of a new deployment, who can then create API keys
+    # and import users. An existing user of that name is made an admin, its
+    # password is left as it is. Returns None if the email is taken.
+    user = find_user(session, username)
+    if user is None or user.username != username:
+        return add_user(session, username, password, email, Role.admin)
+    if user.role != Role.admin:
+        user.role = Role.admin
+        session.commit()
     return user
 
+def get_user(
+    session: Session, username_or_email: str
+) -> User | None:
+    # One indexed query on both the username and the email columns,
+    # see user_lookup.py.
+    return find_user(session, username_or_email)
 
-
+async def get_user_async(
+    session: AsyncSession, username_or_email: str
+) -> User | None:
+    return await find_user_async(session, username_or_email)
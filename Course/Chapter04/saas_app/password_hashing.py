@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+# Security configuration: Use bcrypt for hashing passwords.
+# 'deprecated="auto"' allows upgrading hashes if the scheme changes in the future.
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto"
+)
+
+# bcrypt is slow on purpose (tens of milliseconds of CPU per call). Run inline,
+# a burst of logins keeps the threadpool and the GIL busy and every other
+# endpoint waits. The hashing service below runs it in a pool of processes:
+# - PASSWORD_HASHING_WORKERS processes (one per CPU by default) do the work;
+# - at most PASSWORD_HASHING_MAX_PENDING calls may be running or queued. Past
+#   that, new calls are rejected at once with HashingSaturated, which the app
+#   turns into "429 Too Many Requests", instead of piling up behind the others.
+PASSWORD_HASHING_WORKERS = int(
+    os.getenv("PASSWORD_HASHING_WORKERS", os.cpu_count() or 1)
+)
+PASSWORD_HASHING_MAX_PENDING = int(
+    os.getenv(
+        "PASSWORD_HASHING_MAX_PENDING", PASSWORD_HASHING_WORKERS * 8
+    )
+)
+
+
+class HashingSaturated(Exception):
+    pass
+
+
+# Functions run in the worker processes.
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Calls admitted and not finished yet (running or queued).
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Worker processes are started from a clean server process
+                # ("forkserver"), never forked from the threads of the app.
+                method = (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(method),
+                )
+            return self._executor
+
+    def _admit(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingSaturated(
+                    "too many password hashing requests"
+                )
+            self.pending += 1
+
+    async def _run(self, function, *args):
+        self._admit()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), function, *args
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(
+            verify_password, password, hashed_password
+        )
+
+    def stats(self) -> dict:
+        # 'queued' is the queue depth: admitted calls waiting for a worker.
+        pending = self.pending
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": pending,
+            "queued": max(pending - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASHING_WORKERS,
+    max_pending=PASSWORD_HASHING_MAX_PENDING,
+)
@@ -0,0 +1,125 @@
+"""
+In-process authorization: roles grant permissions, written in the access
+token when it is issued, and routes are checked against a compiled table of
+bit masks, without querying the database.
+"""
+
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Iterable, Optional
+
+from models import Role
+
+
+class Permission(str, Enum):
+    read_welcome = "welcome:read"
+    read_premium = "premium:read"
+    import_users = "users:import"
+    manage_api_keys = "api-keys:manage"
+
+
+ROLE_PERMISSIONS: dict[Role, frozenset[Permission]] = {
+    Role.basic: frozenset({Permission.read_welcome}),
+    Role.premium: frozenset(
+        {Permission.read_welcome, Permission.read_premium}
+    ),
+    # Administrators manage the app, they are not premium subscribers:
+    # /welcome/premium-user stays reserved to the premium role.
+    Role.admin: frozenset(Permission) - {Permission.read_premium},
+}
+
+# Each permission is one bit of an integer: a request is allowed when
+# principal.mask & required == required. Claims are only as fresh as the
+# token, a role change applies to the tokens issued afterwards.
+PERMISSION_BITS: dict[str, int] = {
+    permission.value: 1 << bit
+    for bit, permission in enumerate(Permission)
+}
+
+
+def permission_mask(permissions: Iterable[str]) -> int:
+    # Unknown names (e.g. a permission removed since the token was issued)
+    # grant nothing.
+    mask = 0
+    for permission in permissions:
+        mask |= PERMISSION_BITS.get(permission, 0)
+    return mask
+
+
+# Mask of the permissions of each role.
+ROLE_MASKS: dict[Role, int] = {
+    role: permission_mask(permission.value for permission in permissions)
+    for role, permissions in ROLE_PERMISSIONS.items()
+}
+
+
+def permission_claims(role: Role) -> dict:
+    return {
+        "role": role.value,
+        "perms": sorted(
+            permission.value for permission in ROLE_PERMISSIONS[role]
+        ),
+    }
+
+
+# Identity and permissions of the user of a request, read from the token.
+@dataclass(frozen=True)
+class Principal:
+    username: str
+    role: Role
+    mask: int
+    claims: dict = field(default_factory=dict, compare=False)
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> Optional["Principal"]:
+        try:
+            role = Role(claims["role"])
+        except (KeyError, ValueError):
+            return
+        return cls(
+            username=claims["sub"],
+            role=role,
+            mask=permission_mask(claims.get("perms", ())),
+            claims=claims,
+        )
+
+    def allows(self, required: int) -> bool:
+        return self.mask & required == required
+
+
+class PermissionTable:
+    def __init__(self):
+        # endpoint -> permissions it requires, see require().
+        self.requirements: dict[Callable, frozenset[Permission]] = {}
+        # endpoint -> required mask, filled by compile().
+        self.table: Optional[dict[Callable, int]] = None
+
+    def require(self, *permissions: Permission):
+        # Decorator of an endpoint, placed under the route decorator:
+        #     @router.get("/path")
+        #     @permission_table.require(Permission.read_welcome)
+        #     def endpoint(principal = Depends(authorize)): ...
+        def register(endpoint: Callable) -> Callable:
+            self.requirements[endpoint] = frozenset(permissions)
+            self.table = None
+            return endpoint
+
+        return register
+
+    def compile(self) -> dict[Callable, int]:
+        self.table = {
+            endpoint: permission_mask(
+                permission.value for permission in permissions
+            )
+            for endpoint, permissions in self.requirements.items()
+        }
+        return self.table
+
+    def required(self, endpoint: Callable) -> Optional[int]:
+        table = self.table
+        if table is None:
+            table = self.compile()
+        return table.get(endpoint)
+
+
+permission_table = PermissionTable()
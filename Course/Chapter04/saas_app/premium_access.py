@@ -4,11 +4,11 @@ from fastapi import (
     HTTPException,
     status,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db_connection import get_session
+from db_connection import get_async_session
 from models import Role
-from operations import add_user
+from operations import add_user_async
 from responses import (
     ResponseCreateUser,
     UserCreateBody,
@@ -29,13 +29,16 @@ router = APIRouter(tags=["Premium access"])
         status.HTTP_201_CREATED: {
             "description": "User created"
         },
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many registrations in progress"
+        },
     },
 )
-def register_premium_user(
+async def register_premium_user(
     user: UserCreateBody,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    user = add_user(
+    user = await add_user_async(
         session=session,
         **user.model_dump(),
         role=Role.premium,
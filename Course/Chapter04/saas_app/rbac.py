@@ -1,17 +1,32 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
     status,
 )
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db_connection import get_session
+from db_connection import get_async_session
 from models import Role
-from security import decode_access_token, oauth2_scheme
+from permissions import (
+    ROLE_MASKS,
+    Permission,
+    Principal,
+    permission_claims,
+    permission_table,
+)
+from security import (
+    AuthenticatedUser,
+    decode_access_token_async,
+    optional_oauth2_scheme,
+    verify_token,
+)
+from session_store import UserSession, get_user_session
+from token_cache import TokenCache
 
 
 class UserCreateRequestWithRole(BaseModel):
@@ -20,35 +35,108 @@ class UserCreateRequestWithRole(BaseModel):
     role: Role
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    session: Session = Depends(get_session),
-) -> UserCreateRequestWithRole:
-    user = decode_access_token(token, session)
+async def get_authenticated_user(
+    user_session: Optional[UserSession] = Depends(get_user_session),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    session: AsyncSession = Depends(get_async_session),
+) -> AuthenticatedUser:
+    # Browsers logged in with a session cookie: one lookup in the session
+    # store, no token to decode.
+    if user_session is not None:
+        return user_session.user
+    # Tokens seen before are answered from the token cache of security.py,
+    # without checking the signature or querying the database again.
+    user = token and await decode_access_token_async(token, session)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not authorized",
         )
+    return user
+
 
-    return UserCreateRequestWithRole(
+def get_current_user(
+    user: AuthenticatedUser = Depends(get_authenticated_user),
+) -> UserCreateRequestWithRole:
+    # The values come from the database, where they were validated when the
+    # user registered: model_construct() skips validating the email again.
+    return UserCreateRequestWithRole.model_construct(
         username=user.username,
         email=user.email,
         role=user.role,
     )
 
 
-def get_premium_user(
-    current_user: Annotated[
-        get_current_user, Depends()
-    ],
-):
-    if current_user.role != Role.premium:
+# Principals of the tokens already verified, until the token expires.
+principal_cache = TokenCache(maxsize=4096)
+
+
+async def get_principal(
+    user_session: Optional[UserSession] = Depends(get_user_session),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    session: AsyncSession = Depends(get_async_session),
+) -> Principal:
+    if user_session is not None:
+        return Principal(
+            username=user_session.username,
+            role=user_session.role,
+            mask=ROLE_MASKS[user_session.role],
+        )
+    # The role and the permissions come from the claims of the token: no
+    # database query (the session only opens a connection when used).
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not authorized",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    claims = verify_token(token)
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not authorized",
+        )
+    principal = Principal.from_claims(claims)
+    if principal is None:
+        # Token issued without the permission claims: role from the database.
+        # Not kept in principal_cache: the token cache of security.py forgets
+        # the user as soon as they change (new role, deletion).
+        user = await decode_access_token_async(token, session)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not authorized",
+            )
+        return Principal.from_claims(
+            {**claims, **permission_claims(user.role)}
+        )
+    if claims.get("exp") is not None:
+        principal_cache.set(
+            token,
+            principal,
+            expires_at=claims["exp"],
+            tag=principal.username,
+        )
+    return principal
+
+
+# Authorization of the routes decorated with permission_table.require(): the
+# mask required by the endpoint is found in the compiled table.
+def authorize(
+    request: Request,
+    principal: Principal = Depends(get_principal),
+) -> Principal:
+    required = permission_table.required(request.scope["endpoint"])
+    # A route without requirements in the table is refused, never open.
+    if required is None or not principal.allows(required):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not authorized",
         )
-    return current_user
+    return principal
 
 
 router = APIRouter(tags=["Role-Based Access Control"])
@@ -62,8 +150,9 @@ router = APIRouter(tags=["Role-Based Access Control"])
         }
     },
 )
+@permission_table.require(Permission.read_welcome)
 def all_user_can_access(
-    user: Annotated[get_current_user, Depends()],
+    user: Annotated[Principal, Depends(authorize)],
 ):
     return {
         f"Hello {user.username}, welcome to your space"
@@ -78,8 +167,9 @@ def all_user_can_access(
         }
     },
 )
+@permission_table.require(Permission.read_premium)
 def only_premium_user_can_access(
-    user: Annotated[get_premium_user, Depends()],
+    user: Annotated[Principal, Depends(authorize)],
 ):
     return {
         f"Hello {user.username}, "
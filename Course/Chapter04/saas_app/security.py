@@ -1,3 +1,4 @@
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 
 from fastapi import (
@@ -11,38 +12,25 @@ from fastapi.security import (
     OAuth2PasswordBearer,
 )
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from email_validator import (
-    validate_email,
-    EmailNotValidError,
-)
 from jose import jwt, JWTError
 
-from db_connection import get_session
-from models import User
-from operations import get_user, pwd_context
+from db_connection import get_async_session
+from models import Role, User
+from operations import get_user, get_user_async, pwd_context
+from password_hashing import password_hasher
+from permissions import permission_claims
+from token_cache import TokenCache
+from user_lookup import user_change_listeners
 
 def authenticate_user(
     session: Session,
     username_or_email: str,
     password: str,
 ) -> User | None:
-    # Check if the input is a valid email address.
-    # If it is, we will query by the 'email' column.
-    # If not (EmailNotValidError), we assume it is a 'username'.
-    try:
-        validate_email(username_or_email)
-        query_filter = User.email
-    except EmailNotValidError:
-        query_filter = User.username
-
-    # Query the database for a user matching the filter (email or username).
-    # .first() returns the user object or None if not found.
-    user = (
-        session.query(User)
-        .filter(query_filter == username_or_email)
-        .first()
-    )
+    # A single indexed query matches the username or the email.
+    user = get_user(session, username_or_email)
 
     # Verify the user exists and the password is correct.
     # pwd_context.verify() compares the plain text password with the hashed password in the DB.
@@ -54,6 +42,21 @@ def authenticate_user(
     # Return the authenticated user object.
     return user
 
+async def authenticate_user_async(
+    session: AsyncSession,
+    username_or_email: str,
+    password: str,
+) -> User | None:
+    # Same as authenticate_user(), for async routes: the query is awaited
+    # through the async driver and bcrypt runs in the process pool of the
+    # hashing service.
+    user = await get_user_async(session, username_or_email)
+    if not user or not await password_hasher.verify(
+        password, user.hashed_password
+    ):
+        return
+    return user
+
 # Secret key used to sign the JWT. In production, this should be stored in environment variables.
 SECRET_KEY = "a_very_secret_key"
 # Algorithm used for signing the token (HMAC SHA-256).
@@ -61,9 +64,15 @@ ALGORITHM = "HS256"
 # Token validity duration in minutes.
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-def create_access_token(data: dict) -> str:
+def create_access_token(
+    data: dict, role: Role | None = None
+) -> str:
     # Create a copy of the data to avoid mutating the original dictionary.
     to_encode = data.copy()
+    # With a role, the token also carries the role and its permissions
+    # ("role" and "perms" claims): see permissions.py.
+    if role is not None:
+        to_encode.update(permission_claims(role))
     # Calculate the expiration time based on the current UTC time.
     expire = datetime.utcnow() + timedelta(
         minutes=ACCESS_TOKEN_EXPIRE_MINUTES
@@ -76,23 +85,93 @@ def create_access_token(data: dict) -> str:
     )
     return encoded_jwt
 
-def decode_access_token(
-    token: str, session: Session
-) -> User | None:
+# Identity of the user of a verified token: a snapshot of the database row,
+# safe to share between requests and threads, unlike a SQLAlchemy object.
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: int
+    username: str
+    email: str
+    role: Role
+    # Verified claims of the token.
+    claims: dict = field(default_factory=dict, compare=False)
+
+# Tokens already verified, with their user, until the token expires. A cached
+# token skips both the signature check and the database query. Changing a user
+# in the database drops their cached tokens (see the listeners below).
+token_cache = TokenCache(maxsize=4096)
+
+def verify_token(token: str) -> dict | None:
     try:
         payload = jwt.decode(
             token, SECRET_KEY, algorithms=[ALGORITHM]
         )
-        # Extract the 'sub' (subject) claim from the payload.
-        # In this app, the subject is the username.
-        username: str = payload.get("sub")
     except JWTError:
         return
-    if not username:
+    # The 'sub' (subject) claim of the payload is the username in this app.
+    if not payload.get("sub"):
         return
-    user = get_user(session, username)
+    return payload
+
+def _remember_token(
+    token: str, payload: dict, db_user: User, invalidations: int
+) -> AuthenticatedUser:
+    user = AuthenticatedUser(
+        id=db_user.id,
+        username=db_user.username,
+        email=db_user.email,
+        role=db_user.role,
+        claims=payload,
+    )
+    # A token without expiration is verified every time.
+    if payload.get("exp") is not None:
+        token_cache.set(
+            token,
+            user,
+            expires_at=payload["exp"],
+            tag=user.id,
+            invalidations=invalidations,
+        )
     return user
 
+def decode_access_token(
+    token: str, session: Session
+) -> AuthenticatedUser | None:
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    invalidations = token_cache.invalidations
+    payload = verify_token(token)
+    if payload is None:
+        return
+    db_user = get_user(session, payload["sub"])
+    if not db_user:
+        return
+    return _remember_token(token, payload, db_user, invalidations)
+
+# Same as decode_access_token(), for async routes. Cached tokens are answered
+# without awaiting anything.
+async def decode_access_token_async(
+    token: str, session: AsyncSession
+) -> AuthenticatedUser | None:
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    invalidations = token_cache.invalidations
+    payload = verify_token(token)
+    if payload is None:
+        return
+    db_user = await get_user_async(session, payload["sub"])
+    if not db_user:
+        return
+    return _remember_token(token, payload, db_user, invalidations)
+
+def invalidate_user(user_id: int):
+    token_cache.invalidate_tag(user_id)
+
+# Any committed change to a user (role, TOTP secret...) drops their tokens.
+user_change_listeners.append(invalidate_user)
+
 router = APIRouter(tags=["Security"])
 
 # Pydantic model defining the response structure for the access token.
@@ -106,18 +185,22 @@ class Token(BaseModel):
     responses={
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Invalid username or password"
-        }
+        },
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many logins in progress"
+        },
     },
 )
-def get_user_access_token(
+async def get_user_access_token(
     # OAuth2PasswordRequestForm is a built-in dependency to handle form fields (username, password).
     # OAuth2PasswordRequestForm requires the request body to be 'application/x-www-form-urlencoded'.
     # It does NOT accept JSON
     form_data: OAuth2PasswordRequestForm = Depends(),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     # Authenticate the user against the database.
-    user = authenticate_user(
+    # The password check runs in the hashing service's process pool.
+    user = await authenticate_user_async(
         session,
         form_data.username,
         form_data.password,
@@ -127,9 +210,10 @@ def get_user_access_token(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
-    # Create a JWT access token with the user's username as the subject.
+    # Create a JWT access token with the user's username as the subject,
+    # and their role and permissions.
     access_token = create_access_token(
-        data={"sub": user.username}
+        data={"sub": user.username}, role=user.role
     )
     return {
         "access_token": access_token,
@@ -139,6 +223,10 @@ def get_user_access_token(
 # Defines the security scheme. Tells FastAPI that the token is obtained from the "/token" URL
 # and should be sent as a Bearer token in the Authorization header.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Same, for the routes also accepting a session cookie: no error without token.
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl="token", auto_error=False
+)
 
 @router.get(
     "/users/me",
@@ -151,13 +239,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
         },
     },
 )
-def read_user_me(
+async def read_user_me(
     # Extract the token from the request header using the OAuth2 scheme.
     token: str = Depends(oauth2_scheme),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     # Decode the token to identify the current user.
-    user = decode_access_token(token, session)
+    user = await decode_access_token_async(token, session)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
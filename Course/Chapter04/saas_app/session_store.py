@@ -0,0 +1,383 @@
+"""
+Server-side sessions for the browser login of user_session.py. The cookie
+holds a random session id and its HMAC signature ("<id>.<signature>"), the
+session itself stays in a store: in memory (one worker) or in SQLite (all the
+workers of the machine), selected by SESSION_STORE.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Callable, Optional, Protocol
+
+from fastapi import Cookie
+
+from models import Role
+from security import AuthenticatedUser
+from token_cache import TokenCache
+from user_lookup import user_access_listeners
+
+
+SESSION_SECRET_KEY = os.getenv(
+    "SESSION_SECRET_KEY", "a_very_secret_session_key"
+)
+SESSION_COOKIE_NAME = "session"
+# The cookie is only sent over HTTPS. Set to "false" for local HTTP testing.
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "true") == "true"
+# Expiration slides: every use of a session pushes it SESSION_TTL seconds
+# ahead, at most once every SESSION_TOUCH_INTERVAL seconds (which saves a write
+# per request with the SQLite store).
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_TOUCH_INTERVAL = float(os.getenv("SESSION_TOUCH_INTERVAL", "60"))
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DATABASE_PATH = os.getenv("SESSION_DATABASE_PATH", "sessions.db")
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+
+
+def _signature(session_id: str) -> str:
+    digest = hmac.new(
+        SESSION_SECRET_KEY.encode(), session_id.encode(), hashlib.sha256
+    ).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def sign_session_id(session_id: str) -> str:
+    return f"{session_id}.{_signature(session_id)}"
+
+
+def unsign_session_id(cookie: str) -> Optional[str]:
+    session_id, _, signature = cookie.rpartition(".")
+    if not session_id or not hmac.compare_digest(
+        signature, _signature(session_id)
+    ):
+        return
+    return session_id
+
+
+@dataclass(frozen=True)
+class UserSession:
+    id: str
+    user_id: int
+    username: str
+    email: str
+    role: Role
+    expires_at: float
+
+    @property
+    def user(self) -> AuthenticatedUser:
+        return AuthenticatedUser(
+            id=self.user_id,
+            username=self.username,
+            email=self.email,
+            role=self.role,
+        )
+
+
+class SessionStore(Protocol):
+    ttl: float
+    # True if the store does I/O (see end_user_sessions()).
+    blocking: bool
+
+    def create(self, user: AuthenticatedUser) -> UserSession: ...
+
+    def get(self, session_id: str) -> Optional[UserSession]: ...
+
+    # The session if this process knows it, without any I/O and without
+    # extending it. Only for code that must not block (rate limits).
+    def peek(self, session_id: str) -> Optional[UserSession]: ...
+
+    def delete(self, session_id: str): ...
+
+    def delete_user(self, user_id: int): ...
+
+
+class MemorySessionStore:
+    blocking = False
+
+    def __init__(
+        self,
+        ttl: float = SESSION_TTL,
+        maxsize: int = SESSION_MAX_ENTRIES,
+        touch_interval: float = SESSION_TOUCH_INTERVAL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.touch_interval = touch_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        # session id -> session, least recently used first.
+        self._sessions: OrderedDict[str, UserSession] = OrderedDict()
+        # user id -> ids of their sessions, to end them without a scan.
+        self._user_sessions: dict[int, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, user: AuthenticatedUser) -> UserSession:
+        session = UserSession(
+            id=new_session_id(),
+            user_id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            expires_at=self._clock() + self.ttl,
+        )
+        with self._lock:
+            self._sessions[session.id] = session
+            self._user_sessions.setdefault(session.user_id, set()).add(
+                session.id
+            )
+            # The least recently used sessions are dropped first.
+            while len(self._sessions) > self.maxsize:
+                self._forget(next(iter(self._sessions)))
+        return session
+
+    # Called with the lock held.
+    def _forget(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return
+        session_ids = self._user_sessions[session.user_id]
+        session_ids.discard(session_id)
+        if not session_ids:
+            del self._user_sessions[session.user_id]
+
+    def get(self, session_id: str) -> Optional[UserSession]:
+        now = self._clock()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            if session.expires_at <= now:
+                self._forget(session_id)
+                return
+            if session.expires_at - now < self.ttl - self.touch_interval:
+                session = replace(session, expires_at=now + self.ttl)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def peek(self, session_id: str) -> Optional[UserSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or session.expires_at <= self._clock():
+            return None
+        return session
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._forget(session_id)
+
+    def delete_user(self, user_id: int):
+        with self._lock:
+            for session_id in self._user_sessions.pop(user_id, ()):
+                self._sessions.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._user_sessions.clear()
+
+
+class SQLiteSessionStore:
+    blocking = True
+
+    def __init__(
+        self,
+        path: str = SESSION_DATABASE_PATH,
+        ttl: float = SESSION_TTL,
+        touch_interval: float = SESSION_TOUCH_INTERVAL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._clock = clock
+        # One connection per thread.
+        self._local = threading.local()
+        # Sessions resolved by this process, for peek(). A session ended by
+        # another worker stays there until it expires.
+        self._resolved = TokenCache(maxsize=SESSION_MAX_ENTRIES, clock=clock)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY,"
+                " user_id INTEGER NOT NULL,"
+                " username TEXT NOT NULL,"
+                " email TEXT NOT NULL,"
+                " role TEXT NOT NULL,"
+                " expires_at REAL NOT NULL"
+                ")"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_user_id"
+                " ON sessions (user_id)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_expires_at"
+                " ON sessions (expires_at)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            # WAL: lookups of the other workers do not wait for writes.
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def create(self, user: AuthenticatedUser) -> UserSession:
+        now = self._clock()
+        session = UserSession(
+            id=new_session_id(),
+            user_id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            expires_at=now + self.ttl,
+        )
+        with self._connection() as connection:
+            # Expired sessions are purged as new ones are created.
+            connection.execute(
+                "DELETE FROM sessions WHERE expires_at <= ?", (now,)
+            )
+            connection.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    session.id,
+                    session.user_id,
+                    session.username,
+                    session.email,
+                    session.role.value,
+                    session.expires_at,
+                ),
+            )
+        return session
+
+    def get(self, session_id: str) -> Optional[UserSession]:
+        now = self._clock()
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT user_id, username, email, role, expires_at"
+            " FROM sessions WHERE id = ? AND expires_at > ?",
+            (session_id, now),
+        ).fetchone()
+        if row is None:
+            return
+        user_id, username, email, role, expires_at = row
+        if expires_at - now < self.ttl - self.touch_interval:
+            expires_at = now + self.ttl
+            with connection:
+                connection.execute(
+                    "UPDATE sessions SET expires_at = ? WHERE id = ?",
+                    (expires_at, session_id),
+                )
+        session = UserSession(
+            id=session_id,
+            user_id=user_id,
+            username=username,
+            email=email,
+            role=Role(role),
+            expires_at=expires_at,
+        )
+        self._resolved.set(
+            session_id, session, expires_at=expires_at, tag=user_id
+        )
+        return session
+
+    def peek(self, session_id: str) -> Optional[UserSession]:
+        return self._resolved.peek(session_id)
+
+    def delete(self, session_id: str):
+        self._resolved.discard(session_id)
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM sessions WHERE id = ?", (session_id,)
+            )
+
+    def delete_user(self, user_id: int):
+        self._resolved.invalidate_tag(user_id)
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM sessions WHERE user_id = ?", (user_id,)
+            )
+
+    def clear(self):
+        self._resolved.clear()
+        with self._connection() as connection:
+            connection.execute("DELETE FROM sessions")
+
+
+def create_session_store(kind: str = SESSION_STORE) -> SessionStore:
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    if kind == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"unknown session store: {kind}")
+
+
+session_store = create_session_store()
+
+
+# Session of the request, from its cookie: None without a valid session.
+def resolve_session(cookie: Optional[str]) -> Optional[UserSession]:
+    if not cookie:
+        return
+    session_id = unsign_session_id(cookie)
+    if session_id is None:
+        return
+    return session_store.get(session_id)
+
+
+# Session of a cookie, if this process knows it, without any I/O: for the
+# code running on the event loop (see by_user() in main.py).
+def peek_session(cookie: Optional[str]) -> Optional[UserSession]:
+    if not cookie:
+        return
+    session_id = unsign_session_id(cookie)
+    if session_id is None:
+        return
+    return session_store.peek(session_id)
+
+
+# Dependency giving the session of the request, None without a valid one.
+# A plain function: FastAPI runs it in its thread pool, so the SQLite store
+# does not block the event loop.
+def get_user_session(
+    session_cookie: Optional[str] = Cookie(
+        None, alias=SESSION_COOKIE_NAME
+    ),
+) -> Optional[UserSession]:
+    return resolve_session(session_cookie)
+
+
+# A committed change to the access of a user (role, password, deletion...)
+# ends their sessions. Commits of an AsyncSession call this on the event
+# loop: a blocking store is then updated from the default executor.
+def end_user_sessions(user_id: int):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None or not session_store.blocking:
+        session_store.delete_user(user_id)
+    else:
+        loop.run_in_executor(None, session_store.delete_user, user_id)
+
+
+user_access_listeners.append(end_user_sessions)
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from api_key import (
+    APIKeyCache,
+    APIKeyRecord,
+    TokenBuckets,
+    generate_api_key,
+    hash_api_key,
+    seed_api_keys,
+)
+from models import APIKey
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket():
+    clock = Clock()
+    buckets = TokenBuckets(clock=clock)
+    record = APIKeyRecord(
+        id=1, name="k", scopes=frozenset(), rate_limit=60, burst=2
+    )
+    assert buckets.take(record) == 0
+    assert buckets.take(record) == 0
+    # Empty: one token per second (60 per minute).
+    assert buckets.take(record) == pytest.approx(1)
+    clock.now += 1
+    assert buckets.take(record) == 0
+    # Another key has its own bucket.
+    other = APIKeyRecord(
+        id=2, name="k", scopes=frozenset(), rate_limit=60, burst=1
+    )
+    assert buckets.take(other) == 0
+
+
+@pytest.mark.asyncio
+async def test_api_key_cache(session, async_session_factory):
+    key = generate_api_key()
+    session.add(
+        APIKey(name="k", key_hash=hash_api_key(key), scopes="data:read")
+    )
+    session.add(
+        APIKey(
+            name="revoked",
+            key_hash=hash_api_key("revoked"),
+            active=False,
+        )
+    )
+    session.commit()
+    clock = Clock()
+    cache = APIKeyCache(ttl=60, clock=clock)
+    sessions = async_session_factory
+    assert (await cache.get(sessions, key)).scopes == {"data:read"}
+    assert await cache.get(sessions, "revoked") is None
+    assert await cache.get(sessions, "unknown") is None
+    assert cache.reloads == 1
+    clock.now += 60
+    await cache.get(sessions, key)
+    assert cache.reloads == 2
+    cache.invalidate()
+    await cache.get(sessions, key)
+    assert cache.reloads == 3
+    # Concurrent requests after an invalidation share a single reload.
+    cache.invalidate()
+    records = await asyncio.gather(
+        *(cache.get(sessions, key) for _ in range(10))
+    )
+    assert {record.name for record in records} == {"k"}
+    assert cache.reloads == 4
+
+
+def test_seed_api_keys(session):
+    session.add(
+        APIKey(
+            name="revoked",
+            key_hash=hash_api_key("revoked"),
+            active=False,
+        )
+    )
+    session.commit()
+    assert seed_api_keys(session, ["legacy", "revoked"]) == 1
+    # Seeding again adds nothing, and does not bring revoked keys back.
+    assert seed_api_keys(session, ["legacy", "revoked"]) == 0
+    rows = {row.key_hash: row for row in session.query(APIKey)}
+    assert rows[hash_api_key("legacy")].scopes == "data:read"
+    assert not rows[hash_api_key("revoked")].active
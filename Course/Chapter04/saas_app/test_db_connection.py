@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import text
+
+from db_connection import (
+    PoolMetrics,
+    async_url,
+    create_async_db_engine,
+    create_db_engine,
+)
+
+
+def test_sqlite_file_engine_settings(tmp_path):
+    metrics = PoolMetrics()
+    engine = create_db_engine(
+        f"sqlite:///{tmp_path / 'database.db'}", metrics
+    )
+    with engine.connect() as connection:
+        assert (
+            connection.execute(text("PRAGMA journal_mode")).scalar()
+            == "wal"
+        )
+        # 1 is NORMAL.
+        assert (
+            connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        )
+        assert connection.execute(text("PRAGMA mmap_size")).scalar() > 0
+        assert metrics.checked_out == 1
+    with engine.connect(), engine.connect():
+        assert metrics.max_checked_out == 2
+    assert metrics.as_dict() == {
+        "connections": 2,
+        "checkouts": 3,
+        "checkins": 3,
+        "checked_out": 0,
+        "max_checked_out": 2,
+    }
+    assert engine.pool.size() == 5
+    engine.dispose()
+
+
+def test_in_memory_engine():
+    engine = create_db_engine("sqlite://")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_async_url():
+    assert async_url("sqlite:///database.db") == (
+        "sqlite+aiosqlite:///database.db"
+    )
+    # Already async, or no known async driver: unchanged.
+    assert async_url("postgresql+asyncpg://u:p@host/db") == (
+        "postgresql+asyncpg://u:p@host/db"
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_engine_settings(tmp_path):
+    metrics = PoolMetrics()
+    engine = create_async_db_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'database.db'}", metrics
+    )
+    async with engine.connect() as connection:
+        assert (
+            await connection.scalar(text("PRAGMA journal_mode"))
+        ) == "wal"
+        assert metrics.checked_out == 1
+    assert metrics.checkins == 1
+    assert engine.pool.size() == 5
+    await engine.dispose()
@@ -0,0 +1,90 @@
+import httpx
+import pytest
+
+from github_client import GitHubClient, GitHubUnavailable
+
+
+def stub_github(handler, **kwargs) -> GitHubClient:
+    return GitHubClient(
+        url="http://github.test",
+        api_url="http://api.github.test",
+        transport=httpx.MockTransport(handler),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_user_uses_the_overridden_url():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(200, json={"login": "johndoe"})
+
+    github = stub_github(handler)
+    assert await github.get_user("token") == {"login": "johndoe"}
+    assert await github.get_user("token") == {"login": "johndoe"}
+    assert str(requests[0].url) == "http://api.github.test/user"
+    assert requests[0].headers["Authorization"] == "token"
+    # The same client serves every call.
+    client = github.client
+    await github.get_user("token")
+    assert github.client is client
+    await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_user_is_retried():
+    responses = iter(
+        [httpx.Response(503), httpx.Response(200, json={"login": "a"})]
+    )
+    github = stub_github(lambda request: next(responses))
+    assert await github.get_user("token") == {"login": "a"}
+    await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_rejected_token_gives_no_user():
+    github = stub_github(lambda request: httpx.Response(401))
+    assert await github.get_user("token") == {}
+    await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_github_unavailable():
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request)
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    github = stub_github(handler, retries=2)
+    with pytest.raises(GitHubUnavailable):
+        await github.get_user("token")
+    assert len(calls) == 3
+    # The code exchange is not idempotent: a single attempt.
+    calls.clear()
+    with pytest.raises(GitHubUnavailable):
+        await github.exchange_code("code", "id", "secret", "uri")
+    assert len(calls) == 1
+    await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_failed_connections_are_retried_for_every_call():
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request)
+        if len(calls) < 3:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"access_token": "token"})
+
+    # Nothing was sent: even the code exchange is retried, and only by the
+    # client (retries=2 gives 3 attempts in all).
+    github = stub_github(handler, retries=2)
+    assert await github.exchange_code("code", "id", "secret", "uri") == {
+        "access_token": "token"
+    }
+    assert len(calls) == 3
+    await github.aclose()
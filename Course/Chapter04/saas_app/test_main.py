@@ -1,22 +1,44 @@
+from unittest.mock import patch
+
+import httpx
+import pyotp
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 
-from db_connection import get_session
+from api_key import api_key_cache
+from db_connection import (
+    get_async_session,
+    get_async_session_factory,
+    get_session,
+)
+from github_client import GitHubClient, get_github_client
 from main import app
+from models import APIKey, Role, User
+from operations import add_user
+from password_hashing import password_hasher
+from security import create_access_token
 
 
 # Fixture to create a TestClient for the FastAPI app.
-# It receives the 'session' fixture (from conftest.py) which is connected to the in-memory test database.
+# It receives the 'session' fixture (from conftest.py) which is connected to the test database,
+# and a factory of async sessions on the same database for the async routes.
 @pytest.fixture
-def client(session):
+def client(session, async_session_factory):
+    async def get_test_async_session():
+        async with async_session_factory() as async_session:
+            yield async_session
+
     # Dependency Override:
     # We replace the 'get_session' dependency used in the main app with the test 'session'.
-    # This ensures that when the app runs this test, it uses the in-memory database instead of the real one.
+    # This ensures that when the app runs this test, it uses the test database instead of the real one.
     # The '|=' operator (in-place union) updates the dictionary with new key-value pairs.
     # It is equivalent to 'app.dependency_overrides.update({...})'.
     # This ensures we don't overwrite existing overrides if any were set previously.
     app.dependency_overrides |= {
-        get_session: lambda: session
+        get_session: lambda: session,
+        get_async_session: get_test_async_session,
+        get_async_session_factory: lambda: async_session_factory,
     }
     
     # Create the TestClient, which allows making HTTP requests to the app without running a server.
@@ -46,3 +68,354 @@ def test_endpoint_add_basic_user(client):
             "email": "lyampayet@email.com",
         },
     }
+
+
+def test_endpoint_login_and_register_when_hashing_is_saturated(
+    client, fill_database_session
+):
+    response = client.post(
+        "/token",
+        data={"username": "johndoe", "password": "pass1234"},
+    )
+    assert response.status_code == 200
+
+    # No room left in the password hashing service: fail fast with a 429.
+    with patch.object(password_hasher, "max_pending", 0):
+        response = client.post(
+            "/token",
+            data={"username": "johndoe", "password": "pass1234"},
+        )
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+        response = client.post(
+            "/register/premium-user",
+            json={
+                "username": "newuser",
+                "password": "password",
+                "email": "newuser@email.com",
+            },
+        )
+        assert response.status_code == 429
+    assert password_hasher.stats()["rejected"] >= 2
+    assert password_hasher.stats()["pending"] == 0
+
+
+def test_endpoints_on_the_async_session(client, fill_database_session):
+    response = client.post(
+        "/token",
+        data={"username": "johndoe", "password": "pass1234"},
+    )
+    headers = {
+        "Authorization": f"Bearer {response.json()['access_token']}"
+    }
+    response = client.get("/users/me", headers=headers)
+    assert response.json() == {"description": "johndoe authorized"}
+
+    response = client.post("/user/enable-mfa", headers=headers)
+    assert response.status_code == 200
+    # The secret was committed through the async session.
+    fill_database_session.expire_all()
+    user = fill_database_session.query(User).filter_by(
+        username="johndoe"
+    ).one()
+    assert user.totp_secret is not None
+
+    response = client.post(
+        "/verify-totp",
+        params={
+            "code": pyotp.TOTP(user.totp_secret).now(),
+            "username": "johndoe",
+        },
+    )
+    assert response.status_code == 200
+    # The same code cannot be used twice.
+    response = client.post(
+        "/verify-totp",
+        params={
+            "code": pyotp.TOTP(user.totp_secret).now(),
+            "username": "johndoe",
+        },
+    )
+    assert response.status_code == 401
+    # Nor through the email of the user.
+    response = client.post(
+        "/verify-totp",
+        params={
+            "code": pyotp.TOTP(user.totp_secret).now(),
+            "username": user.email,
+        },
+    )
+    assert response.status_code == 401
+    # Failed attempts are counted per user, whatever the login: 2 so far.
+    for _ in range(3):
+        client.post(
+            "/verify-totp",
+            params={"code": "000000", "username": "johndoe"},
+        )
+    response = client.post(
+        "/verify-totp",
+        params={"code": "000000", "username": "johndoe"},
+    )
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    response = client.post(
+        "/verify-totp", params={"code": "000000", "username": "nobody"}
+    )
+    assert response.status_code == 400
+
+
+def test_github_endpoints_with_a_stub(client, fill_database_session):
+    def github(request: httpx.Request):
+        if request.url.path == "/login/oauth/access_token":
+            return httpx.Response(
+                200, json={"access_token": "gho_token"}
+            )
+        if request.headers["Authorization"] == "Bearer gho_token":
+            return httpx.Response(200, json={"login": "johndoe"})
+        return httpx.Response(401)
+
+    app.dependency_overrides[get_github_client] = lambda: GitHubClient(
+        url="http://github.test",
+        api_url="http://api.github.test",
+        transport=httpx.MockTransport(github),
+    )
+    try:
+        response = client.get(
+            "/github/auth/token", params={"code": "code"}
+        )
+        assert response.json() == {
+            "access_token": "gho_token",
+            "token_type": "bearer",
+        }
+        response = client.get(
+            "/home", headers={"Authorization": "Bearer gho_token"}
+        )
+        assert response.json() == {"message": "logged in johndoe !"}
+        response = client.get(
+            "/home", headers={"Authorization": "Bearer other"}
+        )
+        assert response.status_code == 403
+    finally:
+        del app.dependency_overrides[get_github_client]
+
+
+def test_github_unavailable(client):
+    def github(request: httpx.Request):
+        raise httpx.ConnectError("unreachable", request=request)
+
+    app.dependency_overrides[get_github_client] = lambda: GitHubClient(
+        transport=httpx.MockTransport(github), retries=0
+    )
+    try:
+        response = client.get(
+            "/github/auth/token", params={"code": "code"}
+        )
+        assert response.status_code == 502
+    finally:
+        del app.dependency_overrides[get_github_client]
+
+
+def test_routes_are_authorized_from_the_token_claims(
+    client, fill_database_session, async_session_factory
+):
+    def token(username, password):
+        return client.post(
+            "/token", data={"username": username, "password": password}
+        ).json()["access_token"]
+
+    basic = {"Authorization": f"Bearer {token('johndoe', 'pass1234')}"}
+    premium = {
+        "Authorization": f"Bearer {token('manucourtney', 'harderpass')}"
+    }
+    statements = []
+    event.listen(
+        async_session_factory.kw["bind"].sync_engine,
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    assert client.get("/welcome/all-users", headers=basic).status_code == 200
+    assert (
+        client.get("/welcome/premium-user", headers=basic).status_code
+        == 401
+    )
+    assert (
+        client.get("/welcome/premium-user", headers=premium).status_code
+        == 200
+    )
+    # Authorized from the claims alone.
+    assert statements == []
+    assert (
+        client.get(
+            "/welcome/all-users",
+            headers={"Authorization": "Bearer not-a-jwt"},
+        ).status_code
+        == 401
+    )
+    # Tokens issued without the claims: the role is read from the database.
+    legacy = create_access_token({"sub": "manucourtney"})
+    assert (
+        client.get(
+            "/welcome/premium-user",
+            headers={"Authorization": f"Bearer {legacy}"},
+        ).status_code
+        == 200
+    )
+    # ... and is not cached past a change of the user.
+    user = fill_database_session.query(User).filter_by(
+        username="manucourtney"
+    ).one()
+    user.role = Role.basic
+    fill_database_session.commit()
+    assert (
+        client.get(
+            "/welcome/premium-user",
+            headers={"Authorization": f"Bearer {legacy}"},
+        ).status_code
+        == 401
+    )
+
+
+def test_session_login(client, fill_database_session, async_session_factory):
+    token = client.post(
+        "/token", data={"username": "johndoe", "password": "pass1234"}
+    ).json()["access_token"]
+    # The session cookie is only sent back over HTTPS.
+    client.base_url = "https://testserver"
+    response = client.post(
+        "/login", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert "Secure" in response.headers["set-cookie"]
+    assert "session" in client.cookies
+    statements = []
+    event.listen(
+        async_session_factory.kw["bind"].sync_engine,
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    # The session cookie alone authenticates the requests, without queries.
+    assert client.get("/welcome/all-users").status_code == 200
+    assert client.get("/welcome/premium-user").status_code == 401
+    assert statements == []
+    # Enabling MFA changes the user, not their access: the session stays.
+    assert client.post("/user/enable-mfa").status_code == 200
+    assert client.get("/welcome/all-users").status_code == 200
+    # A tampered cookie is rejected.
+    cookie = client.cookies["session"]
+    tampered = "y" if cookie[0] == "x" else "x"
+    client.cookies["session"] = tampered + cookie[1:]
+    assert client.get("/welcome/all-users").status_code == 401
+    client.cookies["session"] = cookie
+    assert client.post("/logout").status_code == 200
+    client.cookies["session"] = cookie
+    assert client.get("/welcome/all-users").status_code == 401
+
+
+def test_import_users_endpoint(client, session):
+    add_user(session, "admin", "adminpass", "admin@email.com", Role.admin)
+    add_user(session, "basic", "basicpass", "basic@email.com")
+
+    def headers(username, password):
+        token = client.post(
+            "/token", data={"username": username, "password": password}
+        ).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    files = {
+        "file": (
+            "users.ndjson",
+            b'{"username": "a", "email": "a@email.com", "password": "p"}\n'
+            b'{"username": "b", "email": "admin@email.com", "password": "p"}\n',
+        )
+    }
+    response = client.post(
+        "/import/users",
+        files=files,
+        headers=headers("basic", "basicpass"),
+    )
+    assert response.status_code == 401
+    response = client.post(
+        "/import/users",
+        files=files,
+        headers=headers("admin", "adminpass"),
+    )
+    assert response.json() == {
+        "imported": 1,
+        "errors": [{"line": 2, "username": "b", "reason": "email taken"}],
+    }
+    response = client.post(
+        "/token", data={"username": "a", "password": "p"}
+    )
+    assert response.status_code == 200
+
+
+def test_api_keys(client, session):
+    add_user(session, "admin", "adminpass", "admin@email.com", Role.admin)
+    token = client.post(
+        "/token", data={"username": "admin", "password": "adminpass"}
+    ).json()["access_token"]
+    admin = {"Authorization": f"Bearer {token}"}
+    assert client.get("/secure-data").status_code == 403
+    assert (
+        client.get("/secure-data", headers={"X-API-Key": "nope"}).status_code
+        == 403
+    )
+    response = client.post(
+        "/api-keys", json={"name": "billing", "burst": 2}, headers=admin
+    )
+    assert response.status_code == 201
+    key = response.json()["api_key"]
+    # The key itself is not stored.
+    assert session.query(APIKey).one().key_hash != key
+    reloads = api_key_cache.reloads
+    assert (
+        client.get("/secure-data", headers={"X-API-Key": key}).status_code
+        == 200
+    )
+    assert client.get(f"/secure-data?api_key={key}").status_code == 200
+    # Quota exhausted.
+    response = client.get("/secure-data", headers={"X-API-Key": key})
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    # Checked from the in-memory cache, loaded once after the key was created.
+    assert api_key_cache.reloads == reloads + 1
+    response = client.delete(
+        f"/api-keys/{session.query(APIKey).one().id}", headers=admin
+    )
+    assert response.status_code == 200
+    assert (
+        client.get("/secure-data", headers={"X-API-Key": key}).status_code
+        == 403
+    )
+
+
+def test_rate_limits(client, fill_database_session):
+    token = client.post(
+        "/token", data={"username": "johndoe", "password": "pass1234"}
+    ).json()["access_token"]
+    user = {"Authorization": f"Bearer {token}"}
+    response = client.get("/users/me", headers=user)
+    assert response.headers["RateLimit-Policy"] == "600;w=60;burst=100"
+    # The login endpoints accept 20 requests per minute and per IP. The
+    # requests past that are refused before the form is even read.
+    for _ in range(19):
+        assert client.post("/token").status_code == 422
+    response = client.post("/token")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert response.headers["RateLimit-Remaining"] == "0"
+    # Made-up keys and tokens do not get a bucket of their own: they are
+    # counted against the IP, unlike the token verified above.
+    # The bucket of the IP holds 100 requests, and refills meanwhile.
+    for number in range(200):
+        response = client.get(
+            "/welcome/all-users",
+            headers={
+                "X-API-Key": f"key{number}",
+                "Authorization": f"Bearer token{number}",
+            },
+        )
+        if response.status_code == 429:
+            break
+    assert response.status_code == 429
+    assert client.get("/users/me", headers=user).status_code == 200
@@ -0,0 +1,94 @@
+import pyotp
+
+from mfa_service import MFAService, Verification
+
+SECRET = pyotp.random_base32()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_010.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def code_at(timestamp: float) -> str:
+    return pyotp.TOTP(SECRET).at(int(timestamp))
+
+
+def test_codes_of_the_window_are_accepted_once():
+    clock = Clock()
+    service = MFAService(clock=clock)
+    service.remember("johndoe", 1, SECRET)
+    assert service.user_id("johndoe") == 1
+    for offset in (-30, 0, 30):
+        assert (
+            service.verify(1, code_at(clock.now + offset))
+            == Verification.valid
+        )
+    # Replayed codes are refused.
+    assert (
+        service.verify(1, code_at(clock.now))
+        == Verification.replayed
+    )
+    assert (
+        service.verify(1, code_at(clock.now - 60))
+        == Verification.invalid
+    )
+
+
+def test_attempts_are_limited_per_time_step():
+    clock = Clock()
+    service = MFAService(max_attempts=2, clock=clock)
+    service.remember("johndoe", 1, SECRET)
+    wrong = "x" * 6
+    assert service.verify(1, wrong) == Verification.invalid
+    assert service.verify(1, wrong) == Verification.invalid
+    # Locked out, even with the right code, until the next time step.
+    assert (
+        service.verify(1, code_at(clock.now))
+        == Verification.locked
+    )
+    clock.now += service.seconds_to_next_step()
+    assert (
+        service.verify(1, code_at(clock.now))
+        == Verification.valid
+    )
+
+
+def test_changed_users_are_reloaded():
+    clock = Clock()
+    service = MFAService(clock=clock)
+    service.remember("johndoe", 1, SECRET)
+    assert (
+        service.verify(1, code_at(clock.now))
+        == Verification.valid
+    )
+    service.forget_user(1)
+    assert service.user_id("johndoe") is None
+    # Reloaded with the same secret: the used codes are still refused.
+    service.remember("johndoe", 1, SECRET)
+    assert (
+        service.verify(1, code_at(clock.now))
+        == Verification.replayed
+    )
+    # A secret read before the change is not kept.
+    invalidations = service.invalidations
+    service.forget_user(1)
+    service.remember("johndoe", 1, SECRET, invalidations)
+    assert service.user_id("johndoe") is None
+
+
+def test_username_and_email_share_the_state():
+    clock = Clock()
+    service = MFAService(max_attempts=2, clock=clock)
+    service.remember("johndoe", 1, SECRET)
+    assert service.verify(1, code_at(clock.now)) == Verification.valid
+    # Found again through the email: the same user, the same used codes.
+    service.remember("johndoe@email.com", 1, SECRET)
+    assert service.user_id("johndoe@email.com") == 1
+    assert service.verify(1, code_at(clock.now)) == Verification.replayed
+    # The aliases of a changed user are forgotten.
+    service.forget_user(1)
+    assert service.user_id("johndoe@email.com") is None
@@ -1,5 +1,17 @@
-from operations import add_user
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event
+
+from operations import (
+    add_user,
+    add_user_async,
+    get_user,
+    get_user_async,
+    seed_admin,
+)
 from models import User, Role
+from user_lookup import identity_map, looks_like_email
 
 
 def test_add_user_into_the_database(session):
@@ -15,4 +27,93 @@ def test_add_user_into_the_database(session):
         .filter(User.id == user.id)
         .first()
         == user
-    )
\ No newline at end of file
+    )
+
+def test_seed_admin(session):
+    admin = seed_admin(session, "root", "rootpass", "root@email.com")
+    assert admin.role == Role.admin
+    # Seeding again keeps the user, and promotes an existing one.
+    assert seed_admin(session, "root", "other", "root@email.com").id == admin.id
+    add_user(session, "johndoe", "pass", "john@email.com")
+    assert seed_admin(session, "johndoe", "x", "x@email.com").role == Role.admin
+    assert session.query(User).count() == 2
+
+
+def test_get_user_by_username_or_email(fill_database_session):
+    session = fill_database_session
+    assert get_user(session, "johndoe").email == "johndoe@email.com"
+    assert get_user(session, "mcourtney@email.com").username == "manucourtney"
+    assert get_user(session, "nobody") is None
+
+
+@pytest.mark.asyncio
+async def test_add_and_get_user_async(session, async_session):
+    user = await add_user_async(
+        async_session, "alice", "pass1234", "alice@email.com"
+    )
+    assert user.id is not None
+    assert (
+        await get_user_async(async_session, "alice@email.com")
+    ).username == "alice"
+    # Seen by the synchronous sessions as well: same database.
+    assert get_user(session, "alice").id == user.id
+    # Same username: rejected, and the session is usable again.
+    assert (
+        await add_user_async(
+            async_session, "alice", "pass1234", "other@email.com"
+        )
+        is None
+    )
+    assert await get_user_async(async_session, "nobody") is None
+
+
+def test_get_user_prefers_the_column_matching_the_shape(session):
+    # "bob@email.com" is the username of a user and the email of another.
+    add_user(session, "bob@email.com", "pass", "first@email.com")
+    add_user(session, "bob", "pass", "bob@email.com")
+    assert get_user(session, "bob@email.com").username == "bob"
+    assert looks_like_email("bob@email.com")
+    assert not looks_like_email("bob")
+    assert not looks_like_email("bob@localhost")
+
+
+def test_get_user_with_identity_map(fill_database_session):
+    session = fill_database_session
+    statements = []
+    event.listen(
+        session.get_bind(),
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    with patch.object(identity_map, "maxsize", 10):
+        user = get_user(session, "johndoe")
+        session.expunge_all()
+        # Found in the identity map: no query, and the user is usable
+        # like any user loaded by the session.
+        statements.clear()
+        cached = get_user(session, "johndoe")
+        assert statements == []
+        assert cached.id == user.id
+        cached.role = Role.premium
+        session.commit()
+        # The commit dropped the user from the identity map.
+        assert identity_map.get("johndoe") is None
+        assert get_user(session, "johndoe").role == Role.premium
+    identity_map.clear()
+
+
+@pytest.mark.asyncio
+async def test_get_user_async_with_identity_map(
+    fill_database_session, async_session
+):
+    with patch.object(identity_map, "maxsize", 10):
+        user = await get_user_async(async_session, "johndoe")
+        async_session.expunge_all()
+        # Merged from the identity map, and still modifiable.
+        cached = await get_user_async(async_session, "johndoe")
+        assert cached is not user and cached.id == user.id
+        cached.role = Role.premium
+        await async_session.commit()
+        # Committing through the async session invalidates it too.
+        assert identity_map.get("johndoe") is None
+    identity_map.clear()
@@ -0,0 +1,47 @@
+from models import Role
+from permissions import (
+    PERMISSION_BITS,
+    Permission,
+    PermissionTable,
+    Principal,
+    permission_claims,
+)
+
+
+def test_principal_from_claims():
+    claims = {"sub": "johndoe", **permission_claims(Role.basic)}
+    principal = Principal.from_claims(claims)
+    assert principal.role == Role.basic
+    assert principal.allows(
+        PERMISSION_BITS[Permission.read_welcome.value]
+    )
+    assert not principal.allows(
+        PERMISSION_BITS[Permission.read_premium.value]
+    )
+    # Admins get every permission but the premium space.
+    admin = Principal.from_claims(
+        {"sub": "root", **permission_claims(Role.admin)}
+    )
+    assert admin.allows(PERMISSION_BITS[Permission.import_users.value])
+    assert not admin.allows(PERMISSION_BITS[Permission.read_premium.value])
+    # Without the claims, there is no principal.
+    assert Principal.from_claims({"sub": "johndoe"}) is None
+    # Unknown permissions grant nothing.
+    assert Principal.from_claims(
+        {"sub": "johndoe", "role": "basic", "perms": ["all"]}
+    ).mask == 0
+
+
+def test_permission_table():
+    table = PermissionTable()
+
+    @table.require(Permission.read_welcome, Permission.read_premium)
+    def endpoint():
+        pass
+
+    assert table.compile() == {
+        endpoint: PERMISSION_BITS[Permission.read_welcome.value]
+        | PERMISSION_BITS[Permission.read_premium.value]
+    }
+    assert table.required(endpoint) == table.table[endpoint]
+    assert table.required(test_permission_table) is None
@@ -0,0 +1,177 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rate_limit import (
+    MemoryRateLimitStore,
+    RateLimit,
+    RateLimitMiddleware,
+    SlidingWindow,
+    SQLiteRateLimitStore,
+    TokenBucket,
+    by_ip,
+    first_of,
+    parse_rate,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 6000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_parse_rate():
+    assert parse_rate("10/minute") == (10, 60)
+    assert parse_rate("5/second") == (5, 1)
+
+
+def test_sliding_window():
+    window = SlidingWindow(2, 60)
+    state, decision = window.hit(None, 6000)
+    assert decision.allowed and decision.remaining == 1
+    state, decision = window.hit(state, 6010)
+    assert decision.allowed and decision.remaining == 0
+    state, decision = window.hit(state, 6020)
+    assert not decision.allowed
+    # Next window: the 2 requests still weigh until it is half over.
+    assert decision.retry_after == pytest.approx(70)
+    state, decision = window.hit(state, 6060)
+    assert not decision.allowed
+    assert decision.retry_after == pytest.approx(30)
+    state, decision = window.hit(state, 6090)
+    assert decision.allowed
+    # Two windows later, everything is forgotten.
+    state, decision = window.hit(state, 6250)
+    assert decision.allowed and decision.remaining == 1
+
+
+def test_token_bucket():
+    bucket = TokenBucket(60, 60, burst=2)
+    state, decision = bucket.hit(None, 0)
+    assert decision.allowed and decision.remaining == 1
+    state, decision = bucket.hit(state, 0)
+    assert decision.allowed and decision.remaining == 0
+    state, decision = bucket.hit(state, 0)
+    assert not decision.allowed
+    assert decision.retry_after == pytest.approx(1)
+    state, decision = bucket.hit(state, 1)
+    assert decision.allowed
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteRateLimitStore(str(tmp_path / "rate_limits.db"))
+    return MemoryRateLimitStore(shards=4)
+
+
+def test_store(store):
+    bucket = TokenBucket(60, 60, burst=2)
+    assert store.hit("a", bucket, 0).allowed
+    assert store.hit("a", bucket, 0).allowed
+    assert not store.hit("a", bucket, 0).allowed
+    # Other keys are counted apart.
+    assert store.hit("b", bucket, 0).allowed
+    store.clear()
+    assert store.hit("a", bucket, 0).allowed
+
+
+def test_store_hit_many_is_all_or_nothing(store):
+    bucket = TokenBucket(60, 60, burst=2)
+    window = SlidingWindow(1, 60)
+    hits = [("api:a", bucket), ("login:a", window)]
+    assert [d.allowed for d in store.hit_many(hits, 0)] == [True, True]
+    assert [d.allowed for d in store.hit_many(hits, 0)] == [True, False]
+    # The refused hit did not use up the bucket.
+    assert store.hit("api:a", bucket, 0).allowed
+    assert not store.hit("api:a", bucket, 0).allowed
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / "rate_limits.db")
+    bucket = TokenBucket(60, 60, burst=1)
+    assert SQLiteRateLimitStore(path).hit("a", bucket, 0).allowed
+    # As seen by another worker.
+    assert not SQLiteRateLimitStore(path).hit("a", bucket, 0).allowed
+
+
+def test_memory_store_drops_least_recently_updated_keys():
+    store = MemoryRateLimitStore(shards=1, max_keys=2)
+    bucket = TokenBucket(60, 60, burst=1)
+    for key in "abc":
+        store.hit(key, bucket, 0)
+    assert len(store) == 2
+    assert store.hit("a", bucket, 0).allowed
+
+
+# The SQLite store is called from a worker thread, not the event loop.
+def test_middleware(store):
+    app = FastAPI()
+    calls = []
+
+    @app.post("/token")
+    def token():
+        calls.append("token")
+        return {}
+
+    @app.get("/items")
+    def items():
+        return {}
+
+    # A key function only trusting the keys it knows.
+    def by_known_key(scope: dict):
+        for name, value in scope["headers"]:
+            if name == b"x-api-key" and value == b"key":
+                return "key:1"
+
+    clock = Clock()
+    app.add_middleware(
+        RateLimitMiddleware,
+        rules=[
+            RateLimit(
+                "login", SlidingWindow(1, 60), by_ip, paths=("/token",)
+            ),
+            RateLimit(
+                "api",
+                TokenBucket(60, 60, burst=3),
+                first_of(by_known_key, by_ip),
+            ),
+        ],
+        store=store,
+        clock=clock,
+    )
+    client = TestClient(app)
+    response = client.get("/items")
+    assert response.status_code == 200
+    assert response.headers["RateLimit-Limit"] == "3"
+    assert response.headers["RateLimit-Remaining"] == "2"
+    assert response.headers["RateLimit-Policy"] == "60;w=60;burst=3"
+    # The most restrictive rule sets the headers.
+    response = client.post("/token")
+    assert response.headers["RateLimit-Remaining"] == "0"
+    assert response.headers["RateLimit-Policy"] == "1;w=60"
+    response = client.post("/token")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "120"
+    # Refused before reaching the endpoint, and without taking a token from
+    # the bucket of the "api" rule.
+    assert calls == ["token"]
+    response = client.get("/items")
+    assert response.status_code == 200
+    assert response.headers["RateLimit-Remaining"] == "0"
+    # The bucket of the IP is empty, not the one of a known API key.
+    assert client.get("/items").status_code == 429
+    assert (
+        client.get("/items", headers={"X-API-Key": "key"}).status_code
+        == 200
+    )
+    # Unknown keys are counted against the IP.
+    assert (
+        client.get("/items", headers={"X-API-Key": "other"}).status_code
+        == 429
+    )
+    clock.now += 1
+    assert client.get("/items").status_code == 200
@@ -1,4 +1,17 @@
-from security import authenticate_user
+from unittest.mock import patch
+
+import pytest
+
+from models import Role, User
+from security import (
+    authenticate_user,
+    authenticate_user_async,
+    create_access_token,
+    decode_access_token,
+    decode_access_token_async,
+    token_cache,
+)
+from token_cache import TokenCache
 
 
 def test_authenticate_user_with_username(
@@ -40,4 +53,85 @@ def test_authenticate_user_incorrect_password(session):
             "incorrect_password",
         )
         is None
-    )
\ No newline at end of file
+    )
+
+@pytest.mark.asyncio
+async def test_authenticate_user_async(
+    fill_database_session, async_session
+):
+    user = await authenticate_user_async(
+        async_session, "johndoe", "pass1234"
+    )
+    assert user.username == "johndoe"
+    assert (
+        await authenticate_user_async(
+            async_session, "johndoe", "wrong"
+        )
+        is None
+    )
+
+@pytest.mark.asyncio
+async def test_decode_access_token_async(
+    fill_database_session, async_session
+):
+    token = create_access_token({"sub": "johndoe"})
+    user = await decode_access_token_async(token, async_session)
+    assert user.username == "johndoe"
+    # Same cache as decode_access_token().
+    assert decode_access_token(token, fill_database_session) is user
+    assert (
+        await decode_access_token_async("not-a-jwt", async_session)
+        is None
+    )
+
+
+def test_decode_access_token_is_cached_until_user_changes(
+    fill_database_session,
+):
+    session = fill_database_session
+    token = create_access_token({"sub": "johndoe"})
+    user = decode_access_token(token, session)
+    assert user.username == "johndoe"
+    assert user.role == Role.basic
+
+    # A cached token needs neither the signature check nor the database.
+    with patch("security.jwt.decode") as decode, patch(
+        "security.get_user"
+    ) as get_user:
+        assert decode_access_token(token, session) is user
+    decode.assert_not_called()
+    get_user.assert_not_called()
+
+    # Changing the user drops the cached token once committed.
+    db_user = session.query(User).filter_by(username="johndoe").one()
+    db_user.role = Role.premium
+    session.commit()
+    assert decode_access_token(token, session).role == Role.premium
+
+
+def test_decode_access_token_rejects_invalid_tokens(
+    fill_database_session,
+):
+    assert decode_access_token("not-a-jwt", fill_database_session) is None
+    token = create_access_token({"sub": "nobody"})
+    assert decode_access_token(token, fill_database_session) is None
+    assert token_cache.get(token) is None
+
+
+def test_token_cache_expires_and_evicts():
+    now = [0.0]
+    cache = TokenCache(maxsize=2, clock=lambda: now[0])
+    cache.set("a", 1, expires_at=10, tag=1)
+    cache.set("b", 2, expires_at=20, tag=2)
+    assert cache.get("a") == 1
+    cache.set("c", 3, expires_at=20, tag=1)
+    assert cache.get("b") is None
+    now[0] = 10
+    assert cache.get("a") is None
+    assert cache.get("c") == 3
+    # Values loaded before an invalidation are not cached.
+    invalidations = cache.invalidations
+    cache.invalidate_tag(1)
+    cache.set("d", 4, expires_at=20, tag=3, invalidations=invalidations)
+    assert cache.get("d") is None
+    assert len(cache) == 0
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+
+import pytest
+
+from models import Role
+from security import AuthenticatedUser
+import session_store
+from session_store import (
+    MemorySessionStore,
+    SQLiteSessionStore,
+    sign_session_id,
+    unsign_session_id,
+)
+
+USER = AuthenticatedUser(
+    id=1, username="johndoe", email="johndoe@email.com", role=Role.basic
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_signed_session_ids():
+    cookie = sign_session_id("abc")
+    assert unsign_session_id(cookie) == "abc"
+    assert unsign_session_id("abd" + cookie[3:]) is None
+    assert unsign_session_id(cookie + "x") is None
+    assert unsign_session_id("abc") is None
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store_and_clock(request, tmp_path):
+    clock = Clock()
+    if request.param == "memory":
+        return (
+            MemorySessionStore(ttl=100, touch_interval=10, clock=clock),
+            clock,
+        )
+    return (
+        SQLiteSessionStore(
+            str(tmp_path / "sessions.db"),
+            ttl=100,
+            touch_interval=10,
+            clock=clock,
+        ),
+        clock,
+    )
+
+
+def test_sliding_expiration(store_and_clock):
+    store, clock = store_and_clock
+    session = store.create(USER)
+    assert store.get(session.id).user == USER
+    # Used before it expires: the expiration slides.
+    clock.now += 90
+    assert store.get(session.id).expires_at == clock.now + 100
+    clock.now += 90
+    assert store.get(session.id) is not None
+    # Not used for longer than the TTL: expired.
+    clock.now += 101
+    assert store.get(session.id) is None
+
+
+def test_peek_without_io(store_and_clock):
+    store, clock = store_and_clock
+    session = store.create(USER)
+    # The SQLite store only knows the sessions it resolved.
+    store.get(session.id)
+    assert store.peek(session.id).username == "johndoe"
+    assert store.peek("unknown") is None
+    # Peeking does not extend the session.
+    clock.now += 95
+    store.peek(session.id)
+    clock.now += 10
+    assert store.peek(session.id) is None
+    assert store.get(session.id) is None
+    other = store.create(USER)
+    store.get(other.id)
+    store.delete_user(USER.id)
+    assert store.peek(other.id) is None
+
+
+def test_delete_sessions(store_and_clock):
+    store, _ = store_and_clock
+    first, second = store.create(USER), store.create(USER)
+    store.delete(first.id)
+    assert store.get(first.id) is None
+    assert store.get(second.id) is not None
+    store.delete_user(USER.id)
+    assert store.get(second.id) is None
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(maxsize=2)
+    first, second = store.create(USER), store.create(USER)
+    store.get(first.id)
+    third = store.create(USER)
+    assert store.get(second.id) is None
+    assert store.get(first.id) is not None
+    assert store.get(third.id) is not None
+    # The sessions of a user are found without a scan, evicted ones included.
+    store.delete_user(USER.id)
+    assert len(store) == 0
+    assert store._user_sessions == {}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_sessions_end_off_the_event_loop(tmp_path, monkeypatch):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(session_store, "session_store", store)
+    session = store.create(USER)
+    threads = []
+    delete_user = store.delete_user
+
+    def recording_delete_user(user_id):
+        delete_user(user_id)
+        threads.append(threading.current_thread())
+
+    monkeypatch.setattr(store, "delete_user", recording_delete_user)
+    session_store.end_user_sessions(USER.id)
+    while not threads:
+        await asyncio.sleep(0.01)
+    assert threads != [threading.current_thread()]
+    assert store.get(session.id) is None
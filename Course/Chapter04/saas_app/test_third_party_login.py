@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+
+from github_client import GitHubClient
+from third_party_login import GitHubIdentityCache
+
+
+def stub_github(calls: list) -> GitHubClient:
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        # Slow enough for concurrent lookups to overlap.
+        await asyncio.sleep(0.01)
+        if request.headers["Authorization"] == "Bearer gho_john":
+            return httpx.Response(200, json={"login": "johndoe"})
+        if request.headers["Authorization"] == "Bearer gho_mail":
+            return httpx.Response(
+                200,
+                json={"login": "unknown", "email": "mcourtney@email.com"},
+            )
+        return httpx.Response(401)
+
+    return GitHubClient(
+        api_url="http://api.github.test",
+        transport=httpx.MockTransport(handler),
+    )
+
+
+@pytest.mark.asyncio
+async def test_identities_are_cached(fill_database_session, async_session_factory):
+    calls = []
+    github = stub_github(calls)
+    cache = GitHubIdentityCache()
+    user = await cache.resolve("Bearer gho_john", async_session_factory, github)
+    assert user.username == "johndoe"
+    # Repeat visit: no call to GitHub.
+    assert (
+        await cache.resolve("Bearer gho_john", async_session_factory, github)
+        == user
+    )
+    assert len(calls) == 1
+    # Found by email.
+    user = await cache.resolve("Bearer gho_mail", async_session_factory, github)
+    assert user.username == "manucourtney"
+    # Rejected tokens are cached too.
+    for _ in range(2):
+        assert (
+            await cache.resolve("Bearer bad", async_session_factory, github)
+            is None
+        )
+    assert len(calls) == 3
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+    assert stats["hit_rate"] == 2 / 5
+    assert stats["upstream_calls"] == 3
+    # A change to the user drops their tokens.
+    cache.invalidate_user(user.id)
+    await cache.resolve("Bearer gho_mail", async_session_factory, github)
+    assert len(calls) == 4
+    await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_are_coalesced(
+    fill_database_session, async_session_factory
+):
+    calls = []
+    github = stub_github(calls)
+    cache = GitHubIdentityCache()
+    users = await asyncio.gather(
+        *(
+            cache.resolve("Bearer gho_john", async_session_factory, github)
+            for _ in range(5)
+        )
+    )
+    assert {user.username for user in users} == {"johndoe"}
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+    await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_shared_lookup_survives_the_first_request(
+    fill_database_session, async_session_factory
+):
+    calls = []
+    github = stub_github(calls)
+    cache = GitHubIdentityCache()
+    first = asyncio.ensure_future(
+        cache.resolve("Bearer gho_john", async_session_factory, github)
+    )
+    second = asyncio.ensure_future(
+        cache.resolve("Bearer gho_john", async_session_factory, github)
+    )
+    await asyncio.sleep(0)
+    # The request that started the lookup goes away.
+    first.cancel()
+    assert (await second).username == "johndoe"
+    assert len(calls) == 1
+    await github.aclose()
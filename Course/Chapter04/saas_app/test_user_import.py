@@ -0,0 +1,133 @@
+import io
+from unittest.mock import patch
+
+from models import User
+from operations import add_user, get_user
+from password_hashing import pwd_context
+from user_import import (
+    ImportReport,
+    RowError,
+    _insert,
+    _validate,
+    import_users,
+    read_rows,
+)
+
+HASH = pwd_context.hash("password")
+
+
+def fake_hasher(calls: list):
+    def hash_many(passwords: list[str]) -> list[str]:
+        calls.append(passwords)
+        return [HASH] * len(passwords)
+
+    return hash_many
+
+
+CSV = """username,email,password,hashed_password,role
+alice,alice@email.com,pass1,,
+bob,bob@email.com,,{hash},premium
+johndoe,other@email.com,pass3,,
+carol,johndoe@email.com,pass4,,
+alice,alice2@email.com,pass5,,
+dave,not-an-email,pass6,,
+erin,erin@email.com,,,
+frank,frank@email.com,pass8,,owner
+grace,grace@email.com,pass9,,
+""".format(hash=HASH)
+
+
+def test_import_csv(fill_database_session):
+    session = fill_database_session
+    calls = []
+    report = import_users(
+        session,
+        read_rows(io.StringIO(CSV), "csv"),
+        fake_hasher(calls),
+        batch_size=3,
+    )
+    assert report.imported == 3
+    assert report.errors == [
+        RowError(4, "johndoe", "username taken"),
+        RowError(5, "carol", "email taken"),
+        RowError(6, "alice", "username taken"),
+        RowError(7, "dave", "invalid email"),
+        RowError(8, "erin", "missing password"),
+        RowError(9, "frank", "unknown role"),
+    ]
+    # Only the accepted rows without a hash were hashed, batch by batch.
+    assert calls == [["pass1"], ["pass9"]]
+    assert get_user(session, "bob").role == "premium"
+    assert get_user(session, "grace@email.com").hashed_password == HASH
+
+
+def test_import_ndjson(session):
+    lines = [
+        '{"username": "alice", "email": "alice@email.com", "password": "p"}',
+        "",
+        "not json",
+        "[1, 2]",
+        '{"username": 3, "email": "x@email.com", "password": "p"}',
+        # Shaped like an email, but refused at registration.
+        '{"username": "bob", "email": "bob smith@email.com", "password": "p"}',
+    ]
+    report = import_users(
+        session, read_rows(iter(lines), "ndjson"), fake_hasher([])
+    )
+    assert report.imported == 1
+    assert report.errors == [
+        RowError(3, None, "invalid JSON"),
+        RowError(4, None, "not an object"),
+        RowError(5, None, "missing username"),
+        RowError(6, "bob", "invalid email"),
+    ]
+
+
+def test_conflicts_found_at_insert_time(session):
+    # A user registered while the batch is being hashed.
+    def hash_many(passwords):
+        add_user(session, "bob", "pass", "bob@email.com")
+        return [HASH] * len(passwords)
+
+    rows = [
+        (2, {"username": "alice", "email": "a@email.com", "password": "p"}),
+        (3, {"username": "bob", "email": "b@email.com", "password": "p"}),
+    ]
+    report = import_users(session, rows, hash_many)
+    assert report.imported == 1
+    assert report.errors == [RowError(3, "bob", "already exists")]
+    assert get_user(session, "alice") is not None
+
+
+def test_taken_values_looked_up_in_chunks(session):
+    add_user(session, "zed", "pass", "zed@email.com")
+    rows = [
+        (line, {"username": name, "email": f"{name}@x.com", "password": "p"})
+        for line, name in enumerate(["a", "b", "c", "d", "zed"], 2)
+    ]
+    with patch("user_import.TAKEN_LOOKUP_CHUNK", 2):
+        report = import_users(session, rows, fake_hasher([]))
+    assert report.imported == 4
+    assert report.errors == [RowError(6, "zed", "username taken")]
+
+
+def test_insert_isolates_duplicates_of_the_batch(session):
+    # Two rows of the same batch with the same username: the batch insert
+    # fails, and the rows are inserted again one by one.
+    rows = [
+        _validate(
+            line,
+            {"username": name, "email": email, "hashed_password": HASH},
+        )
+        for line, name, email in [
+            (2, "alice", "a@email.com"),
+            (3, "alice", "b@email.com"),
+            (4, "bob", "c@email.com"),
+        ]
+    ]
+    report = ImportReport()
+    _insert(session, rows, report)
+    assert report.imported == 2
+    assert report.errors == [RowError(3, "alice", "already exists")]
+    assert session.query(User).count() == 2
+    assert get_user(session, "alice").email == "a@email.com"
@@ -1,14 +1,19 @@
+import asyncio
 import os
+import time
+from weakref import WeakKeyDictionary
 
-import httpx
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from dotenv import load_dotenv
 
-from db_connection import get_session
-from models import User
-from operations import get_user
+from db_connection import get_async_session_factory
+from github_client import GITHUB_URL, GitHubClient, get_github_client
+from operations import get_user_async
+from security import AuthenticatedUser
+from token_cache import TokenCache, token_digest
+from user_lookup import user_change_listeners
 
 # Load environment variables from a .env file.
 load_dotenv()
@@ -21,32 +26,154 @@ GITHUB_REDIRECT_URI = (
     "http://localhost:8000/github/auth/token"
 )
 # The GitHub URL to redirect users to for authorization.
-GITHUB_AUTHORIZATION_URL = (
-    "https://github.com/login/oauth/authorize"
+GITHUB_AUTHORIZATION_URL = f"{GITHUB_URL}/login/oauth/authorize"
+
+# GitHub identities already resolved: access token -> local user, so repeat
+# visits make neither the call to GitHub nor the database queries.
+# - entries expire after GITHUB_TOKEN_CACHE_TTL seconds (a token revoked on
+#   GitHub is still accepted until then);
+# - rejected tokens are remembered for GITHUB_NEGATIVE_CACHE_TTL seconds, so a
+#   client retrying a bad token does not reach GitHub every time. Keep it short:
+#   the token of a user who registers meanwhile stays rejected until then;
+# - concurrent lookups of the same token share a single call to GitHub.
+GITHUB_TOKEN_CACHE_SIZE = int(os.getenv("GITHUB_TOKEN_CACHE_SIZE", "4096"))
+GITHUB_TOKEN_CACHE_TTL = float(os.getenv("GITHUB_TOKEN_CACHE_TTL", "300"))
+GITHUB_NEGATIVE_CACHE_TTL = float(
+    os.getenv("GITHUB_NEGATIVE_CACHE_TTL", "30")
 )
 
+# Cached value of a rejected token.
+REJECTED = "rejected"
+
+
+class GitHubIdentityCache:
+    def __init__(
+        self,
+        maxsize: int = GITHUB_TOKEN_CACHE_SIZE,
+        ttl: float = GITHUB_TOKEN_CACHE_TTL,
+        negative_ttl: float = GITHUB_NEGATIVE_CACHE_TTL,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = TokenCache(maxsize=maxsize)
+        # Lookups in progress, per event loop: token digest -> task.
+        self._lookups: WeakKeyDictionary = WeakKeyDictionary()
+        self.coalesced = 0
+        self.upstream_calls = 0
+
+    async def _lookup(
+        self,
+        access_token: str,
+        sessions: async_sessionmaker[AsyncSession],
+        github,
+    ) -> AuthenticatedUser | None:
+        invalidations = self.cache.invalidations
+        self.upstream_calls += 1
+        # Query the GitHub API to get user details using the provided access token.
+        user_response = await github.get_user(access_token)
+        # The lookup is shared by all the requests waiting for this token, and
+        # may outlive the one that started it: it uses its own session.
+        async with sessions() as session:
+            # Attempt to find the user in the local database by their GitHub username (login).
+            username = user_response.get("login") or " "
+            user = await get_user_async(session, username)
+            # If not found by username, try to find the user by their email address.
+            if not user:
+                email = user_response.get("email") or " "
+                user = await get_user_async(session, email)
+        if not user:
+            self.cache.set(
+                access_token,
+                REJECTED,
+                expires_at=time.time() + self.negative_ttl,
+                tag=None,
+                invalidations=invalidations,
+            )
+            return
+        user = AuthenticatedUser(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+        )
+        self.cache.set(
+            access_token,
+            user,
+            expires_at=time.time() + self.ttl,
+            tag=user.id,
+            invalidations=invalidations,
+        )
+        return user
+
+    async def resolve(
+        self,
+        access_token: str,
+        sessions: async_sessionmaker[AsyncSession],
+        github,
+    ) -> AuthenticatedUser | None:
+        cached = self.cache.get(access_token)
+        if cached is not None:
+            return None if cached is REJECTED else cached
+        lookups = self._lookups.setdefault(
+            asyncio.get_running_loop(), {}
+        )
+        digest = token_digest(access_token)
+        task = lookups.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._lookup(access_token, sessions, github)
+            )
+            lookups[digest] = task
+            task.add_done_callback(
+                lambda _: lookups.pop(digest, None)
+            )
+        else:
+            self.coalesced += 1
+        # shield(): a cancelled request does not cancel the lookup that the
+        # other requests are waiting for.
+        return await asyncio.shield(task)
+
+    def invalidate_user(self, user_id: int):
+        self.cache.invalidate_tag(user_id)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+        }
+
+
+github_identity_cache = GitHubIdentityCache()
+
+# A committed change to a user (e.g. a deletion) drops their cached tokens.
+user_change_listeners.append(github_identity_cache.invalidate_user)
+
+
 # Dependency to resolve a user from a GitHub access token.
-def resolve_github_token(
+async def resolve_github_token(
     # Depends(OAuth2()) is used here to extract the token from the request.
     access_token: str = Depends(OAuth2()),
-    session: Session = Depends(get_session),
-) -> User:
-    # Query the GitHub API to get user details using the provided access token.
-    user_response = httpx.get(
-        "https://api.github.com/user",
-        headers={"Authorization": access_token},
-    ).json()
-    # Attempt to find the user in the local database by their GitHub username (login).
-    username = user_response.get("login", " ")
-    user = get_user(session, username)
-    # If not found by username, try to find the user by their email address.
-    if not user:
-        email = user_response.get("email", " ")
-        user = get_user(session, email)
+    sessions: async_sessionmaker[AsyncSession] = Depends(
+        get_async_session_factory
+    ),
+    github: GitHubClient = Depends(get_github_client),
+) -> AuthenticatedUser:
+    # The shared client reuses its connections to GitHub, and tokens seen
+    # recently are answered from the cache without calling it at all.
+    user = await github_identity_cache.resolve(
+        access_token, sessions, github
+    )
     # Process user_response to log
     # the user in or create a new account
 
-    # If the user is still not found in the local DB, raise a 403 Forbidden error.
+    # If the user is not found in the local DB, raise a 403 Forbidden error.
     if not user:
         raise HTTPException(
             status_code=403, detail="Token not valid"
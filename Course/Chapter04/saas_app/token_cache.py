@@ -0,0 +1,122 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+def token_digest(token: str) -> bytes:
+    # Tokens are credentials: the cache keeps their SHA-256 digest, never the
+    # tokens themselves.
+    return hashlib.sha256(token.encode()).digest()
+
+
+# Bounded cache of verified tokens.
+# Each entry expires at its own time (the 'exp' claim of the token), and once
+# 'maxsize' entries are stored, the least recently used one is evicted. Entries
+# are tagged (e.g. with the id of the user of the token), so that all the
+# tokens of a user are dropped at once when the user changes.
+class TokenCache:
+    def __init__(
+        self,
+        maxsize: int = 4096,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        # digest -> (expiry timestamp, tag, value), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        # tag -> digests of the entries with that tag
+        self._tags: dict[Hashable, set[bytes]] = {}
+        self.hits = 0
+        self.misses = 0
+        # Number of invalidations so far, see set().
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _discard(self, digest: bytes):
+        _, tag, _ = self._entries.pop(digest)
+        digests = self._tags[tag]
+        digests.discard(digest)
+        if not digests:
+            del self._tags[tag]
+
+    def get(self, token: str):
+        digest = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] <= self._clock():
+                self._discard(digest)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[2]
+
+    def peek(self, token: str):
+        # Like get(), without counting a hit or a miss, nor making the entry
+        # the most recently used: for callers that only want to know whether
+        # the token was verified (e.g. the rate limits of main.py).
+        digest = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+        if entry is None or entry[0] <= self._clock():
+            return None
+        return entry[2]
+
+    def discard(self, token: str):
+        digest = token_digest(token)
+        with self._lock:
+            if digest in self._entries:
+                self._discard(digest)
+
+    def set(
+        self,
+        token: str,
+        value,
+        expires_at: float,
+        tag: Hashable,
+        invalidations: Optional[int] = None,
+    ):
+        # 'invalidations' is the value of the counter read before loading
+        # 'value'. If an invalidation happened since, the value may already be
+        # stale, so it is not cached.
+        digest = token_digest(token)
+        with self._lock:
+            if (
+                invalidations is not None
+                and invalidations != self.invalidations
+            ):
+                return
+            if digest in self._entries:
+                self._discard(digest)
+            self._entries[digest] = (expires_at, tag, value)
+            self._tags.setdefault(tag, set()).add(digest)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_tag(self, tag: Hashable):
+        with self._lock:
+            self.invalidations += 1
+            for digest in list(self._tags.get(tag, ())):
+                self._discard(digest)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
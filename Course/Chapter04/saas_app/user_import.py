@@ -0,0 +1,375 @@
+"""
+Bulk import of users, from CSV or NDJSON (one JSON object per line), through
+POST /import/users or from the command line:
+
+    $ python user_import.py users.csv
+    $ python user_import.py users.ndjson --batch-size 2000 --workers 16
+"""
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+from fastapi import APIRouter, Depends, UploadFile, status
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from db_connection import get_engine, get_session, get_sessionmaker
+from models import Base, Role, User
+from password_hashing import hash_password, pwd_context
+from permissions import Permission, Principal, permission_table
+from rbac import authorize
+
+
+IMPORT_BATCH_SIZE = int(os.getenv("USER_IMPORT_BATCH_SIZE", "1000"))
+# Rows looked up per query when checking the taken usernames and emails: two
+# bound parameters per row, well under the limit of SQLite (999 before 3.32).
+TAKEN_LOOKUP_CHUNK = 400
+# Processes hashing the passwords of an import. The server keeps them apart
+# from the pool of the password hashing service, so that logins do not queue
+# behind an import.
+USER_IMPORT_WORKERS = int(
+    os.getenv(
+        "USER_IMPORT_WORKERS", str(max((os.cpu_count() or 1) // 2, 1))
+    )
+)
+
+# Emails are validated like at registration (UserCreateBody.email), and
+# stored as normalized by the validator.
+_email_adapter = TypeAdapter(EmailStr)
+
+
+@dataclass
+class RowError:
+    line: int
+    username: Optional[str]
+    reason: str
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    errors: list[RowError] = field(default_factory=list)
+
+
+@dataclass
+class _Row:
+    line: int
+    username: str
+    email: str
+    role: Role
+    password: Optional[str] = None
+    hashed_password: Optional[str] = None
+
+
+def read_rows(
+    lines: Iterable[str], format: str
+) -> Iterator[tuple[int, object]]:
+    # Yields (line number, row as a dict), or (line number, error message)
+    # for lines that cannot be parsed.
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == "ndjson":
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, "invalid JSON"
+                continue
+            yield number, row if isinstance(row, dict) else "not an object"
+    else:
+        raise ValueError(f"unknown format: {format}")
+
+
+def _text(row: dict, key: str) -> str:
+    value = row.get(key)
+    return value if isinstance(value, str) else ""
+
+
+# A row has a username, an email, an optional role, and either a plain text
+# password or an existing bcrypt hash ("hashed_password", kept as is).
+def _validate(line: int, row) -> _Row | RowError:
+    if isinstance(row, str):
+        return RowError(line, None, row)
+    username = _text(row, "username").strip()
+    email = _text(row, "email").strip()
+    password = _text(row, "password") or None
+    hashed_password = _text(row, "hashed_password") or None
+    if not username:
+        return RowError(line, None, "missing username")
+    try:
+        email = _email_adapter.validate_python(email)
+    except ValidationError:
+        return RowError(line, username, "invalid email")
+    if hashed_password is not None:
+        # Only hashes the app can verify are kept.
+        if pwd_context.identify(hashed_password) is None:
+            return RowError(line, username, "unknown password hash")
+    elif not password:
+        return RowError(line, username, "missing password")
+    try:
+        role = Role(_text(row, "role") or Role.basic)
+    except ValueError:
+        return RowError(line, username, "unknown role")
+    return _Row(line, username, email, role, password, hashed_password)
+
+
+def _taken(session: Session, rows: list[_Row]) -> tuple[set, set]:
+    usernames, emails = set(), set()
+    for start in range(0, len(rows), TAKEN_LOOKUP_CHUNK):
+        chunk = rows[start:start + TAKEN_LOOKUP_CHUNK]
+        taken = session.execute(
+            select(User.username, User.email).where(
+                or_(
+                    User.username.in_([row.username for row in chunk]),
+                    User.email.in_([row.email for row in chunk]),
+                )
+            )
+        ).all()
+        usernames.update(username for username, _ in taken)
+        emails.update(email for _, email in taken)
+    return usernames, emails
+
+
+def _values(row: _Row) -> dict:
+    return {
+        "username": row.username,
+        "email": row.email,
+        "hashed_password": row.hashed_password,
+        "role": row.role,
+    }
+
+
+def _commit_new_users(session: Session):
+    # The users are inserted without the ORM objects: flag them for the
+    # events of user_lookup.py, which empty the identity map on commit.
+    session.info["new_users"] = True
+    session.commit()
+
+
+def _insert(session: Session, rows: list[_Row], report: ImportReport):
+    try:
+        session.execute(insert(User), [_values(row) for row in rows])
+        _commit_new_users(session)
+        report.imported += len(rows)
+        return
+    except IntegrityError:
+        session.rollback()
+    # Fallback: one transaction per row, to isolate the conflicts. Not
+    # savepoints, which pysqlite only supports with extra event hooks.
+    for row in rows:
+        try:
+            session.execute(insert(User), [_values(row)])
+            _commit_new_users(session)
+        except IntegrityError:
+            session.rollback()
+            report.errors.append(
+                RowError(row.line, row.username, "already exists")
+            )
+        else:
+            report.imported += 1
+
+
+# Rows are streamed in batches. For each batch: invalid rows and taken values
+# (in the database or earlier in the file) are reported and skipped, the
+# passwords are hashed in parallel, and the rows are inserted with a single
+# executemany and one commit. A conflict only skips its row, never the batch.
+def import_users(
+    session: Session,
+    rows: Iterable[tuple[int, object]],
+    hash_many: Callable[[list[str]], list[str]],
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> ImportReport:
+    report = ImportReport()
+    # Values seen earlier in the file.
+    seen_usernames: set[str] = set()
+    seen_emails: set[str] = set()
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        valid = []
+        for line, row in batch:
+            row = _validate(line, row)
+            if isinstance(row, RowError):
+                report.errors.append(row)
+            else:
+                valid.append(row)
+        if not valid:
+            continue
+        taken_usernames, taken_emails = _taken(session, valid)
+        accepted = []
+        for row in valid:
+            if (
+                row.username in taken_usernames
+                or row.username in seen_usernames
+            ):
+                report.errors.append(
+                    RowError(row.line, row.username, "username taken")
+                )
+            elif row.email in taken_emails or row.email in seen_emails:
+                report.errors.append(
+                    RowError(row.line, row.username, "email taken")
+                )
+            else:
+                seen_usernames.add(row.username)
+                seen_emails.add(row.email)
+                accepted.append(row)
+        to_hash = [row for row in accepted if row.hashed_password is None]
+        if to_hash:
+            for row, hashed in zip(
+                to_hash, hash_many([row.password for row in to_hash])
+            ):
+                row.hashed_password = hashed
+        if accepted:
+            _insert(session, accepted, report)
+    report.errors.sort(key=lambda error: error.line)
+    return report
+
+
+def process_hasher(
+    executor: Executor, workers: int
+) -> Callable[[list[str]], list[str]]:
+    # Hash a batch across the processes of 'executor', sending the passwords
+    # in a few chunks per process rather than one by one.
+    def hash_many(passwords: list[str]) -> list[str]:
+        chunksize = max(len(passwords) // (workers * 4), 1)
+        return list(
+            executor.map(hash_password, passwords, chunksize=chunksize)
+        )
+
+    return hash_many
+
+
+def import_executor(
+    workers: int = USER_IMPORT_WORKERS,
+) -> ProcessPoolExecutor:
+    method = (
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context(method)
+    )
+
+
+# Lines of an uploaded file, decoded as they are read.
+def text_lines(binary) -> io.TextIOWrapper:
+    return io.TextIOWrapper(binary, encoding="utf-8", newline="")
+
+
+def guess_format(filename: str) -> str:
+    return "ndjson" if filename.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+# Processes of the imports made through the endpoint, started on first use
+# and stopped by the lifespan of the app.
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_import_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = import_executor()
+    return _executor
+
+
+def shutdown():
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+router = APIRouter(tags=["User Import"])
+
+
+@router.post(
+    "/import/users",
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User not authorized"
+        },
+    },
+)
+@permission_table.require(Permission.import_users)
+async def import_users_file(
+    file: UploadFile,
+    # Guessed from the file name when omitted.
+    format: Optional[str] = None,
+    principal: Principal = Depends(authorize),
+    session: Session = Depends(get_session),
+):
+    # The upload is spooled to a temporary file by Starlette and read line by
+    # line: the whole file is never held in memory. The import itself runs in
+    # the threadpool, the hashing in the processes of the import executor.
+    rows = read_rows(
+        text_lines(file.file), format or guess_format(file.filename or "")
+    )
+    report = await run_in_threadpool(
+        import_users,
+        session,
+        rows,
+        process_hasher(get_import_executor(), USER_IMPORT_WORKERS),
+    )
+    return asdict(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import users from a CSV or NDJSON file."
+    )
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=("csv", "ndjson"))
+    parser.add_argument(
+        "--batch-size", type=int, default=IMPORT_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1
+    )
+    arguments = parser.parse_args()
+
+    Base.metadata.create_all(bind=get_engine())
+    format = arguments.format or guess_format(arguments.file)
+    started = time.perf_counter()
+    with (
+        open(arguments.file, newline="", encoding="utf-8") as lines,
+        import_executor(arguments.workers) as executor,
+        get_sessionmaker()() as session,
+    ):
+        report = import_users(
+            session,
+            read_rows(lines, format),
+            process_hasher(executor, arguments.workers),
+            arguments.batch_size,
+        )
+    elapsed = time.perf_counter() - started
+    for error in report.errors:
+        print(
+            f"line {error.line}: {error.username or '-'}: {error.reason}",
+            file=sys.stderr,
+        )
+    print(
+        f"{report.imported} users imported, {len(report.errors)} rows "
+        f"skipped in {elapsed:.1f}s "
+        f"({report.imported / elapsed:.0f} users/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
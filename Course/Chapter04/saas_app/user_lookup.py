@@ -0,0 +1,204 @@
+"""
+Lookup of a user by username or by email in a single query, shared by
+operations.get_user() and security.authenticate_user(), with an optional
+in-memory identity map of the users found.
+"""
+
+import os
+import time
+from typing import Callable
+
+from sqlalchemy import Select, event, inspect, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import User
+from token_cache import TokenCache
+
+
+# Number of users kept in the identity map, 0 disables it. Entries expire
+# after USER_IDENTITY_MAP_TTL seconds, and as soon as the user is modified
+# through this process. With several server processes, a change made by another
+# one is only seen after the TTL: keep it short, or disabled.
+USER_IDENTITY_MAP_SIZE = int(os.getenv("USER_IDENTITY_MAP_SIZE", "0"))
+USER_IDENTITY_MAP_TTL = float(os.getenv("USER_IDENTITY_MAP_TTL", "60"))
+
+identity_map = TokenCache(maxsize=USER_IDENTITY_MAP_SIZE)
+
+# Functions called with the id of every user modified or deleted, once the
+# transaction is committed (e.g. to drop cached tokens in security.py).
+user_change_listeners: list[Callable[[int], None]] = []
+# Functions called with the id of every user whose access changed (username,
+# email, role or password) or who was deleted, once the transaction commits
+# (e.g. to end their sessions in session_store.py). A new TOTP secret does not.
+user_access_listeners: list[Callable[[int], None]] = []
+ACCESS_COLUMNS = ("username", "email", "role", "hashed_password")
+
+
+def looks_like_email(value: str) -> bool:
+    # Only the shape is checked: "local@domain.tld". Real validation happens
+    # at registration, through the EmailStr fields of the request models.
+    local, at, domain = value.rpartition("@")
+    return bool(at and local and "." in domain.strip("."))
+
+
+def _columns(user: User) -> dict:
+    return {
+        column.key: getattr(user, column.key)
+        for column in User.__mapper__.column_attrs
+    }
+
+
+def _cached_user(session: Session, username_or_email: str):
+    columns = identity_map.get(username_or_email)
+    if columns is None:
+        return None, None
+    user = session.identity_map.get(
+        session.identity_key(User, columns["id"])
+    )
+    if user is not None:
+        return user, None
+    # Attach a copy of the cached row to the session without querying it:
+    # the object is then like any loaded user, and can be modified.
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return None, user
+
+
+# One query on both columns, which SQLite answers with a lookup in each of the
+# two unique indexes ("MULTI-INDEX OR"): no need to tell an email from a
+# username beforehand (email_validator was slow, and could query the DNS).
+def _lookup(username_or_email: str) -> Select:
+    return (
+        select(User)
+        .where(
+            or_(
+                User.username == username_or_email,
+                User.email == username_or_email,
+            )
+        )
+        .limit(2)
+    )
+
+
+# When the value is the username of a user and the email of another, its
+# shape decides which one wins.
+def _pick(users: list[User], username_or_email: str) -> User | None:
+    if not users:
+        return None
+    if len(users) == 1:
+        return users[0]
+    prefer_email = looks_like_email(username_or_email)
+    return next(
+        candidate
+        for candidate in users
+        if (candidate.email == username_or_email) == prefer_email
+    )
+
+
+def _remember(user: User, username_or_email: str, invalidations: int):
+    identity_map.set(
+        username_or_email,
+        _columns(user),
+        expires_at=time.time() + USER_IDENTITY_MAP_TTL,
+        tag=user.id,
+        invalidations=invalidations,
+    )
+
+
+def find_user(
+    session: Session, username_or_email: str
+) -> User | None:
+    if identity_map.maxsize:
+        user, detached = _cached_user(session, username_or_email)
+        if user is not None:
+            return user
+        if detached is not None:
+            return session.merge(detached, load=False)
+        invalidations = identity_map.invalidations
+    user = _pick(
+        session.scalars(_lookup(username_or_email)).all(),
+        username_or_email,
+    )
+    if user is not None and identity_map.maxsize:
+        _remember(user, username_or_email, invalidations)
+    return user
+
+
+async def find_user_async(
+    session: AsyncSession, username_or_email: str
+) -> User | None:
+    if identity_map.maxsize:
+        user, detached = _cached_user(
+            session.sync_session, username_or_email
+        )
+        if user is not None:
+            return user
+        if detached is not None:
+            return await session.merge(detached, load=False)
+        invalidations = identity_map.invalidations
+    user = _pick(
+        (await session.scalars(_lookup(username_or_email))).all(),
+        username_or_email,
+    )
+    if user is not None and identity_map.maxsize:
+        _remember(user, username_or_email, invalidations)
+    return user
+
+
+def invalidate_user(user_id: int):
+    identity_map.invalidate_tag(user_id)
+    for listener in user_change_listeners:
+        listener(user_id)
+
+
+# Any change to a user row (role, TOTP secret, password...) or its deletion
+# is reported once the transaction commits. Changes committed through an
+# AsyncSession go through its underlying Session, so they are reported too.
+@event.listens_for(User, "after_update")
+def _remember_changed_user(mapper, connection, target: User):
+    session = Session.object_session(target)
+    if session is None:
+        return
+    session.info.setdefault("changed_users", set()).add(target.id)
+    attributes = inspect(target).attrs
+    if any(
+        attributes[column].history.has_changes()
+        for column in ACCESS_COLUMNS
+    ):
+        session.info.setdefault("revoked_users", set()).add(target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _remember_deleted_user(mapper, connection, target: User):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+        session.info.setdefault("revoked_users", set()).add(target.id)
+
+
+# A new user can take, as username, a value cached as the email of another
+# user (or the opposite), so the identity map is emptied when users are added.
+@event.listens_for(User, "after_insert")
+def _remember_new_user(mapper, connection, target: User):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["new_users"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session: Session):
+    if session.info.pop("new_users", False):
+        identity_map.clear()
+    for user_id in session.info.pop("changed_users", ()):
+        invalidate_user(user_id)
+    for user_id in session.info.pop("revoked_users", ()):
+        for listener in user_access_listeners:
+            listener(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session: Session):
+    session.info.pop("new_users", None)
+    session.info.pop("changed_users", None)
+    session.info.pop("revoked_users", None)
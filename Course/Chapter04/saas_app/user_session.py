@@ -1,45 +1,64 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Response
-from sqlalchemy.orm import Session
 
-from db_connection import get_session
-from operations import get_user
-from rbac import get_current_user
-from responses import UserCreateResponse
+from rbac import get_authenticated_user
+from security import AuthenticatedUser
+from session_store import (
+    SESSION_COOKIE_NAME,
+    SESSION_COOKIE_SECURE,
+    UserSession,
+    get_user_session,
+    session_store,
+    sign_session_id,
+)
 
 router = APIRouter(tags=["User Session Management"])
 
 
-# Endpoint to simulate a login session by setting a cookie.
-# Note: The user must already be authenticated via the 'get_current_user' dependency.
+# Endpoint to open a login session by setting a cookie.
+# Note: The user must already be authenticated via the 'get_authenticated_user' dependency.
+# Plain functions: the session store may be a SQLite file, which FastAPI then
+# queries from its thread pool instead of the event loop.
 @router.post("/login")
-async def login(
+def login(
     response: Response,
-    user: UserCreateResponse = Depends(
-        get_current_user
+    # The authenticated user already holds the id of the user,
+    # no need to query the database again.
+    user: AuthenticatedUser = Depends(
+        get_authenticated_user
     ),
-    session: Session = Depends(get_session),
 ):
-    # Retrieve the full user record from the database using the username from the token.
-    user = get_user(session, user.username)
-
-    # Set a cookie named "fakesession" with the user's ID.
-    # In a real application, this would be a secure, signed session ID.
+    # The session is kept on the server (see session_store.py), the cookie
+    # only holds its signed, opaque id. Later requests with the cookie are
+    # authenticated with one lookup in the session store.
+    user_session = session_store.create(user)
     response.set_cookie(
-        key="fakesession", value=f"{user.id}"
+        key=SESSION_COOKIE_NAME,
+        value=sign_session_id(user_session.id),
+        httponly=True,
+        secure=SESSION_COOKIE_SECURE,
+        samesite="lax",
     )
     return {"message": "User logged in successfully"}
 
 
-# Endpoint to log out the user by clearing the session cookie.
+# Endpoint to log out the user by ending the session and clearing its cookie.
 @router.post("/logout")
-async def logout(
+def logout(
     response: Response,
-    user: UserCreateResponse = Depends(
-        get_current_user
+    user: AuthenticatedUser = Depends(
+        get_authenticated_user
     ),
+    user_session: Optional[UserSession] = Depends(get_user_session),
 ):
-    # Delete the "fakesession" cookie to invalidate the session.
+    if user_session is not None:
+        session_store.delete(user_session.id)
+    # Delete the session cookie.
     response.delete_cookie(
-        "fakesession"
-    )  # Clear session data
-    return {"message": "User logged out successfully"}
\ No newline at end of file
+        SESSION_COOKIE_NAME,
+        httponly=True,
+        secure=SESSION_COOKIE_SECURE,
+        samesite="lax",
+    )
+    return {"message": "User logged out successfully"}
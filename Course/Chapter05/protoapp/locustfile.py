@@ -2,7 +2,7 @@ from locust import HttpUser, task
 
 """
 You need to run in two separated terminals the following commands:
-Terminal1: $ uvicorn protoapp.main:app
+Terminal1: $ RATE_LIMIT_API=1000000/minute RATE_LIMIT_API_BURST=100000 uvicorn protoapp.main:app
 Terminal2: $ locust
 
 Open your browser and navigate to http://localhost:8089 to access the web interface of the application.
@@ -13,6 +13,8 @@ during peak usage.
 increasing traffic.
 After configuring these parameters, click the Start button to initiate a simulation that generates traffic
 to the protoapp via the /home endpoint defined in the locustfile.py.
+The simulated users all come from the same IP: the rate limits of the app are
+raised above, or most of their requests get "429 Too Many Requests".
 Alternatively, you can simulate traffic using the command line. Here’s how:
     $ locust --headless --users 10 --spawn-rate 1
 This command runs Locust in a headless mode to simulate:
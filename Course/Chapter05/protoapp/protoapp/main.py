@@ -1,3 +1,5 @@
+import os
+
 from fastapi import (
     FastAPI,
     Depends,
@@ -10,10 +12,46 @@ from sqlalchemy.orm import Session
 
 from protoapp.logging import client_logger
 from protoapp.database import SessionLocal, Item
+from protoapp.rate_limit import (
+    RateLimit,
+    RateLimitMiddleware,
+    TokenBucket,
+    by_ip,
+    create_rate_limit_store,
+    parse_rate,
+)
 
 # To run this: $ uvicorn protoapp.main:app --reload
 app = FastAPI()
 
+# Admission control (see rate_limit.py): every request takes a token from the
+# bucket of its IP, and the writes to the database are limited further.
+# Raise RATE_LIMIT_API for load tests, all the Locust users share one IP.
+RATE_LIMIT_API = os.getenv("RATE_LIMIT_API", "600/minute")
+RATE_LIMIT_API_BURST = int(os.getenv("RATE_LIMIT_API_BURST", "100"))
+RATE_LIMIT_WRITES = os.getenv("RATE_LIMIT_WRITES", "60/minute")
+rate_limit_store = create_rate_limit_store()
+app.add_middleware(
+    RateLimitMiddleware,
+    rules=[
+        RateLimit(
+            "api",
+            TokenBucket(
+                *parse_rate(RATE_LIMIT_API), burst=RATE_LIMIT_API_BURST
+            ),
+            by_ip,
+        ),
+        RateLimit(
+            "writes",
+            TokenBucket(*parse_rate(RATE_LIMIT_WRITES)),
+            by_ip,
+            paths=("/item",),
+            methods=("POST",),
+        ),
+    ],
+    store=rate_limit_store,
+)
+
 @app.get("/home")
 async def read_main():
     return {"message": "Hello World"}
@@ -0,0 +1,443 @@
+"""
+Rate limiting middleware for any ASGI app (FastAPI, Starlette...):
+
+    app.add_middleware(
+        RateLimitMiddleware,
+        rules=[
+            RateLimit("login", SlidingWindow(10, 60), by_ip, ("/token",)),
+            RateLimit("api", TokenBucket(100, 60, burst=20), by_ip),
+        ],
+        store=create_rate_limit_store(),
+    )
+"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional, Protocol
+
+import anyio
+
+
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_DATABASE_PATH = os.getenv(
+    "RATE_LIMIT_DATABASE_PATH", "rate_limits.db"
+)
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    # "10/minute" -> (10, 60)
+    limit, _, period = rate.partition("/")
+    return int(limit), PERIODS[period.strip()]
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the quota is fully available again.
+    reset: float
+    # Seconds until the next request is allowed, when refused.
+    retry_after: float = 0
+
+
+class SlidingWindow:
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.policy = f"{limit};w={int(period)}"
+        # The state is useless once both windows are over.
+        self.ttl = 2 * period
+
+    def hit(self, state: Optional[list], now: float) -> tuple[list, Decision]:
+        # State: [index of the current window, its count, previous count].
+        window = int(now // self.period)
+        index, count, previous = state or (window, 0, 0)
+        if window != index:
+            previous = count if window == index + 1 else 0
+            count = 0
+        elapsed = now - window * self.period
+        reset = self.period - elapsed
+        # Requests of the previous window still within 'period' seconds.
+        weighted = previous * (1 - elapsed / self.period) + count
+        if weighted + 1 <= self.limit:
+            count += 1
+            return [window, count, previous], Decision(
+                True,
+                self.limit,
+                max(int(self.limit - weighted - 1), 0),
+                reset,
+            )
+        if count + 1 <= self.limit:
+            # Wait for the previous window to weigh less.
+            retry_after = (
+                self.period * (1 - (self.limit - 1 - count) / previous)
+                - elapsed
+            )
+        else:
+            # Wait for the next window, where this one is the previous one.
+            retry_after = reset + self.period * (
+                1 - (self.limit - 1) / count
+            )
+        return [window, count, previous], Decision(
+            False, self.limit, 0, reset, max(retry_after, 0)
+        )
+
+
+class TokenBucket:
+    def __init__(
+        self, limit: int, period: float, burst: Optional[int] = None
+    ):
+        self.limit = limit
+        self.period = period
+        self.burst = burst or limit
+        self.rate = limit / period
+        self.policy = f"{limit};w={int(period)};burst={self.burst}"
+        # A bucket left alone that long is full again.
+        self.ttl = self.burst / self.rate
+
+    def hit(self, state: Optional[list], now: float) -> tuple[list, Decision]:
+        # State: [tokens left, time of the last update].
+        tokens, updated = state or (self.burst, now)
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            return [tokens, now], Decision(
+                True,
+                self.burst,
+                int(tokens),
+                (self.burst - tokens) / self.rate,
+            )
+        return [tokens, now], Decision(
+            False,
+            self.burst,
+            0,
+            (self.burst - tokens) / self.rate,
+            (1 - tokens) / self.rate,
+        )
+
+
+class Algorithm(Protocol):
+    policy: str
+    ttl: float
+
+    def hit(
+        self, state: Optional[list], now: float
+    ) -> tuple[list, Decision]: ...
+
+
+# Stores of the algorithm states: "memory" (one worker) or "sqlite" (all the
+# workers of the machine), selected by RATE_LIMIT_STORE.
+# hit_many() is all or nothing: the states are only saved when every hit is
+# allowed, so a request refused by one rule does not use up the others.
+class RateLimitStore(Protocol):
+    # True if hit_many() does I/O: the middleware then calls it from a thread.
+    blocking: bool
+
+    def hit_many(
+        self, hits: list[tuple[str, Algorithm]], now: float
+    ) -> list[Decision]: ...
+
+    def hit(
+        self, key: str, algorithm: Algorithm, now: float
+    ) -> Decision: ...
+
+    def clear(self): ...
+
+
+class MemoryRateLimitStore:
+    blocking = False
+
+    def __init__(
+        self,
+        shards: int = RATE_LIMIT_SHARDS,
+        max_keys: int = RATE_LIMIT_MAX_KEYS,
+    ):
+        self.max_keys_per_shard = max(max_keys // shards, 1)
+        # Each shard: a lock, and key -> (state, expiration), least recently
+        # updated first. Requests of different keys rarely wait for each other.
+        self._shards = [
+            (threading.Lock(), OrderedDict()) for _ in range(shards)
+        ]
+
+    def _shard(self, key: str) -> tuple[threading.Lock, OrderedDict]:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def hit_many(
+        self, hits: list[tuple[str, Algorithm]], now: float
+    ) -> list[Decision]:
+        shards = [self._shard(key) for key, _ in hits]
+        # The locks of the shards involved, always taken in the same order
+        # (the order of the shards), so two requests never wait for each other.
+        involved = {id(lock) for lock, _ in shards}
+        ordered = [lock for lock, _ in self._shards if id(lock) in involved]
+        for lock in ordered:
+            lock.acquire()
+        try:
+            results = []
+            for (key, algorithm), (_, entries) in zip(hits, shards):
+                state, expires_at = entries.get(key, (None, now))
+                if expires_at < now:
+                    state = None
+                results.append(algorithm.hit(state, now))
+            if all(decision.allowed for _, decision in results):
+                for (key, algorithm), (_, entries), (state, _) in zip(
+                    hits, shards, results
+                ):
+                    entries.pop(key, None)
+                    entries[key] = (state, now + algorithm.ttl)
+                    # The least recently updated keys are dropped first.
+                    while len(entries) > self.max_keys_per_shard:
+                        entries.popitem(last=False)
+        finally:
+            for lock in reversed(ordered):
+                lock.release()
+        return [decision for _, decision in results]
+
+    def hit(self, key: str, algorithm: Algorithm, now: float) -> Decision:
+        return self.hit_many([(key, algorithm)], now)[0]
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _, entries in self._shards)
+
+    def clear(self):
+        for lock, entries in self._shards:
+            with lock:
+                entries.clear()
+
+
+class SQLiteRateLimitStore:
+    blocking = True
+
+    def __init__(
+        self,
+        path: str = RATE_LIMIT_DATABASE_PATH,
+        # Expired keys are purged every 'purge_every' updates.
+        purge_every: int = 1000,
+    ):
+        self.path = path
+        self.purge_every = purge_every
+        self._updates = 0
+        self._updates_lock = threading.Lock()
+        # One connection per thread.
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " expires_at REAL NOT NULL"
+            ")"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS rate_limits_expires_at"
+            " ON rate_limits (expires_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Transactions are opened explicitly, see hit_many().
+            connection = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def hit_many(
+        self, hits: list[tuple[str, Algorithm]], now: float
+    ) -> list[Decision]:
+        connection = self._connection()
+        # BEGIN IMMEDIATE takes the write lock before reading: the workers
+        # update a key one after the other, no request is lost.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            results = []
+            for key, algorithm in hits:
+                row = connection.execute(
+                    "SELECT state FROM rate_limits"
+                    " WHERE key = ? AND expires_at >= ?",
+                    (key, now),
+                ).fetchone()
+                results.append(
+                    algorithm.hit(json.loads(row[0]) if row else None, now)
+                )
+            if all(decision.allowed for _, decision in results):
+                connection.executemany(
+                    "INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?)",
+                    (
+                        (key, json.dumps(state), now + algorithm.ttl)
+                        for (key, algorithm), (state, _) in zip(hits, results)
+                    ),
+                )
+            with self._updates_lock:
+                self._updates += 1
+                purge = self._updates % self.purge_every == 0
+            if purge:
+                connection.execute(
+                    "DELETE FROM rate_limits WHERE expires_at < ?", (now,)
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [decision for _, decision in results]
+
+    def hit(self, key: str, algorithm: Algorithm, now: float) -> Decision:
+        return self.hit_many([(key, algorithm)], now)[0]
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limits")
+
+
+def create_rate_limit_store(
+    kind: str = RATE_LIMIT_STORE,
+) -> RateLimitStore:
+    if kind == "sqlite":
+        return SQLiteRateLimitStore()
+    if kind == "memory":
+        return MemoryRateLimitStore()
+    raise ValueError(f"unknown rate limit store: {kind}")
+
+
+# Key functions: ASGI scope -> key of the client, or None to leave the request
+# out of the rule. They run before the app on every request, so they must not
+# block, and must only return identities the server verified: a client can
+# send a new made-up header with each request, and get a new bucket each time.
+# Behind a proxy, run uvicorn with --proxy-headers so by_ip sees the client.
+KeyFunction = Callable[[dict], Optional[str]]
+
+
+def by_ip(scope: dict) -> Optional[str]:
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else None
+
+
+def first_of(*functions: KeyFunction) -> KeyFunction:
+    def key(scope: dict) -> Optional[str]:
+        for function in functions:
+            value = function(scope)
+            if value is not None:
+                return value
+
+    return key
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    name: str
+    algorithm: Algorithm
+    key: KeyFunction
+    # Paths the rule applies to, with their subpaths. All paths if empty.
+    paths: tuple[str, ...] = ()
+    # Methods the rule applies to. All methods if empty.
+    methods: tuple[str, ...] = ()
+
+    def matches(self, scope: dict) -> bool:
+        if self.methods and scope["method"] not in self.methods:
+            return False
+        if not self.paths:
+            return True
+        path = scope["path"]
+        return any(
+            path == prefix or path.startswith(prefix.rstrip("/") + "/")
+            for prefix in self.paths
+        )
+
+
+class RateLimitMiddleware:
+    def __init__(
+        self,
+        app,
+        rules: Iterable[RateLimit],
+        store: RateLimitStore,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.app = app
+        self.rules = list(rules)
+        self.store = store
+        self._clock = clock
+
+    def check(self, scope: dict) -> Optional[tuple[Decision, str]]:
+        # Decision of the most restrictive rule, with its policy. The request
+        # is counted under "<rule name>:<key>" by every matching rule, or by
+        # none of them if one rule refuses it.
+        hits, policies = [], []
+        for rule in self.rules:
+            if not rule.matches(scope):
+                continue
+            key = rule.key(scope)
+            if key is None:
+                continue
+            hits.append((f"{rule.name}:{key}", rule.algorithm))
+            policies.append(rule.algorithm.policy)
+        if not hits:
+            return None
+        decisions = self.store.hit_many(hits, self._clock())
+        return max(
+            zip(decisions, policies),
+            key=lambda result: (not result[0].allowed, -result[0].remaining),
+        )
+
+    # A refused request gets "429 Too Many Requests" and a Retry-After header
+    # without reaching the app; the others get the RateLimit-* headers of the
+    # most restrictive rule.
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.store.blocking:
+            result = await anyio.to_thread.run_sync(self.check, scope)
+        else:
+            result = self.check(scope)
+        if result is None:
+            await self.app(scope, receive, send)
+            return
+        decision, policy = result
+        headers = [
+            (b"ratelimit-limit", str(decision.limit).encode()),
+            (b"ratelimit-remaining", str(decision.remaining).encode()),
+            (b"ratelimit-reset", str(math.ceil(decision.reset)).encode()),
+            (b"ratelimit-policy", policy.encode()),
+        ]
+        if not decision.allowed:
+            body = b'{"detail":"Too Many Requests"}'
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (
+                            b"retry-after",
+                            str(math.ceil(decision.retry_after)).encode(),
+                        ),
+                        *headers,
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", ()), *headers],
+                }
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
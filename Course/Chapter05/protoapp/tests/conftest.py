@@ -5,7 +5,7 @@ from sqlalchemy.pool import StaticPool
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from protoapp.main import app, get_db_session
+from protoapp.main import app, get_db_session, rate_limit_store
 from protoapp.database import Base
 
 engine = create_engine(
@@ -35,3 +35,10 @@ def test_client(test_db_session):
 
     return client
 
+
+# Each test starts with empty rate limit counters, all the tests making their
+# requests from the same client.
+@pytest.fixture(autouse=True)
+def clear_rate_limits():
+    rate_limit_store.clear()
+    yield
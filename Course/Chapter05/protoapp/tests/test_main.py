@@ -84,3 +84,16 @@ def test_client_can_add_read_the_item_from_database(
         "color": "red",
     }
 
+
+def test_rate_limit(test_client):
+    response = test_client.get("/home")
+    assert response.headers["RateLimit-Limit"] == "100"
+    assert response.headers["RateLimit-Remaining"] == "99"
+    # The bucket holds 100 requests and refills at 10 per second: a client
+    # going faster gets refused, before reaching the endpoint.
+    for _ in range(200):
+        response = test_client.get("/home")
+        if response.status_code != 200:
+            break
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers